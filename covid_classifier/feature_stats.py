@@ -0,0 +1,121 @@
+"""
+One pass streaming statistics (means, variances, correlation) and a consistent feature pruning plan
+"""
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from ingest import TARGET, MANIFEST
+
+class StreamingStats:
+    ''' Exact means, variances and co-moments updated chunk by chunk (Welford/Chan updates).
+        Two accumulators can be merged, so partial results of worker processes are combined
+        into the statistics of the whole file
+    '''
+    def __init__(self,columns):
+        self.columns = list(columns)
+        d = len(self.columns)
+        self.n = 0
+        self.mean = np.zeros(d)
+        self.M2 = np.zeros((d,d)) # co-moments sum((x_i-mean_i)*(x_j-mean_j))
+
+    def merge_moments(self,n,mean,M2):
+        if n==0:
+            return self
+        total = self.n+n
+        delta = mean-self.mean
+        self.M2 += M2 + np.outer(delta,delta)*(self.n*n/total)
+        self.mean += delta*(n/total)
+        self.n = total
+        return self
+
+    def update(self,X):
+        ''' Add a chunk (rows x columns, in the order of self.columns) '''
+        X = np.asarray(X,dtype=np.float64)
+        if len(X)==0:
+            return self
+        mean = X.mean(axis=0)
+        Xc = X-mean
+        return self.merge_moments(len(X),mean,np.dot(Xc.T,Xc))
+
+    def merge(self,other):
+        ''' Merge the statistics of another accumulator with the same columns '''
+        return self.merge_moments(other.n,other.mean,other.M2)
+
+    def variance(self):
+        return np.diag(self.M2)/(self.n-1)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def corr(self):
+        scale = np.sqrt(np.diag(self.M2))
+        with np.errstate(divide='ignore',invalid='ignore'):
+            corr = self.M2/np.outer(scale,scale)
+        return np.nan_to_num(corr)
+
+def range_stats(args):
+    ''' Statistics of a range of rows of the columnar cache (runs in a worker process) '''
+    cache_dir,columns,start,end = args
+    X = np.column_stack([np.load(os.path.join(cache_dir,col+'.npy'),mmap_mode='r')[start:end] for col in columns])
+    return StreamingStats(columns).update(X)
+
+def cache_stats(cache_dir,columns=None,chunk_rows=10**6,n_jobs=None):
+    ''' Compute the statistics of the whole columnar cache in one parallel pass
+    INPUTS:
+        cache_dir: directory of the cache written by ingest.ingest_csv
+        columns: columns to include (default: every cached column)
+        chunk_rows: rows of each task
+        n_jobs: number of worker processes (default: number of cores)
+    OUTPUTS:
+        stats: StreamingStats of the whole dataset
+    '''
+    with open(os.path.join(cache_dir,MANIFEST)) as f:
+        manifest = json.load(f)
+    columns = manifest['columns'] if columns is None else list(columns)
+    tasks = [(cache_dir,columns,start,min(start+chunk_rows,manifest['rows'])) for start in range(0,manifest['rows'],chunk_rows)]
+    stats = StreamingStats(columns)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        for partial in executor.map(range_stats,tasks):
+            stats.merge(partial)
+    return stats
+
+def chunks_stats(chunks,columns=None):
+    ''' Compute the statistics of a stream of DataFrame chunks (p.ej. pd.read_csv(...,chunksize=...)) '''
+    stats = None
+    for chunk in chunks:
+        if stats is None:
+            stats = StreamingStats(chunk.columns if columns is None else columns)
+        stats.update(chunk[stats.columns].to_numpy())
+    return stats
+
+def pruning_plan(stats,std_threshold=0.01,corr_threshold=0.95,keep=(TARGET,)):
+    ''' Single column pruning plan for all the chunks: variables with standard deviation less than
+        std_threshold are removed, then a variable is removed when its correlation with a previous
+        kept variable is more than corr_threshold (upper triangle filter of the notebook)
+    INPUTS:
+        stats: StreamingStats of the whole dataset
+        std_threshold: minimum standard deviation
+        corr_threshold: maximum absolute correlation
+        keep: columns never removed (the target)
+    OUTPUTS:
+        plan: dict with the kept columns and the removed columns of each filter
+    '''
+    std = stats.std()
+    low_variance = [col for col,s in zip(stats.columns,std) if s<=std_threshold and col not in keep]
+    candidates = [i for i,col in enumerate(stats.columns) if col not in low_variance]
+    corr = np.abs(stats.corr())
+    correlated = []
+    for pos,j in enumerate(candidates):
+        col = stats.columns[j]
+        if col in keep:
+            continue
+        if any(corr[i,j]>corr_threshold for i in candidates[:pos] if stats.columns[i] not in correlated):
+            correlated.append(col)
+    removed = set(low_variance+correlated)
+    return {'keep':[col for col in stats.columns if col not in removed],
+            'drop_low_variance':low_variance,'drop_correlated':correlated}
+
+def apply_plan(chunk,plan):
+    ''' Keep the same columns in every chunk '''
+    return chunk[[col for col in plan['keep'] if col in chunk.columns]]
@@ -0,0 +1,137 @@
+"""
+Chunked, parallel ingest of the national COVID dataset into a columnar cache
+"""
+import os
+import io
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# target variable of the classifiers
+TARGET = 'RESULTADO_ANTIGENO'
+# record identifier, only its deterministic hash is cached (used to split the data)
+ID_COLUMN = 'ID_REGISTRO'
+ID_HASH = 'ID_HASH'
+# columns kept after preprocessing() (a priori non-causal, correlated and date variables are not read at all)
+COLUMN_DTYPES = {
+    'ORIGEN': 'int8', 'SECTOR': 'int8', 'ENTIDAD_UM': 'int8', 'SEXO': 'int8', 'ENTIDAD_NAC': 'int8',
+    'MUNICIPIO_RES': 'int16', 'TIPO_PACIENTE': 'int8', 'INTUBADO': 'int8', 'NEUMONIA': 'int8', 'EDAD': 'int16',
+    'NACIONALIDAD': 'int8', 'HABLA_LENGUA_INDIG': 'int8', 'INDIGENA': 'int8', 'DIABETES': 'int8', 'EPOC': 'int8',
+    'ASMA': 'int8', 'INMUSUPR': 'int8', 'HIPERTENSION': 'int8', 'OTRA_COM': 'int8', 'CARDIOVASCULAR': 'int8',
+    'OBESIDAD': 'int8', 'RENAL_CRONICA': 'int8', 'TABAQUISMO': 'int8', 'OTRO_CASO': 'int8',
+    'TOMA_MUESTRA_LAB': 'int8', 'TOMA_MUESTRA_ANTIGENO': 'int8', 'RESULTADO_ANTIGENO': 'int8', 'MIGRANTE': 'int8',
+}
+MANIFEST = 'manifest.json'
+
+def byte_ranges(filename,chunk_bytes=64*2**20):
+    ''' Split a csv file into byte ranges aligned to the start of a line
+    INPUTS:
+        filename: csv file path
+        chunk_bytes: approximate size in bytes of each range
+    OUTPUTS:
+        header: list with the columns names of the file
+        ranges: list of (start,end) byte offsets, the header line is excluded
+    '''
+    size = os.path.getsize(filename)
+    with open(filename,'rb') as f:
+        header_line = f.readline()
+        header = header_line.decode('utf-8').strip().replace('"','').split(',')
+        ranges = []
+        start = len(header_line)
+        while start<size:
+            f.seek(min(start+chunk_bytes,size))
+            # move the end of the range to the next line break
+            f.readline()
+            end = min(f.tell(),size)
+            ranges.append((start,end))
+            start = end
+    return header,ranges
+
+def ingest_range(args):
+    ''' Read and preprocess a byte range of the csv file (runs in a worker process)
+    INPUTS:
+        args: tuple (filename,header,start,end,columns,categorical)
+    OUTPUTS:
+        arrays: dict with a numpy array for each numeric column and the hash of the record identifier
+        categories: dict with (local vocabulary, local codes) for each categorical column
+    '''
+    filename,header,start,end,columns,categorical = args
+    with open(filename,'rb') as f:
+        f.seek(start)
+        buffer = f.read(end-start)
+    dtypes = {col:('Int16' if COLUMN_DTYPES.get(col,'int16')=='int16' else 'Int8') for col in columns if col not in categorical}
+    data = pd.read_csv(io.BytesIO(buffer),names=header,header=None,usecols=[ID_COLUMN]+list(columns)+list(categorical),
+                       dtype=dict(dtypes,**{col:'object' for col in [ID_COLUMN]+list(categorical)}),low_memory=False)
+    # remove non classified or missing info rows
+    data = data[data[TARGET] < 3].dropna()
+    arrays = {col:data[col].to_numpy(dtype=COLUMN_DTYPES.get(col,'int16')) for col in columns if col not in categorical}
+    arrays[ID_HASH] = pd.util.hash_pandas_object(data[ID_COLUMN],index=False).to_numpy()
+    categories = {}
+    for col in categorical:
+        codes,vocabulary = pd.factorize(data[col],sort=True)
+        categories[col] = (np.asarray(vocabulary,dtype=object),codes)
+    return arrays,categories
+
+def ingest_csv(filename,cache_dir,columns=None,categorical=(),chunk_bytes=64*2**20,n_jobs=None):
+    ''' Parse the raw csv file in parallel and write a columnar cache (one .npy file per column,
+        plus the hash of ID_REGISTRO, which is not listed as a column of the cache).
+        Every worker parses its own byte range, categorical columns are encoded with a global
+        vocabulary (sorted union of the vocabularies of all chunks, as LabelEncoder would do on the
+        whole file) and every column is concatenated only once
+    INPUTS:
+        filename: raw csv file path
+        cache_dir: directory where the cache is written
+        columns: numeric columns to keep (default: COLUMN_DTYPES)
+        categorical: non numerical columns to encode with a global vocabulary
+        chunk_bytes: approximate size in bytes of each parsed chunk
+        n_jobs: number of worker processes (default: number of cores)
+    OUTPUTS:
+        manifest: dict with the cached columns, dtypes, number of rows and vocabularies
+    '''
+    columns = list(COLUMN_DTYPES) if columns is None else list(columns)
+    categorical = list(categorical)
+    header,ranges = byte_ranges(filename,chunk_bytes)
+    tasks = [(filename,header,start,end,columns,categorical) for start,end in ranges]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(executor.map(ingest_range,tasks))
+    # global vocabulary for each categorical column and remapping of the local codes
+    vocabularies = {}
+    for col in categorical:
+        vocabulary = np.unique(np.concatenate([res[1][col][0] for res in results]).astype(str))
+        vocabularies[col] = vocabulary.tolist()
+        for res in results:
+            local_vocabulary,codes = res[1][col]
+            lookup = np.searchsorted(vocabulary,local_vocabulary.astype(str)).astype(np.int32)
+            res[0][col] = lookup[codes] if len(codes)>0 else np.zeros(0,dtype=np.int32)
+    # write each column once
+    os.makedirs(cache_dir,exist_ok=True)
+    dtypes = {}
+    rows = 0
+    for col in columns+categorical+[ID_HASH]:
+        column = np.concatenate([res[0][col] for res in results])
+        np.save(os.path.join(cache_dir,col+'.npy'),column)
+        dtypes[col] = str(column.dtype)
+        rows = len(column)
+    del dtypes[ID_HASH]
+    manifest = {'source':os.path.basename(filename),'rows':rows,'columns':columns+categorical,
+                'dtypes':dtypes,'vocabularies':vocabularies}
+    with open(os.path.join(cache_dir,MANIFEST),'w') as f:
+        json.dump(manifest,f,indent=1)
+    return manifest
+
+def load_cache(cache_dir,columns=None,mmap_mode=None,as_frame=True):
+    ''' Load the columnar cache written by ingest_csv
+    INPUTS:
+        cache_dir: cache directory
+        columns: columns to load (default: all the cached columns)
+        mmap_mode: numpy memmap mode ('r' to map the columns without reading them)
+        as_frame: return a pandas DataFrame instead of a dict of arrays
+    OUTPUTS:
+        data: DataFrame (or dict) with the cached columns
+    '''
+    with open(os.path.join(cache_dir,MANIFEST)) as f:
+        manifest = json.load(f)
+    columns = manifest['columns'] if columns is None else columns
+    data = {col:np.load(os.path.join(cache_dir,col+'.npy'),mmap_mode=mmap_mode) for col in columns}
+    return pd.DataFrame(data,copy=False) if as_frame else data
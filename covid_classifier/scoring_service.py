@@ -0,0 +1,266 @@
+"""
+Low latency batch scoring service for the persisted COVID classifiers
+
+Usage:
+    python scoring_service.py --models rfc.joblib dtc.joblib mlp.joblib --port 8080 --workers 4
+
+Endpoints:
+    POST /predict/<model>  body: a raw record (dict) or a list of raw records
+    GET  /stats            latency percentiles and throughput counters of the worker
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from joblib import load
+from ingest import COLUMN_DTYPES, TARGET
+
+def load_models(paths):
+    ''' Load each model once with memory mapped arrays, so the worker processes share the
+        tree arrays (and weights) through the page cache instead of holding a copy each
+    INPUTS:
+        paths: list of joblib files
+    OUTPUTS:
+        models: dict model name (file name without extension) -> model
+    '''
+    return {os.path.splitext(os.path.basename(p))[0]:load(p,mmap_mode='r') for p in paths}
+
+def model_features(model):
+    ''' Features (in order) expected by a model '''
+    if hasattr(model,'feature_names_in_'):
+        return list(model.feature_names_in_)
+    return [col for col in COLUMN_DTYPES if col!=TARGET]
+
+def preprocess_records(records,features):
+    ''' Same preprocessing as preprocessing() for raw records: the dropped variables are
+        ignored and the kept variables are taken in the order used to train the model. Empty
+        requests and non finite values are rejected here, before they reach a shared batch
+    INPUTS:
+        records: list of dicts with the raw variables of each record
+        features: features of the model
+    OUTPUTS:
+        X: array (records x features)
+    '''
+    if not records:
+        raise ValueError("no records")
+    try:
+        X = np.array([[float(r[col]) for col in features] for r in records]).reshape(len(records),len(features))
+    except KeyError as exc:
+        raise ValueError("missing variable %s" % exc)
+    if not np.isfinite(X).all():
+        raise ValueError("non finite values in the records")
+    return X
+
+class LatencyStats:
+    ''' Latency percentiles over the last requests and throughput counters '''
+    def __init__(self,window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.start = time.perf_counter()
+
+    def add(self,latency,rows):
+        self.latencies.append(latency)
+        self.requests += 1
+        self.rows += rows
+
+    def summary(self):
+        elapsed = time.perf_counter()-self.start
+        lat = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            'pid':os.getpid(),
+            'requests':self.requests,
+            'rows':self.rows,
+            'batches':self.batches,
+            'mean_batch_rows':self.rows/self.batches if self.batches else 0.0,
+            'p50_ms':float(np.percentile(lat,50)*1e3),
+            'p99_ms':float(np.percentile(lat,99)*1e3),
+            'requests_per_s':self.requests/elapsed,
+            'rows_per_s':self.rows/elapsed,
+        }
+
+class MicroBatcher:
+    ''' Collect the concurrent requests of a model and score them with a single predict_proba
+        call. A batch is closed when it has max_batch rows or max_delay seconds have passed
+        since its first request. predict_proba runs in a worker thread, so the event loop keeps
+        parsing requests (and filling the next batch) while a batch is scored. If a batch fails,
+        its requests are scored one by one so only the failing request gets the error
+    '''
+    def __init__(self,model,stats,max_batch=1024,max_delay=0.002):
+        self.model = model
+        self.features = model_features(model)
+        self.stats = stats
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def predict(self,X):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((X,future))
+        return await future
+
+    def predict_batch(self,blocks):
+        ''' predict_proba of the rows of all the requests of a batch (runs in the worker thread) '''
+        X_batch = np.concatenate(blocks)
+        if hasattr(self.model,'feature_names_in_'):
+            X_batch = pd.DataFrame(X_batch,columns=self.features)
+        return self.model.predict_proba(X_batch)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            rows = len(items[0][0])
+            deadline = loop.time()+self.max_delay
+            while rows<self.max_batch:
+                # take the queued requests without waiting, wait only when the queue is empty
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline-loop.time()
+                    if timeout<=0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(),timeout)
+                    except asyncio.TimeoutError:
+                        break
+                items.append(item)
+                rows += len(item[0])
+            try:
+                proba = await loop.run_in_executor(self.executor,self.predict_batch,[X for X,_ in items])
+            except Exception as exc:
+                if len(items)==1:
+                    if not items[0][1].done():
+                        items[0][1].set_exception(exc)
+                    continue
+                # score the requests of the failed batch on their own
+                for X,future in items:
+                    try:
+                        proba = await loop.run_in_executor(self.executor,self.predict_batch,[X])
+                    except Exception as item_exc:
+                        if not future.done():
+                            future.set_exception(item_exc)
+                    else:
+                        self.stats.batches += 1
+                        if not future.done():
+                            future.set_result(proba)
+                continue
+            self.stats.batches += 1
+            start = 0
+            for X,future in items:
+                if not future.done():
+                    future.set_result(proba[start:start+len(X)])
+                start += len(X)
+
+class ScoringServer:
+    ''' asyncio HTTP/1.1 server (keep alive) with a micro batcher for each model '''
+    def __init__(self,models,max_batch=1024,max_delay=0.002):
+        self.models = models
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = LatencyStats()
+        self.batchers = {}
+
+    async def score(self,name,body):
+        model = self.models[name]
+        if name not in self.batchers:
+            self.batchers[name] = MicroBatcher(model,self.stats,self.max_batch,self.max_delay)
+        records = json.loads(body)
+        records = [records] if isinstance(records,dict) else records
+        X = preprocess_records(records,self.batchers[name].features)
+        proba = await self.batchers[name].predict(X)
+        classes = model.classes_
+        return {'class':classes[np.argmax(proba,axis=1)].tolist(),'classes':classes.tolist(),'proba':proba.tolist()}
+
+    async def handle(self,reader,writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                status,rows,headers,keep_alive = '200 OK',0,{},True
+                try:
+                    method,path,_ = request_line.decode('latin-1').split(' ',2)
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n',b'\n',b''):
+                            break
+                        key,value = line.decode('latin-1').split(':',1)
+                        headers[key.strip().lower()] = value.strip()
+                    body = await reader.readexactly(int(headers.get('content-length',0)))
+                except ValueError as exc:
+                    # the rest of the stream cannot be framed after a malformed request
+                    status,response,keep_alive = '400 Bad Request',{'error':'malformed request: %s' % exc},False
+                else:
+                    try:
+                        if method=='GET' and path=='/stats':
+                            response = self.stats.summary()
+                        elif method=='POST' and path.startswith('/predict/') and path[9:] in self.models:
+                            response = await self.score(path[9:],body)
+                            rows = len(response['class'])
+                        else:
+                            status,response = '404 Not Found',{'error':'unknown endpoint %s %s' % (method,path)}
+                    except (ValueError,TypeError) as exc:
+                        status,response = '400 Bad Request',{'error':str(exc)}
+                    except Exception as exc:
+                        status,response = '500 Internal Server Error',{'error':'%s: %s' % (type(exc).__name__,exc)}
+                payload = json.dumps(response).encode()
+                writer.write(('HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                              % (status,len(payload))).encode()+payload)
+                await writer.drain()
+                if rows:
+                    self.stats.add(time.perf_counter()-start,rows)
+                if not keep_alive or headers.get('connection','').lower()=='close':
+                    break
+        except (asyncio.IncompleteReadError,ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(model_paths,host='127.0.0.1',port=8080,unix_socket=None,max_batch=1024,max_delay=0.002):
+    ''' Run a scoring worker (TCP with SO_REUSEPORT so several workers share the port, or Unix socket) '''
+    server = ScoringServer(load_models(model_paths),max_batch,max_delay)
+    if unix_socket:
+        srv = await asyncio.start_unix_server(server.handle,path=unix_socket)
+    else:
+        srv = await asyncio.start_server(server.handle,host,port,reuse_port=True)
+    async with srv:
+        await srv.serve_forever()
+
+def run_worker(kwargs):
+    asyncio.run(serve(**kwargs))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch scoring service for the COVID classifiers')
+    parser.add_argument('--models',nargs='+',default=['rfc.joblib','dtc.joblib','mlp.joblib'])
+    parser.add_argument('--host',default='127.0.0.1')
+    parser.add_argument('--port',type=int,default=8080)
+    parser.add_argument('--unix-socket',default=None)
+    parser.add_argument('--workers',type=int,default=1)
+    parser.add_argument('--max-batch',type=int,default=1024)
+    parser.add_argument('--max-delay-ms',type=float,default=2.0)
+    args = parser.parse_args(argv)
+    kwargs = {'model_paths':args.models,'host':args.host,'port':args.port,'unix_socket':args.unix_socket,
+              'max_batch':args.max_batch,'max_delay':args.max_delay_ms/1e3}
+    if args.workers<=1 or args.unix_socket:
+        run_worker(kwargs)
+    else:
+        workers = [multiprocessing.Process(target=run_worker,args=(kwargs,)) for _ in range(args.workers)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Out-of-core stratified train/test split of the columnar cache into binary shards
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from ingest import TARGET, ID_HASH, MANIFEST
+
+def quota_split(y,h,train_size,seen,assigned):
+    ''' Assign the rows of a chunk to the train subset keeping the class proportions of all the
+        rows seen so far (per class quotas). Inside each class the rows with the smallest hash
+        are taken, so the split is deterministic
+    INPUTS:
+        y: class of each row of the chunk
+        h: hash of the record identifier of each row
+        train_size: proportion of rows of each class for the train subset
+        seen,assigned: dicts with the rows seen and assigned to train for each class (updated)
+    OUTPUTS:
+        train_mask: boolean array, True for the train rows
+    '''
+    train_mask = np.zeros(len(y),dtype=bool)
+    for c in np.unique(y):
+        idx = np.flatnonzero(y==c)
+        seen[c] = seen.get(c,0) + len(idx)
+        # train rows for this class up to this chunk minus the rows already assigned
+        n_train = int(np.floor(train_size*seen[c]+0.5)) - assigned.get(c,0)
+        order = idx[np.argsort(h[idx],kind='stable')]
+        train_mask[order[:n_train]] = True
+        assigned[c] = assigned.get(c,0) + n_train
+    return train_mask
+
+def stratified_split(cache_dir,split_dir,train_size=0.9,chunk_rows=10**6,shard_rows=10**6,columns=None):
+    ''' Split the columnar cache into train and test subsets in one pass. The cache columns
+        are memory mapped and read chunk_rows at a time, so the peak memory is bounded by
+        the chunk and shard sizes, not by the dataset size
+    INPUTS:
+        cache_dir: directory of the cache written by ingest.ingest_csv
+        split_dir: directory where the shards are written
+        train_size: proportion of the rows of each class for the train subset
+        chunk_rows: rows read from the cache at a time
+        shard_rows: rows of each shard file
+        columns: columns to keep, p.ej. feature_stats.pruning_plan(...)['keep'] (default: every cached column)
+    OUTPUTS:
+        manifest: dict with the features names and the shard files of each subset
+    '''
+    with open(os.path.join(cache_dir,MANIFEST)) as f:
+        cache = json.load(f)
+    columns = cache['columns'] if columns is None else columns
+    features = [col for col in columns if col!=TARGET]
+    columns = {col:np.load(os.path.join(cache_dir,col+'.npy'),mmap_mode='r') for col in features+[TARGET,ID_HASH]}
+    os.makedirs(split_dir,exist_ok=True)
+    shards = {'train':[],'test':[]}
+    buffers = {'train':[],'test':[]}
+    seen,assigned = {},{}
+
+    def flush(subset,final=False):
+        # write complete shards (and the remaining rows at the end)
+        X = np.concatenate([b[0] for b in buffers[subset]]) if buffers[subset] else np.zeros((0,len(features)),dtype=np.int16)
+        y = np.concatenate([b[1] for b in buffers[subset]]) if buffers[subset] else np.zeros(0,dtype=np.int8)
+        start = 0
+        while len(y)-start>=shard_rows or (final and len(y)-start>0):
+            name = '%s_%05d.npz' % (subset,len(shards[subset]))
+            np.savez(os.path.join(split_dir,name),X=X[start:start+shard_rows],y=y[start:start+shard_rows])
+            shards[subset].append(name)
+            start += shard_rows
+        buffers[subset] = [(X[start:],y[start:])] if start<len(y) else []
+
+    for start in range(0,cache['rows'],chunk_rows):
+        end = min(start+chunk_rows,cache['rows'])
+        y = np.asarray(columns[TARGET][start:end])
+        X = np.column_stack([np.asarray(columns[col][start:end],dtype=np.int16) for col in features])
+        train_mask = quota_split(y,np.asarray(columns[ID_HASH][start:end]),train_size,seen,assigned)
+        buffers['train'].append((X[train_mask],y[train_mask]))
+        buffers['test'].append((X[~train_mask],y[~train_mask]))
+        for subset in buffers:
+            if sum(len(b[1]) for b in buffers[subset])>=shard_rows:
+                flush(subset)
+    for subset in buffers:
+        flush(subset,final=True)
+    manifest = {'features':features,'target':TARGET,'train_size':train_size,'shards':shards,
+                'rows':{'train':int(sum(assigned.values())),'test':int(sum(seen.values())-sum(assigned.values()))}}
+    with open(os.path.join(split_dir,MANIFEST),'w') as f:
+        json.dump(manifest,f,indent=1)
+    return manifest
+
+def iter_shards(split_dir,subset='train',columns=None):
+    ''' Stream the shards of a subset, to be used by partial_fit or warm start training loops
+    INPUTS:
+        split_dir: directory of the shards written by stratified_split
+        subset: 'train' or 'test'
+        columns: features to return (default: all the features)
+    OUTPUTS:
+        (X,y): DataFrame with the features and Series with the target of each shard
+    '''
+    with open(os.path.join(split_dir,MANIFEST)) as f:
+        manifest = json.load(f)
+    features = manifest['features']
+    columns = features if columns is None else list(columns)
+    idx = [features.index(col) for col in columns]
+    for name in manifest['shards'][subset]:
+        with np.load(os.path.join(split_dir,name)) as shard:
+            X = pd.DataFrame(shard['X'][:,idx],columns=columns)
+            y = pd.Series(shard['y'],name=manifest['target'])
+        yield X,y
+
+def load_split(split_dir,subset='test',columns=None):
+    ''' Load all the shards of a subset in memory (concatenated only once)
+    INPUTS:
+        split_dir: directory of the shards written by stratified_split
+        subset: 'train' or 'test'
+        columns: features to return (default: all the features)
+    OUTPUTS:
+        X,y: DataFrame with the features and Series with the target
+    '''
+    parts = list(iter_shards(split_dir,subset,columns))
+    X = pd.concat([p[0] for p in parts],ignore_index=True)
+    y = pd.concat([p[1] for p in parts],ignore_index=True)
+    return X,y
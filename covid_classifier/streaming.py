@@ -0,0 +1,123 @@
+"""
+Streaming training driver that overlaps chunk reading/preprocessing with training
+"""
+import time
+import queue
+import threading
+import multiprocessing
+import pandas as pd
+from ingest import TARGET
+
+def csv_chunks(filename,chunksize=10**5,columns=None,preprocess=None,separator=','):
+    ''' Read a csv file by chunks and separate input/output data
+    INPUTS:
+        filename: csv file path
+        chunksize: rows of each chunk
+        columns: features to return (default: every column but the target)
+        preprocess: function applied to each chunk before separating the data
+        separator: csv separator
+    OUTPUTS:
+        (X,y): features DataFrame and target Series of each chunk
+    '''
+    with pd.read_csv(filename, chunksize=chunksize, sep=separator, low_memory=False) as reader:
+        for chunk in reader:
+            if preprocess is not None:
+                chunk = preprocess(chunk)
+            X = chunk.loc[:, chunk.columns != TARGET] if columns is None else chunk[columns]
+            yield X,chunk[TARGET]
+
+def put(items,entry,stop):
+    ''' Put entry in the bounded queue unless the consumer stops first; returns False when stopped '''
+    while not stop.is_set():
+        try:
+            items.put(entry,timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def produce(source,items,stop):
+    ''' Put the items of source() in the bounded queue (runs in the background thread or process) '''
+    try:
+        for item in source():
+            if not put(items,('item',item),stop):
+                return
+        put(items,('end',None),stop)
+    except Exception as exc:
+        put(items,('error',exc),stop)
+
+def prefetch(source,max_prefetch=2,use_process=False):
+    ''' Iterate over the items of source() while a background thread (or process) reads and
+        preprocesses the next ones. The queue holds at most max_prefetch items (backpressure)
+    INPUTS:
+        source: callable returning an iterator, p.ej. functools.partial(iter_shards,split_dir,'train');
+            it must be picklable when use_process is True
+        max_prefetch: maximum number of items read ahead
+        use_process: read in a process instead of a thread (for pure python parsing that holds the GIL)
+    OUTPUTS:
+        the items of source()
+    '''
+    if use_process:
+        items = multiprocessing.Queue(max_prefetch)
+        stop = multiprocessing.Event()
+        worker = multiprocessing.Process(target=produce,args=(source,items,stop),daemon=True)
+    else:
+        items = queue.Queue(max_prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(target=produce,args=(source,items,stop),daemon=True)
+    worker.start()
+    try:
+        while True:
+            kind,item = items.get()
+            if kind=='end':
+                break
+            if kind=='error':
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join(timeout=1)
+        if use_process and worker.is_alive():
+            worker.terminate()
+
+def train_streaming(model,source,classes=None,epochs=1,mode='auto',n_estimators_step=5,max_prefetch=2,use_process=False):
+    ''' Train an estimator over a stream of (X,y) chunks while the next chunks are read in the background.
+        Estimators with partial_fit are updated with each chunk; ensembles with warm_start (p.ej.
+        RandomForestClassifier) grow n_estimators_step new estimators on each chunk, and other
+        warm_start estimators (p.ej. LogisticRegression) are refit on each chunk from the previous solution
+    INPUTS:
+        model: sklearn estimator with partial_fit or warm_start
+        source: callable returning an iterator of (X,y) chunks (called once per epoch)
+        classes: all the classes of the target (required by partial_fit)
+        epochs: passes over the data
+        mode: 'partial_fit', 'warm_start' or 'auto'
+        n_estimators_step: estimators added on each chunk in warm_start mode
+        max_prefetch: maximum number of chunks read ahead
+        use_process: read the chunks in a process instead of a thread
+    OUTPUTS:
+        model: trained estimator
+        stats: dict with the chunks, the time waiting for data and the training time
+    '''
+    if mode=='auto':
+        mode = 'partial_fit' if hasattr(model,'partial_fit') else 'warm_start'
+    if mode=='warm_start':
+        model.set_params(warm_start=True)
+        n_estimators = model.get_params().get('n_estimators')
+    stats = {'chunks':0,'wait_time':0.0,'train_time':0.0}
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        for X,y in prefetch(source,max_prefetch,use_process):
+            fit_start = time.perf_counter()
+            stats['wait_time'] += fit_start-start
+            if mode=='partial_fit':
+                model.partial_fit(X,y,classes=classes)
+            else:
+                # the first chunk trains the initial estimators
+                if stats['chunks']>0 and n_estimators is not None:
+                    n_estimators += n_estimators_step
+                    model.set_params(n_estimators=n_estimators)
+                model.fit(X,y)
+            start = time.perf_counter()
+            stats['train_time'] += start-fit_start
+            stats['chunks'] += 1
+    return model,stats
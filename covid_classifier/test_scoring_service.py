@@ -0,0 +1,51 @@
+"""
+Tests of the request validation and of the micro batches of the scoring service
+"""
+import asyncio
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from scoring_service import ScoringServer, MicroBatcher, LatencyStats, model_features, preprocess_records
+
+def fitted_model():
+    ''' Logistic regression on random records with the features of the raw dataset '''
+    model = LogisticRegression()
+    features = model_features(model)
+    rng = np.random.default_rng(0)
+    X = rng.integers(0,3,(200,len(features))).astype(float)
+    return model.fit(X,(X[:,0]>0).astype(int)),features
+
+def test_preprocess_rejects_empty_and_non_finite():
+    _,features = fitted_model()
+    record = {col:1 for col in features}
+    assert preprocess_records([record],features).shape==(1,len(features))
+    with pytest.raises(ValueError):
+        preprocess_records([],features)
+    with pytest.raises(ValueError):
+        preprocess_records([dict(record,**{features[0]:float('nan')})],features)
+    with pytest.raises(ValueError):
+        preprocess_records([{features[0]:1}],features)
+
+def test_score_rejects_bad_requests():
+    model,features = fitted_model()
+    async def run():
+        server = ScoringServer({'model':model})
+        good = await server.score('model','{%s}' % ','.join('"%s": 1' % col for col in features))
+        with pytest.raises(ValueError):
+            await server.score('model','[]')
+        return good
+    assert len(asyncio.run(run())['class'])==1
+
+def test_bad_request_does_not_fail_its_batch():
+    model,features = fitted_model()
+    good = np.ones((2,len(features)))
+    bad = np.ones((1,len(features)+1))
+    async def run():
+        # a long delay so all the requests are scored in the same batch
+        batcher = MicroBatcher(model,LatencyStats(),max_batch=1024,max_delay=0.05)
+        return await asyncio.gather(batcher.predict(good),batcher.predict(bad),batcher.predict(good),
+                                    return_exceptions=True)
+    first,second,third = asyncio.run(run())
+    np.testing.assert_allclose(first,model.predict_proba(good))
+    assert isinstance(second,ValueError)
+    np.testing.assert_allclose(third,model.predict_proba(good))
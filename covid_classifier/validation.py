@@ -0,0 +1,136 @@
+"""
+Parallel cross validation engine for the COVID classifiers
+"""
+import os
+import tempfile
+import numpy as np
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import roc_curve, auc, confusion_matrix
+
+def fit_fold(args):
+    ''' Fit a clone of the model on the train indices of a fold and score its test indices
+        (runs in a worker process, the data is read from read-only memory maps)
+    INPUTS:
+        args: tuple (model,X_path,y_path,train,test)
+    OUTPUTS:
+        test: test indices of the fold
+        y_score: probability of the second class (model.classes_[1]) for the test rows
+        y_pred: predicted class for the test rows
+        classes: classes of the fitted model
+    '''
+    model,X_path,y_path,train,test = args
+    X = np.load(X_path,mmap_mode='r')
+    y = np.load(y_path,mmap_mode='r')
+    model.fit(X[train],y[train])
+    proba = model.predict_proba(X[test])
+    y_pred = model.classes_[np.argmax(proba,axis=1)]
+    return test,proba[:,1],y_pred,model.classes_
+
+def fold_metrics(y_true,y_score,y_pred,classes,pos_label=1):
+    ''' Compute every metric of a fold from the same predictions
+    INPUTS:
+        y_true: true classes
+        y_score: probability of classes[1]
+        y_pred: predicted classes
+        classes: classes of the model
+        pos_label: positive class for precision and recall
+    OUTPUTS:
+        metrics: dict with fpr, tpr, auc, confusion matrix, accuracy, precision and recall
+    '''
+    fpr,tpr,_ = roc_curve(y_true,y_score,pos_label=classes[1])
+    cnf_matrix = confusion_matrix(y_true,y_pred,labels=classes)
+    # precision and recall from the confusion matrix (rows: true class, columns: predicted class)
+    p = list(classes).index(pos_label)
+    tp = cnf_matrix[p,p]
+    predicted = cnf_matrix[:,p].sum()
+    actual = cnf_matrix[p,:].sum()
+    return {
+        'fpr':fpr,
+        'tpr':tpr,
+        'auc':auc(fpr,tpr),
+        'confusion_matrix':cnf_matrix,
+        'accuracy':np.trace(cnf_matrix)/cnf_matrix.sum(),
+        'precision':tp/predicted if predicted>0 else 0.0,
+        'recall':tp/actual if actual>0 else 0.0,
+    }
+
+def cross_validate(model,X,y,n_splits=6,pos_label=1,n_jobs=None):
+    ''' Fit the StratifiedKFold folds of a model in parallel worker processes. The dataset is
+        written once to a temporary directory and shared by the workers as read-only memory maps.
+        The predictions of every fold are collected once and all the metrics are computed from them
+    INPUTS:
+        model: sklearn classifier (it is cloned, the given model is not modified)
+        X,y: features and target (DataFrame/Series or arrays)
+        n_splits: number of folds
+        pos_label: positive class for precision and recall
+        n_jobs: number of worker processes (default: number of cores)
+    OUTPUTS:
+        results: dict with the metrics of each fold ('folds'), the out of fold predictions
+            ('y_true','y_score','y_pred','fold') and the mean/std of each metric
+    '''
+    X = np.ascontiguousarray(X)
+    y = np.ascontiguousarray(y)
+    estimator = clone(model)
+    # the folds are already fitted in parallel, avoid oversubscription
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=1)
+    folds = list(StratifiedKFold(n_splits=n_splits).split(X,y))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        X_path = os.path.join(tmp_dir,'X.npy')
+        y_path = os.path.join(tmp_dir,'y.npy')
+        np.save(X_path,X)
+        np.save(y_path,y)
+        tasks = [(clone(estimator),X_path,y_path,train,test) for train,test in folds]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            predictions = list(executor.map(fit_fold,tasks))
+    # out of fold predictions
+    y_score = np.zeros(len(y))
+    y_pred = np.zeros(len(y),dtype=y.dtype)
+    fold = np.zeros(len(y),dtype=int)
+    results = {'folds':[]}
+    for i,(test,score,pred,classes) in enumerate(predictions):
+        y_score[test] = score
+        y_pred[test] = pred
+        fold[test] = i
+        results['folds'].append(fold_metrics(y[test],score,pred,classes,pos_label))
+    results.update({'y_true':y,'y_score':y_score,'y_pred':y_pred,'fold':fold,'classes':classes})
+    for metric in ('auc','accuracy','precision','recall'):
+        values = np.array([f[metric] for f in results['folds']])
+        results[metric] = (values.mean(),values.std())
+    results['confusion_matrix'] = np.sum([f['confusion_matrix'] for f in results['folds']],axis=0)
+    return results
+
+def print_cv_summary(results,model_name):
+    ''' Print the mean/std of the cross validation metrics '''
+    print(model_name+" (Media/STD)")
+    for metric in ('accuracy','precision','recall','auc'):
+        mean,std = results[metric]
+        print("%s: %0.1f+/-%0.1f" % (metric.capitalize(),mean*100,std*100))
+    print()
+
+def plot_roc(results,title="Receiver operating characteristic example"):
+    ''' Plot the ROC curve of each fold, the mean ROC curve and its std band '''
+    mean_fpr = np.linspace(0, 1, 100)
+    tprs = []
+    fig, ax = plt.subplots(figsize=(16,8))
+    for i,f in enumerate(results['folds']):
+        ax.plot(f['fpr'],f['tpr'],alpha=0.3,lw=1,label="ROC fold {} (AUC = {:0.2f})".format(i,f['auc']))
+        interp_tpr = np.interp(mean_fpr, f['fpr'], f['tpr'])
+        interp_tpr[0] = 0.0
+        tprs.append(interp_tpr)
+    ax.plot([0, 1], [0, 1], linestyle="--", lw=2, color="r", label="Chance", alpha=0.8)
+    mean_tpr = np.mean(tprs, axis=0)
+    mean_tpr[-1] = 1.0
+    mean_auc = auc(mean_fpr, mean_tpr)
+    std_auc = results['auc'][1]
+    ax.plot(mean_fpr,mean_tpr,color="b",label=r"Mean ROC (AUC = %0.2f $\pm$ %0.2f)" % (mean_auc, std_auc),lw=2,alpha=0.8)
+    std_tpr = np.std(tprs, axis=0)
+    tprs_upper = np.minimum(mean_tpr + std_tpr, 1)
+    tprs_lower = np.maximum(mean_tpr - std_tpr, 0)
+    ax.fill_between(mean_fpr,tprs_lower,tprs_upper,color="grey",alpha=0.2,label=r"$\pm$ 1 std. dev.")
+    ax.set(xlim=[-0.05, 1.05],ylim=[-0.05, 1.05],title=title)
+    ax.legend(loc="lower right")
+    plt.show()
@@ -0,0 +1,256 @@
+"""
+Byte entropy of files (same results as Entropia.java): memory mapped files, byte histograms with
+bulk bincounts, many files and segments of large files in worker processes, and sliding window
+entropy profiles to locate compressed or encrypted regions
+"""
+import os
+import sys
+import math
+import mmap
+import time
+import argparse
+import numpy as np
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+
+BLOCK = 1 << 19         # bytes per bincount (fits in the cache)
+SEGMENT = 1 << 28       # bytes per task of a large file
+MAX_CHUNKS = 1 << 12    # step-sized chunks per window of the entropy profile
+
+def map_bytes(path):
+    ''' Read only memory map of a file as a uint8 array (the mapping is released with the array) '''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.zeros(0, dtype=np.uint8)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    return np.frombuffer(mm, dtype=np.uint8)
+
+def byte_counts(data, block=BLOCK):
+    ''' Histogram of 256 bins of a uint8 array. Every block is counted as uint16 pairs (half the
+        elements) and the 65536 pair counts are folded into the counts of the low and high bytes
+    INPUTS:
+        data: uint8 array (memory map or buffer)
+        block: bytes per bincount
+    OUTPUTS:
+        counts: int64 array (256)
+    '''
+    block -= block % 2
+    pairs = np.zeros(65536, dtype=np.int64)
+    even = len(data) - len(data) % 2
+    for start in range(0, even, block):
+        pairs += np.bincount(data[start:min(start + block, even)].view(np.uint16), minlength=65536)
+    pairs = pairs.reshape(256, 256)
+    counts = pairs.sum(axis=0) + pairs.sum(axis=1)
+    if even < len(data):
+        counts[data[-1]] += 1
+    return counts
+
+def count_segment(args):
+    ''' Byte counts of the bytes [start, stop) of a file (runs in a worker process) '''
+    path, start, stop = args
+    return byte_counts(map_bytes(path)[start:stop])
+
+def entropy(counts):
+    ''' Shannon entropy in bits per byte of a byte histogram '''
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if total == 0:
+        return 0.
+    prob = counts[counts > 0] / total
+    return float(np.sum(prob * np.log2(1 / prob)))
+
+def sequential_entropy(counts):
+    ''' Entropy with the order and formula of Entropia.java (E -= p*log(p)/log(2) over the 256
+        bins in order), so the last digits match the value it prints
+    '''
+    total = float(sum(int(c) for c in counts))
+    log2 = math.log(2.0)
+    result = 0.
+    for c in counts:
+        p = int(c) / total
+        if p != 0:
+            result = result - p * math.log(p) / log2
+    return result
+
+def java_double(x):
+    ''' Double.toString of Java: shortest digits, scientific notation (1.5E-4) outside [1e-3, 1e7) '''
+    if x == 0 or 1e-3 <= abs(x) < 1e7:
+        return repr(float(x))
+    sign, digits, exponent = Decimal(repr(float(x))).normalize().as_tuple()
+    mantissa = ''.join(map(str, digits))
+    return "%s%s.%sE%d" % ('-' if sign else '', mantissa[0], mantissa[1:] or '0', len(digits) - 1 + exponent)
+
+def analyze_files(paths, n_jobs=None, segment=SEGMENT):
+    ''' Byte histogram and entropy of many files. Files larger than segment are divided in
+        segments, and all the segments of all the files are counted in a process pool
+    INPUTS:
+        paths: file paths
+        n_jobs: number of worker processes (default: number of cores)
+        segment: bytes per task
+    OUTPUTS:
+        results: list of dicts with the path, bytes, counts, probabilities and entropy of each file
+    '''
+    paths = list(paths)
+    sizes = [os.path.getsize(path) for path in paths]
+    tasks = [(path, start, min(start + segment, size)) for path, size in zip(paths, sizes)
+             for start in range(0, size, segment)]
+    owners = [i for i, size in enumerate(sizes) for _ in range(0, size, segment)]
+    n_workers = max(1, min(len(tasks), n_jobs or os.cpu_count() or 1))
+    if n_workers == 1:
+        parts = [count_segment(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            parts = list(executor.map(count_segment, tasks))
+    counts = np.zeros((len(paths), 256), dtype=np.int64)
+    for i, part in zip(owners, parts):
+        counts[i] += part
+    return [{'path': path, 'bytes': size, 'counts': c, 'probabilities': c / size if size else np.zeros(256),
+             'entropy': entropy(c)} for path, size, c in zip(paths, sizes, counts)]
+
+def entropy_table(window):
+    ''' c * log2(c) for c = 0..window, so the entropy of a window is log2(window) - sum(table[counts]) / window '''
+    c = np.arange(window + 1, dtype=np.float64)
+    table = np.zeros(window + 1)
+    table[1:] = c[1:] * np.log2(c[1:])
+    return table
+
+def chunk_counts(chunks):
+    ''' Byte histogram of every row of a uint8 array (rows x bytes) with one bincount '''
+    rows = len(chunks)
+    codes = chunks + (np.arange(rows, dtype=np.int64) * 256)[:, None]
+    return np.bincount(codes.ravel(), minlength=rows * 256).reshape(rows, 256)
+
+def profile_segment(args):
+    ''' Entropy of count windows of a file, the first one starting at byte first * step (runs in a
+        worker process). The histograms of the step-sized chunks are accumulated once and every
+        window is the difference of two cumulative histograms
+    INPUTS:
+        args: tuple (path, first, count, window, step, block) where block is the number of windows
+            computed at once
+    OUTPUTS:
+        entropies: array (count)
+    '''
+    path, first, count, window, step, block = args
+    data = map_bytes(path)
+    r = window // step
+    table = entropy_table(window)
+    entropies = np.empty(count)
+    for i in range(0, count, block):
+        k = min(block, count - i)
+        start = (first + i) * step
+        chunks = data[start:start + (k + r - 1) * step].reshape(k + r - 1, step)
+        cumulative = np.zeros((k + r, 256), dtype=np.int64)
+        np.cumsum(chunk_counts(chunks), axis=0, out=cumulative[1:])
+        counts = cumulative[r:] - cumulative[:k]
+        entropies[i:i + k] = np.log2(window) - table[counts].sum(axis=1) / window
+    return entropies
+
+def entropy_profile(path, window=4096, step=None, n_jobs=None, segment=SEGMENT):
+    ''' Sliding window entropy of a file
+    INPUTS:
+        path: file path
+        window: bytes per window
+        step: bytes between consecutive windows (divisor of window, at least window / MAX_CHUNKS,
+            default: window)
+        n_jobs: number of worker processes (default: number of cores)
+        segment: approximate bytes per task
+    OUTPUTS:
+        offsets: first byte of every window
+        entropies: entropy in bits per byte of every window
+    '''
+    step = step or window
+    if window % step:
+        raise ValueError("step must divide window")
+    if window // step > MAX_CHUNKS:
+        raise ValueError("step must be at least window / %d" % MAX_CHUNKS)
+    size = os.path.getsize(path)
+    n_windows = max(0, (size - window) // step + 1)
+    per_task = max(1, segment // step)
+    # every chunk of a block holds its bytes as int64 codes plus two int64 histograms of 256 bins;
+    # a block has at least window // step windows so the chunks shared with the next block at most
+    # double the work (the memory stays below 2 * MAX_CHUNKS chunks)
+    block = max(BLOCK // (step + 2 * 256), window // step)
+    tasks = [(path, first, min(per_task, n_windows - first), window, step, block)
+             for first in range(0, n_windows, per_task)]
+    n_workers = max(1, min(len(tasks), n_jobs or os.cpu_count() or 1))
+    if n_workers == 1:
+        parts = [profile_segment(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            parts = list(executor.map(profile_segment, tasks))
+    entropies = np.concatenate(parts) if parts else np.zeros(0)
+    return np.arange(n_windows, dtype=np.int64) * step, entropies
+
+def high_entropy_regions(offsets, entropies, window, threshold=7.5):
+    ''' Byte ranges [start, stop) covered by consecutive windows with entropy above threshold
+        (compressed or encrypted data is close to 8 bits per byte; with 4096 byte windows random
+        data gives about 7.95)
+    '''
+    above = np.r_[False, np.asarray(entropies) > threshold, False].astype(np.int8)
+    edges = np.diff(above)
+    first = np.flatnonzero(edges == 1)
+    last = np.flatnonzero(edges == -1) - 1
+    return list(zip(offsets[first].tolist(), (offsets[last] + window).tolist()))
+
+def report(counts):
+    ''' Lines of the results file of Entropia.java: probability of every byte and the entropy
+        (summed in the order of Entropia.java and printed like Java prints a double)
+    '''
+    counts = np.asarray(counts)
+    total = counts.sum()
+    prob = counts / total if total else np.zeros(256)
+    lines = ["Prob[%3.0f]= %12.10f" % (i, p) for i, p in enumerate(prob)]
+    lines.append("La entropia calculada es %s" % java_double(sequential_entropy(counts) if total else 0.))
+    return lines
+
+def benchmark(path, n_jobs=None, window=4096):
+    ''' Throughput of the histogram and of the entropy profile of a file '''
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    result = analyze_files([path], n_jobs)[0]
+    histogram_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    entropy_profile(path, window, n_jobs=n_jobs)
+    profile_seconds = time.perf_counter() - start
+    print("%d bytes, entropy %0.6f: histogram %0.2f s (%0.0f MB/s), profile %0.2f s (%0.0f MB/s)"
+          % (size, result['entropy'], histogram_seconds, size / 1e6 / histogram_seconds,
+             profile_seconds, size / 1e6 / profile_seconds))
+    return {'bytes': size, 'histogram_seconds': histogram_seconds, 'profile_seconds': profile_seconds}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Entropy of the bytes of files')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--output-dir', default=None, help='write the results of every file to <name>.entropia.txt')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--window', type=int, default=0, help='bytes per window of the entropy profile (0: no profile)')
+    parser.add_argument('--step', type=int, default=None)
+    parser.add_argument('--threshold', type=float, default=7.5)
+    parser.add_argument('--quiet', action='store_true', help='print only the entropy of every file')
+    args = parser.parse_args(argv)
+    paths = []
+    for path in args.files:
+        if os.path.isfile(path):
+            paths.append(path)
+        else:
+            print("No se encontro \"%s\"" % path)
+    for result in analyze_files(paths, args.jobs):
+        lines = report(result['counts'])
+        if args.quiet:
+            print("%s: %s" % (result['path'], lines[-1]))
+        else:
+            print("%s\nSe leyeron %d bytes\n" % (result['path'], result['bytes']))
+            print("\n".join(lines))
+        if args.output_dir:
+            name = os.path.join(args.output_dir, os.path.basename(result['path']) + '.entropia.txt')
+            with open(name, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+        if args.window:
+            offsets, entropies = entropy_profile(result['path'], args.window, args.step, args.jobs)
+            for start, stop in high_entropy_regions(offsets, entropies, args.window, args.threshold):
+                print("Region de alta entropia: bytes %d-%d" % (start, stop))
+    return 0 if len(paths) == len(args.files) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
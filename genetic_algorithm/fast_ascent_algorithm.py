@@ -29,34 +29,71 @@ def readData(path,delimiter='tab'):
         print('Selected separator is incorrect')
         sys.exit()
         
-def introducePerturbation(data,factor):
+def introducePerturbation(data,factor,dtype=np.float64,noise=None):
     '''
     Funcion que agrega una perturbacion del orden de factor a un conjunto de datos
     
     Input:
     data: array - Conjunto de datos al que se le quiere agregar una perturbacion
     factor: float - Factor de perturbacion
+    dtype: numpy dtype - Tipo de dato del arreglo resultante (float32 en el modo de precision mixta)
+    noise: array - Perturbacion de cada elemento (hashNoise); por defecto se genera con random.random*factor
     
     Return:
     data_noise: array - Conjunto de datos con perturbacion
     
     '''
     rows,cols = data.shape
-    data_noise = np.zeros((rows,cols)) # inicializar arreglo data_noise
+    data_noise = np.zeros((rows,cols),dtype=dtype) # inicializar arreglo data_noise
+    if noise is not None:
+        # perturbacion dada: X = 0 -> noise, X != 0 -> X*(1+noise)
+        data_noise[:,:] = np.where(data==0,noise,data*(1+noise))
+        return data_noise
+    #endIf
+    noise = np.zeros((rows,cols))
+    for row in range(rows):
+        for col in range(cols):
+            noise[row,col] = random.random()*factor
+        #endFor
+    #endFor
     
     # iterar para cada elemento del arreglo
     for row in range(rows):
         for col in range(cols):
             if data[row,col] == 0: # si X = 0
-                data_noise[row,col] = random.random()*factor
+                data_noise[row,col] = noise[row,col]
             else: # si X != 0
-                data_noise[row,col] = data[row,col]*(1+random.random()*factor)
+                data_noise[row,col] = data[row,col]*(1+noise[row,col])
             #endIf
         #endFor
     #endFor
     return data_noise
 
-def map2powers(data_set,coef_comb):
+def hashNoise(rows_idx,cols,factor,seed):
+    '''
+    Funcion que genera de forma deterministica la perturbacion (uniforme en [0,factor)) de los renglones rows_idx
+    de una matriz con cols columnas. Cada elemento es un hash (splitmix64) de su indice row*cols+col y de la
+    semilla, por lo que la perturbacion de cualquier renglon se regenera sin almacenar la matriz de perturbaciones
+    
+    Inputs:
+    rows_idx: array - Indices de los renglones
+    cols: int - Numero de columnas de la matriz
+    factor: float - Factor de perturbacion
+    seed: int - Semilla (entero de 64 bits)
+    
+    Returns:
+    noise: array - Perturbacion en float64 con dimension len(rows_idx)xcols
+    '''
+    rows_idx = np.atleast_1d(rows_idx).astype(np.uint64)
+    index = rows_idx[:,None]*np.uint64(cols) + np.arange(cols,dtype=np.uint64) + np.uint64(1)
+    # las operaciones en uint64 son modulo 2**64
+    z = np.uint64(seed) + index*np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z >> np.uint64(11))*(factor/2.0**53)
+
+def map2powers(data_set,coef_comb,dtype=np.float64):
     '''
     Funcion para mapear los vectores de un conjunto de datos originales (variables x1,x2,...,xn) a las potencias
     de los monomios, dicho mapeo es la matriz P. P.ej., si se tiene el grado de los polinomios '000' entonces el 
@@ -69,6 +106,7 @@ def map2powers(data_set,coef_comb):
     Inputs:
     data_set: array - Conjunto de datos originales
     coef_comb: list - Lista con las combinaciones de las potencias de los monomios
+    dtype: numpy dtype - Tipo de dato de la matriz P (float32 en el modo de precision mixta)
     
     Returns:
     P: array - Matriz de dimension Nxn_degree+1 con el mapeo de los datos originales a las potencias de los monomios
@@ -82,7 +120,7 @@ def map2powers(data_set,coef_comb):
     # el numero de variables independientes del conjunto original menos 1, ya que la ultima columna es f(X)
     n_variables = columns-1
     # inicializar matriz P
-    P = np.zeros((N,n_degree+1))
+    P = np.zeros((N,n_degree+1),dtype=dtype)
     for row in range(N): # iterar para cada tupla
         for column in range(n_degree): # iterar para cada combinacion de potencias
             coef = 1 #inicializar
@@ -95,7 +133,7 @@ def map2powers(data_set,coef_comb):
     P[:,-1] = data_set[:,-1]
     return P
 
-def generatePerturbationS(matrix,auto=True):
+def generatePerturbationS(matrix,auto=True,dtype=np.float64,seed=None,chunk_size=65536):
     '''
     Funcion para generar la matriz S, que toma a la matriz con los datos originales mapeados a las 
     potencias de los monomios + columna con la variable dependiente f. Para asegurar que la matriz no 
@@ -105,14 +143,19 @@ def generatePerturbationS(matrix,auto=True):
     Inputs:
     matrix: array - Matriz de dimension Nxn_degree+1 con el mapeo de los datos originales a las potencias de los monomios
         + columna con la variable dependiente f
-    factor: float - Factor de perturbacion
+    auto: boolean - bandera para usar el factor de perturbacion por defecto (1e-6) sin preguntar al usuario
+    dtype: numpy dtype - Tipo de dato de la matriz S (float32 en el modo de precision mixta)
+    seed: int - semilla para generar la perturbacion con hashNoise por bloques de chunk_size renglones, sin
+        almacenar la matriz de perturbaciones (para recalcular renglones de S con mapRows64)
+    chunk_size: int - Numero de renglones por bloque (si seed)
     
     Returns:
     S: array - Matriz con los valores mapeados con una cierta perturbacion, y la variable dependiente sin perturbacion
+    factor: float - Factor de perturbacion usado (si seed)
     '''
     factor=1/1e6
     rows,cols = matrix.shape
-    S = np.zeros((rows,cols))
+    S = np.zeros((rows,cols),dtype=dtype)
     if not auto:
         while (True):
             resp=input("Do you wish to stabilize the data? (Y/N) ").upper()
@@ -132,9 +175,19 @@ def generatePerturbationS(matrix,auto=True):
         #endIf
     # introducir perturbacion a todos los datos a excepcion de la ultima columna
     # por convencion la ultima columna es la variable dependiente
-    S[:,:-1] = introducePerturbation(matrix[:,:-1],factor)
+    if seed is None:
+        S[:,:-1] = introducePerturbation(matrix[:,:-1],factor,dtype)
+    else:
+        for start in range(0,rows,chunk_size): # iterar para cada bloque
+            stop = min(start+chunk_size,rows)
+            noise = hashNoise(np.arange(start,stop),cols-1,factor,seed)
+            S[start:stop,:-1] = introducePerturbation(matrix[start:stop,:-1],factor,dtype,noise=noise)
+        #endFor
+    #endIf
     # agregar los valores originales de la variable dependiente
     S[:,-1] = matrix[:,-1]
+    if seed is not None:
+        return S,factor
     return S
 
 def solveMinimaxSigns(matrix):
@@ -340,9 +393,80 @@ def updateInverse(B_matrix,lambda_vector,e_theta_idx):
             B_matrix[j,i] = B_matrix[j,i]-lambda_vector[i]*B_matrix[j,e_theta_idx]
     return B_matrix
 
+def mapRows64(data,rows_idx,coef_comb,factor,seed):
+    '''
+    Funcion para recalcular en float64 los vectores perturbados de S a partir de los datos originales. En el modo
+    de precision mixta el conjunto externo se almacena en float32, por lo que el vector ganador del barrido se
+    vuelve a mapear (y perturbar) en float64 antes de usarlo en el conjunto interno y en la actualizacion de B.
+    La perturbacion se regenera con hashNoise y la misma semilla que S, por lo que cada renglon en float64
+    corresponde a su renglon en float32
+    
+    Inputs:
+    data: array - Conjunto de datos originales (la ultima columna es f(X))
+    rows_idx: array - Indices de los renglones de data a recalcular
+    coef_comb: list - Lista con las combinaciones de las potencias de los monomios
+    factor: float - Factor de perturbacion de S
+    seed: int - Semilla de la perturbacion de S (generatePerturbationS)
+    
+    Returns:
+    rows: array - Renglones de S en float64 con dimension len(rows_idx)xn_degree+1
+    '''
+    rows_idx = np.atleast_1d(rows_idx)
+    rows = map2powers(data[rows_idx,:],coef_comb)
+    noise = hashNoise(rows_idx,rows.shape[1]-1,factor,seed)
+    rows[:,:-1] = introducePerturbation(rows[:,:-1],factor,noise=noise)
+    return rows
 
+def get_e_phi_chunked(data,coef_comb,solution_coef,chunk_size=65536,factor=None,seed=None,exclude=None):
+    '''
+    Funcion para calcular en float64 el error maximo e_phi, su indice y el error rms sobre el conjunto completo
+    de datos sin construir la matriz completa; el mapeo a las potencias (y la perturbacion, si se da la semilla,
+    igual que en mapRows64) se hace por bloques de chunk_size renglones
+    
+    Inputs:
+    data: array - Conjunto de datos originales (la ultima columna es f(X))
+    coef_comb: list - Lista con las combinaciones de las potencias de los monomios
+    solution_coef: array - Arreglo con el valor de los coeficientes
+    chunk_size: int - Numero de renglones a mapear por bloque
+    factor: float - Factor de perturbacion de S
+    seed: int - Semilla de la perturbacion de S (None: sin perturbacion, matriz P)
+    exclude: array - Indices de renglones que no se consideran para e_phi (conjunto interno); si cuentan en e_rms
+    
+    Returns:
+    e_phi: float - Valor del error maximo en el conjunto al realizar |f_i-y_i|
+    e_phi_idx: int - Indice (en data) donde se encuentra el error maximo e_phi
+    e_rms: float - Error cuadratico medio
+    y_i: array - Arreglo con los valores de y_i al utilizar los coeficientes en solution_coef
+    '''
+    N = data.shape[0]
+    y_i = np.zeros(N)
+    e_phi = -1.0
+    e_phi_idx = 0
+    sq_sum = 0.0
+    excluded = np.zeros(N,dtype=bool)
+    if exclude is not None:
+        excluded[exclude] = True
+    #endIf
+    for start in range(0,N,chunk_size): # iterar para cada bloque
+        if seed is None:
+            P_chunk = map2powers(data[start:start+chunk_size,:],coef_comb)
+        else:
+            P_chunk = mapRows64(data,np.arange(start,min(start+chunk_size,N)),coef_comb,factor,seed)
+        #endIf
+        y_i[start:start+P_chunk.shape[0]] = np.dot(P_chunk[:,:-1],solution_coef)
+        e_i_real = P_chunk[:,-1] - y_i[start:start+P_chunk.shape[0]]
+        e_i = np.where(excluded[start:start+P_chunk.shape[0]],-1.0,np.abs(e_i_real))
+        idx = np.argmax(e_i)
+        if e_i[idx]>e_phi:
+            e_phi = e_i[idx]
+            e_phi_idx = start + idx
+        #endIf
+        sq_sum += np.sum(np.square(e_i_real))
+    #endFor
+    e_rms = np.sqrt(sq_sum/N)
+    return e_phi, e_phi_idx, e_rms, y_i
 
-def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=True):
+def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=True,mixed_precision=False,chunk_size=65536):
     '''
     Funcion principal para ejecutar Fast Ascent Algorithm, donde se realizan los siguientes pasos:
     1. Lectura y procesamiento
@@ -372,6 +496,12 @@ def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=Tru
     delimiter: str - 'tab' para separar datos con tabulador o ',' para separarlos por coma
     save_results: boolean - bandera para guardar resultados en la carpeta local donde se ejecuta el programa 
         de la solucion que es el erms mas los coeficientes (solution.txt) y del vector y_i (yi.txt)
+    mixed_precision: boolean - bandera para almacenar el conjunto externo en float32 y hacer el barrido argmax
+        en float32; el vector ganador, el conjunto interno y la matriz B se calculan en float64, y al converger
+        se verifica e_phi sobre el conjunto externo en float64 (por bloques de chunk_size renglones). La
+        perturbacion se regenera por renglon (hashNoise), por lo que e_phi y e_rms se calculan sobre la misma
+        matriz perturbada S que en el modo por defecto
+    chunk_size: int - Numero de renglones por bloque para la verificacion final en float64 (modo de precision mixta)
     
     Returns:
     C: array - Arreglo con los valores de e_theta y los m coeficientes
@@ -387,17 +517,32 @@ def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=Tru
     # coef_comb = coefficientCombination(degree_variables)
 
     # 3 Map the original data vectors into the powers of the monomials (P)
-    P = map2powers(D,coef_comb)
     # 4 Stabilize the vectors of P by random disturbing the original values (S)
-    S = generatePerturbationS(P,auto_perturb)
+    if mixed_precision:
+        ## P y S se almacenan en float32, P no se conserva para el resto de la ejecucion
+        seed = random.getrandbits(64)
+        S,factor = generatePerturbationS(map2powers(D,coef_comb,np.float32),auto_perturb,np.float32,seed,chunk_size)
+    else:
+        P = map2powers(D,coef_comb)
+        S = generatePerturbationS(P,auto_perturb)
+    #endIf
     # 5 Select a subset of size M from S. I (inner_set), and the remaining E (outer_set)
     ## calculo de parametros importantes para la ejecucion
     rows, columns = S.shape
     m = len(coef_comb) # numero de variables independientes para calcular
     M = m + 1 # variables independientes mas el error
     ## generacion de los conjuntos interno y externo
-    inner_set = S[:M,:]
-    outer_set = S[M:,:]
+    if mixed_precision:
+        ## el conjunto interno se recalcula en float64, el externo queda en float32 junto con
+        ## los indices de sus renglones en D para poder recalcular el vector ganador en float64
+        inner_set = mapRows64(D,np.arange(M),coef_comb,factor,seed)
+        outer_set = S[M:,:]
+        inner_map = np.arange(M)
+        outer_map = np.arange(M,rows)
+    else:
+        inner_set = S[:M,:]
+        outer_set = S[M:,:]
+    #endIf
 
     # ************ BOOTSTRAP ************
     # 6 Obtain the minimax signs (call the matrix incorporating sigmas A)
@@ -416,9 +561,33 @@ def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=Tru
         C = np.dot(B,f_vector) # C=fB
         e_theta = C[0] # obtener error theta
         # 9 Calculate the maximum external error e_phi from C and E
-        e_phi, e_phi_idx, e_phi_sign, e_rms, y_i, A_IE = get_e_phi(outer_set,C[1:])
+        if mixed_precision:
+            ## barrido argmax en float32 y recalculo del vector ganador en float64
+            _, e_phi_idx, _, e_rms, _, _ = get_e_phi(outer_set,C[1:].astype(np.float32))
+            row64 = mapRows64(D,outer_map[e_phi_idx],coef_comb,factor,seed)
+            e_phi, _, e_phi_sign, _, _, A_IE = get_e_phi(row64,C[1:])
+        else:
+            e_phi, e_phi_idx, e_phi_sign, e_rms, y_i, A_IE = get_e_phi(outer_set,C[1:])
+        #endIf
         # 10 Check convergence
-        if e_theta>=e_phi:
+        if e_theta>=e_phi and mixed_precision:
+            ## verificar e_phi en float64 sobre el conjunto completo; si el barrido en float32 no encontro
+            ## el maximo real y este supera a e_theta se continua con dicho vector
+            e_phi_full, e_phi_full_idx, e_rms, y_i = get_e_phi_chunked(D,coef_comb,C[1:],chunk_size,factor,seed,inner_map)
+            position = np.flatnonzero(outer_map==e_phi_full_idx)
+            if position.size>0:
+                row64 = mapRows64(D,e_phi_full_idx,coef_comb,factor,seed)
+                e_phi_row, _, e_phi_row_sign, _, _, A_IE_row = get_e_phi(row64,C[1:])
+                if e_phi_row>e_theta:
+                    e_phi, e_phi_idx, e_phi_sign, A_IE = e_phi_row, position[0], e_phi_row_sign, A_IE_row
+                #endIf
+            #endIf
+            if e_theta>=e_phi:
+                # terminar ejecucion con el error e_phi exacto del conjunto externo
+                e_phi = e_phi_full
+                run = False
+            #endIf
+        elif e_theta>=e_phi:
             # terminar ejecucion
             run = False
         ## en caso de tener el criterio de convergencia continuar
@@ -427,7 +596,14 @@ def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=Tru
         # 12 calculate the vector beta which maximizes sigma*(lambda/B). Call its index I_I
         e_theta_idx = getInternalIndex(e_phi_sign,lambda_vector,B)
         # 13 Interchange vector Ie (e_phi_idx) and Ii (e_theta_idx)
-        inner_set, outer_set = swapVectors(inner_set,e_theta_idx,outer_set,e_phi_idx)
+        if mixed_precision:
+            ## intercambio en sitio para no copiar el conjunto externo en cada iteracion
+            outer_set[e_phi_idx,:] = inner_set[e_theta_idx,:]
+            inner_set[e_theta_idx,:] = row64[0,:]
+            inner_map[e_theta_idx], outer_map[e_phi_idx] = outer_map[e_phi_idx], inner_map[e_theta_idx]
+        else:
+            inner_set, outer_set = swapVectors(inner_set,e_theta_idx,outer_set,e_phi_idx)
+        #endIf
         # 14 Calculate the new inverse B
         B = updateInverse(B,lambda_vector,e_theta_idx)
         
@@ -453,7 +629,9 @@ def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=Tru
         plt.show()
 
         # plot results
-        _, _, _, _, y_i, _ = get_e_phi(P,C[1:]) # calculo de y_i con los coeficientes solucion
+        if not mixed_precision:
+            _, _, _, _, y_i, _ = get_e_phi(P,C[1:]) # calculo de y_i con los coeficientes solucion
+        #endIf
         plt.figure(figsize=(14, 8))
         plt.plot(np.arange(0,D.shape[0],1),y_i,marker='.', markersize=10,label=r'$y_i$')
         plt.plot(np.arange(0,D.shape[0],1),D[:,-1],label=r'$f_i$')
@@ -508,5 +686,107 @@ def FAA(data_to_fit,coef_comb=[],auto_perturb=True,save_results=True,verbose=Tru
             FDO1.write("(%2.0f)\t %12.10f \t%12.10f \n" % (i,y_i[i],D[i,3]))
         #ebdfor
         FDO1.close()
-    _, _, _, e_rms, _, _ = get_e_phi(S,C[1:])
-    return C, e_rms
\ No newline at end of file
+    if not mixed_precision:
+        _, _, _, e_rms, _, _ = get_e_phi(S,C[1:])
+    #endIf
+    return C, e_rms
+
+def FAA_multi(data_to_fit,targets,coef_comb=[],auto_perturb=True,verbose=True):
+    '''
+    Funcion para ejecutar Fast Ascent Algorithm sobre varias variables dependientes que comparten la misma
+    base de monomios. El mapeo a las potencias (P) y la perturbacion (S) se calculan una sola vez para todas
+    las variables dependientes, al igual que la fase de arranque (los signos minimax y la inversa B solo
+    dependen de la base). Los ciclos de intercambio de todas las variables se ejecutan a la par, de manera que
+    el error externo de todas las variables activas se calcula con un solo producto matricial S*C por iteracion.
+    Los conjuntos internos se manejan como indices sobre S, por lo que no se copian los conjuntos en cada iteracion.
+    
+    Inputs:
+    data_to_fit: array - Conjunto de datos de las variables independientes (Nxn_variables)
+    targets: array - Matriz de variables dependientes (Nxn_targets), una columna por variable
+    coef_comb: list - Lista con las combinaciones de las potencias de los monomios
+    auto_perturb: boolean - bandera para usar el factor de perturbacion por defecto sin preguntar al usuario
+    verbose: boolean - bandera para imprimir los resultados de cada variable dependiente
+    
+    Returns:
+    C: array - Matriz (M x n_targets) con el valor de e_theta y los m coeficientes de cada variable dependiente
+    e_rms: array - Error rms de cada variable dependiente
+    e_minimax: array - Error minimax (maximo error absoluto en S) de cada variable dependiente
+    '''
+    # ************ READ AND PROCESSING ************
+    X = np.asarray(data_to_fit,dtype=np.float64)
+    F = np.asarray(targets,dtype=np.float64)
+    if F.ndim==1:
+        F = F.reshape(-1,1)
+    #endIf
+    N, n_targets = F.shape
+    # 3-4 Map and stabilize the vectors only once for every target (la ultima columna de S no se usa)
+    S = generatePerturbationS(map2powers(np.column_stack((X,F[:,0])),coef_comb),auto_perturb)
+    S = np.ascontiguousarray(S[:,:-1])
+    m = len(coef_comb) # numero de variables independientes para calcular
+    M = m + 1 # variables independientes mas el error
+
+    # ************ BOOTSTRAP ************
+    # 6-7 los signos minimax y la inversa B son los mismos para todas las variables dependientes
+    A = solveMinimaxSigns(np.column_stack((S[:M,:],F[:M,0])))
+    B = np.linalg.inv(A)
+    B_list = [B.copy() for j in range(n_targets)]
+    inner_idx = np.tile(np.arange(M),(n_targets,1)) # indices del conjunto interno de cada variable
+    C = np.zeros((M,n_targets))
+
+    # ************ LOOP ************
+    active = np.arange(n_targets) # variables dependientes que no han convergido
+    while active.size>0:
+        # 8 Calculate the coefficients C=fB for every active target
+        for j in active:
+            C[:,j] = np.dot(B_list[j],F[inner_idx[j],j])
+        #endFor
+        # 9 Calculate the maximum external error e_phi of every active target with one product
+        e_i_real = F[:,active] - np.dot(S,C[1:,active])
+        e_i = np.abs(e_i_real)
+        for k,j in enumerate(active): # excluir el conjunto interno de cada variable
+            e_i[inner_idx[j],k] = -1
+        #endFor
+        e_phi_idx = np.argmax(e_i,axis=0)
+        still_active = []
+        for k,j in enumerate(active):
+            e_phi = e_i[e_phi_idx[k],k]
+            # 10 Check convergence
+            if C[0,j]>=e_phi:
+                continue
+            #endIf
+            still_active.append(j)
+            # 11 calculate the lambda vector from lambda = A_IE*B
+            A_IE = np.zeros(M)
+            A_IE[0] = np.sign(e_i_real[e_phi_idx[k],k])
+            A_IE[1:] = S[e_phi_idx[k],:]
+            lambda_vector = np.dot(A_IE,B_list[j])
+            # 12 calculate the vector beta which maximizes sigma*(lambda/B). Call its index I_I
+            e_theta_idx = getInternalIndex(A_IE[0],lambda_vector,B_list[j])
+            # 13 Interchange vector Ie (e_phi_idx) and Ii (e_theta_idx)
+            inner_idx[j,e_theta_idx] = e_phi_idx[k]
+            # 14 Calculate the new inverse B
+            B_list[j] = updateInverse(B_list[j],lambda_vector,e_theta_idx)
+        #endFor
+        active = np.array(still_active,dtype=int)
+    #endWhile
+
+    # errores de cada variable dependiente sobre el conjunto completo
+    e_i_real = F - np.dot(S,C[1:,:])
+    e_rms = np.sqrt(np.sum(np.square(e_i_real),axis=0)/N)
+    e_minimax = np.max(np.abs(e_i_real),axis=0)
+    if verbose:
+        # print results
+        print('\n*** RESULTS ***')
+        for j in range(n_targets):
+            print("\nTarget %d" % (j))
+            for i in range(M):
+                if (i==0):
+                    print("E_minimax: \t%12.10f " % (C[i,j]))
+                else:
+                    print("C[%2.0f]\t %12.10f " % (i, C[i,j]))
+                #endIf
+            #endFor
+            print("E_rms: \t%12.10f " % (e_rms[j]))
+        #endFor
+    #endIf
+    return C, e_rms, e_minimax
\ No newline at end of file
@@ -0,0 +1,280 @@
+"""
+k-means engine: Lloyd/Elkan iterations over blocked distance computations, mini-batch mode for
+data read by chunks and a warm-started parallel elbow sweep
+"""
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+def block_rows(k, max_entries=2**22):
+    ''' Rows per block so that a block of the distance matrix has about max_entries entries '''
+    return max(1, max_entries // max(1, k))
+
+def squared_distances(X, C, C_norms=None):
+    ''' Squared distances (rows x centers) with ||x||^2 + ||c||^2 - 2xc (one matrix product) '''
+    if C_norms is None:
+        C_norms = np.einsum('ij,ij->i', C, C)
+    dist = X.dot(C.T)
+    dist *= -2
+    dist += C_norms
+    dist += np.einsum('ij,ij->i', X, X)[:, None]
+    return np.maximum(dist, 0, out=dist)
+
+def assign(X, C, block_size=None):
+    ''' Nearest center of every row of X, computed by blocks of rows
+    INPUTS:
+        X: data (n x d)
+        C: centers (k x d)
+        block_size: rows per block (default: distance blocks of about 4M entries)
+    OUTPUTS:
+        labels: index of the nearest center of each row
+        min_dist: squared distance to the nearest center
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    C = np.asarray(C, dtype=np.float64)
+    if block_size is None:
+        block_size = block_rows(len(C))
+    C_norms = np.einsum('ij,ij->i', C, C)
+    labels = np.empty(len(X), dtype=np.int64)
+    min_dist = np.empty(len(X))
+    for start in range(0, len(X), block_size):
+        dist = squared_distances(X[start:start+block_size], C, C_norms)
+        labels[start:start+len(dist)] = np.argmin(dist, axis=1)
+        min_dist[start:start+len(dist)] = dist[np.arange(len(dist)), labels[start:start+len(dist)]]
+    return labels, min_dist
+
+def predict(X, C, block_size=None):
+    ''' Cluster of every row of X '''
+    return assign(X, C, block_size)[0]
+
+def closest_to_centroids(C, X, block_size=None):
+    ''' Row of X closest to each center (replaces pairwise_distances_argmin_min(C, X))
+    OUTPUTS:
+        closest: index in X of the row closest to each center
+        dist: euclidean distance from each center to that row
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    C = np.asarray(C, dtype=np.float64)
+    if block_size is None:
+        block_size = block_rows(len(C))
+    best = np.full(len(C), np.inf)
+    closest = np.zeros(len(C), dtype=np.int64)
+    C_norms = np.einsum('ij,ij->i', C, C)
+    for start in range(0, len(X), block_size):
+        dist = squared_distances(X[start:start+block_size], C, C_norms)
+        rows = np.argmin(dist, axis=0)
+        values = dist[rows, np.arange(len(C))]
+        better = values < best
+        best[better] = values[better]
+        closest[better] = rows[better] + start
+    return closest, np.sqrt(best)
+
+def kmeans_plusplus(X, k, rng=np.random):
+    ''' k-means++ seeding: each new center is a row drawn with probability proportional to its
+        squared distance to the nearest center already chosen
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    C = np.empty((k, X.shape[1]))
+    C[0] = X[rng.randint(len(X))]
+    min_dist = squared_distances(X, C[:1])[:, 0]
+    for j in range(1, k):
+        total = min_dist.sum()
+        idx = rng.choice(len(X), p=min_dist/total) if total > 0 else rng.randint(len(X))
+        C[j] = X[idx]
+        np.minimum(min_dist, squared_distances(X, C[j:j+1])[:, 0], out=min_dist)
+    return C
+
+def cluster_sums(X, labels, k):
+    ''' Sum of the rows of each cluster (one bincount per dimension, much faster than np.add.at) '''
+    return np.column_stack([np.bincount(labels, weights=X[:, j], minlength=k) for j in range(X.shape[1])])
+
+def update_centers(X, labels, k, min_dist):
+    ''' Mean of the rows of each cluster. An empty cluster takes the row farthest from its center '''
+    counts = np.bincount(labels, minlength=k)
+    C = cluster_sums(X, labels, k)
+    empty = np.where(counts == 0)[0]
+    if len(empty):
+        far = np.argsort(-min_dist)[:len(empty)]
+        C[empty] = X[far]
+        counts[empty] = 1
+    return C / counts[:, None]
+
+def lloyd(X, C, max_iter=300, tol=1e-4, algorithm='elkan', block_size=None):
+    ''' k-means iterations from the centers C
+    INPUTS:
+        X: data (n x d)
+        C: initial centers (k x d)
+        max_iter: maximum number of iterations
+        tol: convergence when the squared shift of the centers is less than tol * mean variance of X
+        algorithm: 'lloyd' (every distance on every iteration) or 'elkan' (triangle inequality bounds:
+            only the rows whose upper bound can change their cluster are recomputed)
+        block_size: rows per block of the distance computations
+    OUTPUTS:
+        C: final centers
+        labels: cluster of each row
+        inertia: sum of squared distances to the nearest center
+        n_iter: iterations run
+    '''
+    X = np.asarray(X, dtype=np.float64)
+    C = np.array(C, dtype=np.float64)
+    k = len(C)
+    threshold = tol * X.var(axis=0).mean()
+    labels, min_dist = assign(X, C, block_size)
+    if algorithm == 'elkan':
+        # exact distances to every center as first lower bounds
+        lower = np.sqrt(squared_distances(X, C))
+        upper = np.sqrt(min_dist)
+    for n_iter in range(1, max_iter+1):
+        C_new = update_centers(X, labels, k, min_dist)
+        shift = np.sqrt(((C_new - C)**2).sum(axis=1))
+        C = C_new
+        if algorithm == 'elkan':
+            upper += shift[labels]
+            np.maximum(lower - shift, 0, out=lower)
+            center_dist = np.sqrt(squared_distances(C, C))
+            np.fill_diagonal(center_dist, np.inf)
+            half = 0.5 * center_dist.min(axis=1)
+            # rows whose cluster can change: the upper bound exceeds the lower bound of another
+            # center and half of the distance between both centers
+            rows = np.where(upper > half[labels])[0]
+            if len(rows):
+                others = (upper[rows, None] > lower[rows]) & (upper[rows, None] > 0.5 * center_dist[labels[rows]])
+                rows = rows[others.any(axis=1)]
+            for start in range(0, len(rows), block_size or block_rows(k)):
+                r = rows[start:start+(block_size or block_rows(k))]
+                dist = np.sqrt(squared_distances(X[r], C))
+                lower[r] = dist
+                labels[r] = np.argmin(dist, axis=1)
+                upper[r] = dist[np.arange(len(r)), labels[r]]
+            min_dist = upper**2
+        else:
+            labels, min_dist = assign(X, C, block_size)
+        if (shift**2).sum() <= threshold:
+            break
+    # exact inertia of the final centers
+    labels, min_dist = assign(X, C, block_size)
+    return C, labels, min_dist.sum(), n_iter
+
+def minibatch_kmeans(source, k, epochs=1, C=None, n_init=3, rng=np.random):
+    ''' Mini-batch k-means for data that does not fit in memory: every chunk moves the centers
+        towards the mean of its rows with per-center learning rates 1/count
+    INPUTS:
+        source: callable returning an iterator of chunks (rows x d), called once per epoch
+        k: number of clusters
+        epochs: passes over the data
+        C: initial centers (default: best of n_init k-means runs over the first chunk)
+        n_init: k-means++ seedings tried on the first chunk
+        rng: random generator
+    OUTPUTS:
+        C: centers
+        counts: rows assigned to each center
+    '''
+    counts = np.zeros(k)
+    if C is not None:
+        # the centers are updated in place, keep the caller's array
+        C = np.array(C, dtype=np.float64)
+    for epoch in range(epochs):
+        for chunk in source():
+            chunk = np.asarray(chunk, dtype=np.float64)
+            if C is None:
+                C = min((lloyd(chunk, kmeans_plusplus(chunk, k, rng)) for _ in range(n_init)), key=lambda r: r[2])[0]
+            labels, _ = assign(chunk, C)
+            batch_counts = np.bincount(labels, minlength=k)
+            sums = cluster_sums(chunk, labels, k)
+            counts += batch_counts
+            seen = batch_counts > 0
+            C[seen] += (sums[seen] - batch_counts[seen, None] * C[seen]) / counts[seen, None]
+    return C, counts
+
+def source_inertia(source, C):
+    ''' Inertia of the centers C over a stream of chunks '''
+    return sum(assign(np.asarray(chunk, dtype=np.float64), C)[1].sum() for chunk in source())
+
+def split_largest(X, C, labels, min_dist):
+    ''' Seed k+1 centers from a k solution: the cluster with the largest SSE is replaced by two
+        centers along its principal direction (mean +/- the standard deviation along it)
+    '''
+    k = len(C)
+    sse = np.bincount(labels, weights=min_dist, minlength=k)
+    j = int(np.argmax(sse))
+    members = X[labels == j]
+    if len(members) < 2:
+        return np.vstack((C, X[np.argmax(min_dist)]))
+    centered = members - members.mean(axis=0)
+    _, s, vt = np.linalg.svd(centered, full_matrices=False)
+    delta = vt[0] * s[0] / np.sqrt(len(members))
+    C = np.vstack((C, C[j] + delta))
+    C[j] = C[j] - delta
+    return C
+
+def sweep_segment(args):
+    ''' Warm-started chain of solutions for k_start..k_end (runs in a worker process) '''
+    X, k_start, k_end, max_iter, tol, algorithm, seed = args
+    rng = np.random.RandomState(seed)
+    C = kmeans_plusplus(X, k_start, rng)
+    results = []
+    for k in range(k_start, k_end+1):
+        if k > k_start:
+            C = split_largest(X, C, labels, min_dist)
+        C, labels, inertia, n_iter = lloyd(X, C, max_iter, tol, algorithm)
+        min_dist = assign(X, C)[1]
+        results.append((k, C, inertia, n_iter))
+    return results
+
+def elbow_sweep(X, k_range=range(1, 20), max_iter=300, tol=1e-4, algorithm='elkan', n_jobs=None, seed=0):
+    ''' Inertia of every k of k_range in one call. The range is divided into contiguous segments,
+        one per worker process; inside a segment the solution of k seeds k+1 by splitting the
+        cluster with the largest SSE, so each fit starts close to its optimum
+    INPUTS:
+        X: data (n x d)
+        k_range: numbers of clusters
+        max_iter, tol, algorithm: parameters of lloyd
+        n_jobs: number of worker processes (default: number of cores)
+        seed: random seed of the k-means++ seeding of each segment
+    OUTPUTS:
+        results: dict with the values of k, their inertia, centers and iterations
+    '''
+    import os
+    X = np.asarray(X, dtype=np.float64)
+    ks = sorted(k_range)
+    n_segments = max(1, min(len(ks), n_jobs or os.cpu_count() or 1))
+    segments = [s for s in np.array_split(np.array(ks), n_segments) if len(s)]
+    tasks = [(X, int(s[0]), int(s[-1]), max_iter, tol, algorithm, seed+i) for i, s in enumerate(segments)]
+    if len(tasks) == 1:
+        chains = [sweep_segment(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+            chains = list(executor.map(sweep_segment, tasks))
+    solutions = {k: (C, inertia, n_iter) for chain in chains for k, C, inertia, n_iter in chain}
+    return {'k': np.array(ks),
+            'inertia': np.array([solutions[k][1] for k in ks]),
+            'centers': [solutions[k][0] for k in ks],
+            'n_iter': np.array([solutions[k][2] for k in ks])}
+
+class KMeansEngine:
+    ''' k-means model with the interface used in the notebook (fit, predict, score, cluster_centers_) '''
+    def __init__(self, n_clusters=8, n_init=1, max_iter=300, tol=1e-4, algorithm='elkan', seed=None):
+        self.n_clusters = n_clusters
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.tol = tol
+        self.algorithm = algorithm
+        self.seed = seed
+
+    def fit(self, X):
+        ''' Best of n_init k-means++ runs '''
+        X = np.asarray(X, dtype=np.float64)
+        rng = np.random.RandomState(self.seed)
+        self.inertia_ = np.inf
+        for _ in range(self.n_init):
+            C = kmeans_plusplus(X, self.n_clusters, rng)
+            C, labels, inertia, n_iter = lloyd(X, C, self.max_iter, self.tol, self.algorithm)
+            if inertia < self.inertia_:
+                self.cluster_centers_, self.labels_, self.inertia_, self.n_iter_ = C, labels, inertia, n_iter
+        return self
+
+    def predict(self, X):
+        return predict(X, self.cluster_centers_)
+
+    def score(self, X):
+        ''' Opposite of the inertia of X (same sign convention as sklearn) '''
+        return -assign(X, self.cluster_centers_)[1].sum()
@@ -0,0 +1,362 @@
+"""
+Indexed k-nearest neighbors engine: KD-tree built once, blocked brute force search and
+regression/classification outputs
+"""
+import time
+import heapq
+import numpy as np
+
+def block_rows(n_points, max_entries=2**22):
+    ''' Queries per block so that a block of the distance matrix has about max_entries entries '''
+    return max(1, max_entries // max(1, n_points))
+
+def select_k(dist_sq, k):
+    ''' Indices of the k smallest values of each row, in increasing order (argpartition + sort of k columns)
+    INPUTS:
+        dist_sq: matrix (queries x points) of squared distances
+        k: number of neighbors
+    OUTPUTS:
+        ind: matrix (queries x k) of column indices
+    '''
+    if k < dist_sq.shape[1]:
+        ind = np.argpartition(dist_sq, k-1, axis=1)[:, :k]
+    else:
+        ind = np.broadcast_to(np.arange(dist_sq.shape[1]), dist_sq.shape).copy()
+    order = np.argsort(np.take_along_axis(dist_sq, ind, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(ind, order, axis=1)
+
+def brute_kneighbors(data, X, k, block_size=None, data_norms=None):
+    ''' k nearest neighbors of every row of X by blocks of queries, with the squared distances
+        ||a||^2 + ||b||^2 - 2ab computed by a matrix product (no queries x points x d temporaries)
+    INPUTS:
+        data: training points (n x d)
+        X: queries (q x d)
+        k: number of neighbors
+        block_size: queries per block (default: distance blocks of about 4M entries)
+        data_norms: precomputed squared norms of data
+    OUTPUTS:
+        dist: matrix (q x k) of distances in increasing order
+        ind: matrix (q x k) of indices of the neighbors in data
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+    k = min(k, len(data))
+    if data_norms is None:
+        data_norms = np.einsum('ij,ij->i', data, data)
+    if block_size is None:
+        block_size = block_rows(len(data))
+    dist = np.empty((len(X), k))
+    ind = np.empty((len(X), k), dtype=np.int64)
+    for start in range(0, len(X), block_size):
+        Xb = X[start:start+block_size]
+        dist_sq = Xb.dot(data.T)
+        dist_sq *= -2
+        dist_sq += data_norms
+        dist_sq += np.einsum('ij,ij->i', Xb, Xb)[:, None]
+        ind_b = select_k(dist_sq, k)
+        ind[start:start+len(Xb)] = ind_b
+        dist[start:start+len(Xb)] = np.take_along_axis(dist_sq, ind_b, axis=1)
+    # rounding of the product can give small negative values
+    np.maximum(dist, 0, out=dist)
+    return np.sqrt(dist, out=dist), ind
+
+class KDTree:
+    ''' KD-tree stored in flat arrays. Each node splits its points at the median of the dimension
+        with the largest spread; the points of a leaf are contiguous in the reordered data, so a
+        leaf is scanned with one vectorized distance computation. Nodes are visited best first and
+        pruned with the distance from the query to their bounding box
+    '''
+    def __init__(self, data, leaf_size=64):
+        self.data = np.asarray(data, dtype=np.float64)
+        self.leaf_size = max(1, leaf_size)
+        n = len(self.data)
+        self.index = np.arange(n)
+        start, end, left, right, lower, upper = [], [], [], [], [], []
+        stack = [(0, n, -1, False)]
+        while stack:
+            s, e, parent, is_right = stack.pop()
+            node = len(start)
+            points = self.data[self.index[s:e]]
+            start.append(s)
+            end.append(e)
+            left.append(-1)
+            right.append(-1)
+            lower.append(points.min(axis=0) if e > s else np.zeros(self.data.shape[1]))
+            upper.append(points.max(axis=0) if e > s else np.zeros(self.data.shape[1]))
+            if parent >= 0:
+                (right if is_right else left)[parent] = node
+            if e - s <= self.leaf_size:
+                continue
+            dim = int(np.argmax(upper[node] - lower[node]))
+            mid = (e - s) // 2
+            part = np.argpartition(points[:, dim], mid)
+            self.index[s:e] = self.index[s:e][part]
+            stack.append((s+mid, e, node, True))
+            stack.append((s, s+mid, node, False))
+        self.start = np.array(start)
+        self.end = np.array(end)
+        self.left = np.array(left)
+        self.right = np.array(right)
+        self.lower = np.array(lower)
+        self.upper = np.array(upper)
+        # points in leaf order, so a leaf is a contiguous slice
+        self.points = self.data[self.index]
+        self.norms = np.einsum('ij,ij->i', self.points, self.points)
+
+    def box_dist_sq(self, x, node):
+        ''' Squared distance from x to the bounding box of a node '''
+        gap = np.maximum(self.lower[node] - x, 0) + np.maximum(x - self.upper[node], 0)
+        return gap.dot(gap)
+
+    def query(self, x, k=1):
+        ''' k nearest neighbors of a single point
+        INPUTS:
+            x: query point (d)
+            k: number of neighbors
+        OUTPUTS:
+            dist: distances in increasing order (k)
+            ind: indices of the neighbors in data (k)
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        k = min(k, len(self.points))
+        best_d = np.full(k, np.inf)
+        best_i = np.full(k, -1, dtype=np.int64)
+        heap = [(0.0, 0)]
+        while heap:
+            bound, node = heapq.heappop(heap)
+            if bound >= best_d[-1]:
+                break
+            if self.left[node] < 0:
+                s, e = self.start[node], self.end[node]
+                pts = self.points[s:e]
+                d_sq = self.norms[s:e] - 2 * pts.dot(x) + x.dot(x)
+                cand_d = np.concatenate((best_d, d_sq))
+                cand_i = np.concatenate((best_i, np.arange(s, e)))
+                keep = np.argpartition(cand_d, k-1)[:k] if len(cand_d) > k else np.arange(len(cand_d))
+                keep = keep[np.argsort(cand_d[keep], kind='stable')]
+                best_d, best_i = cand_d[keep], cand_i[keep]
+                continue
+            for child in (self.left[node], self.right[node]):
+                child_bound = self.box_dist_sq(x, child)
+                if child_bound < best_d[-1]:
+                    heapq.heappush(heap, (child_bound, child))
+        return np.sqrt(np.maximum(best_d, 0)), self.index[best_i]
+
+    def query_batch(self, X, k=1):
+        ''' k nearest neighbors of every row of X (dist, ind matrices of q x k) '''
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        k = min(k, len(self.points))
+        dist = np.empty((len(X), k))
+        ind = np.empty((len(X), k), dtype=np.int64)
+        for i, x in enumerate(X):
+            dist[i], ind[i] = self.query(x, k)
+        return dist, ind
+
+class KNN:
+    ''' k-nearest neighbors regressor (mean of the neighbor targets) or classifier (mode of the
+        neighbor classes). The index is built once in fit
+    '''
+    def __init__(self, n_neighbors=3, task='regression', algorithm='auto', weights='uniform',
+                 leaf_size=64, block_size=None):
+        self.n_neighbors = n_neighbors
+        self.task = task
+        self.algorithm = algorithm
+        self.weights = weights
+        self.leaf_size = leaf_size
+        self.block_size = block_size
+
+    def fit(self, X, y):
+        ''' Store the training data and build the index
+        INPUTS:
+            X: training points (n x d)
+            y: targets (regression) or classes (classification)
+        OUTPUTS:
+            self
+        '''
+        self.data = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        if self.task == 'classification':
+            self.classes_, self.y_ = np.unique(y, return_inverse=True)
+        else:
+            self.y_ = y.astype(np.float64)
+        algorithm = self.algorithm
+        if algorithm == 'auto':
+            # the tree pays off with many points in few dimensions
+            algorithm = 'kdtree' if self.data.shape[1] <= 10 and len(self.data) >= 50000 else 'brute'
+        self.algorithm_ = algorithm
+        if algorithm == 'kdtree':
+            self.tree = KDTree(self.data, self.leaf_size)
+        else:
+            self.tree = None
+            self.data_norms = np.einsum('ij,ij->i', self.data, self.data)
+        return self
+
+    def kneighbors(self, X, n_neighbors=None):
+        ''' Distances and indices (q x k) of the nearest training points of every row of X, in increasing order '''
+        k = self.n_neighbors if n_neighbors is None else n_neighbors
+        if self.tree is not None:
+            return self.tree.query_batch(X, k)
+        return brute_kneighbors(self.data, X, k, self.block_size, self.data_norms)
+
+    def neighbor_weights(self, dist):
+        if self.weights == 'distance':
+            with np.errstate(divide='ignore'):
+                w = 1 / dist
+            # exact matches take all the weight
+            exact = np.isinf(w).any(axis=1)
+            w[exact] = np.isinf(w[exact])
+            return w
+        return np.ones_like(dist)
+
+    def predict(self, X):
+        ''' Mean of the neighbor targets (regression) or most common neighbor class (classification;
+            ties go to the smallest class, like scipy.stats.mode)
+        '''
+        dist, ind = self.kneighbors(X)
+        w = self.neighbor_weights(dist)
+        if self.task == 'classification':
+            votes = np.zeros((len(ind), len(self.classes_)))
+            np.add.at(votes, (np.arange(len(ind))[:, None], self.y_[ind]), w)
+            return self.classes_[np.argmax(votes, axis=1)]
+        return (w * self.y_[ind]).sum(axis=1) / w.sum(axis=1)
+
+def cumulative_predictions(dist, targets, weights='uniform'):
+    ''' Predictions for every k = 1..k_max from the sorted neighbors of each query: cumulative
+        (weighted) mean of the neighbor targets
+    INPUTS:
+        dist: matrix (q x k_max) of sorted neighbor distances
+        targets: matrix (q x k_max) of neighbor targets, or (q x k_max x classes) one hot votes
+        weights: 'uniform' or 'distance'
+    OUTPUTS:
+        predictions: matrix (q x k_max) with the prediction of k in column k-1
+            (q x k_max x classes vote totals for classification)
+    '''
+    extra = (slice(None), slice(None)) + (None,) * (targets.ndim - 2)
+    if weights == 'uniform':
+        return np.cumsum(targets, axis=1) / np.arange(1, dist.shape[1]+1)[extra[1:]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = 1 / dist
+        zero = np.isinf(w)
+        w[zero] = 0
+        # 0/0 while all the first k neighbors are exact matches, replaced below
+        weighted = np.cumsum(w[extra] * targets, axis=1) / np.cumsum(w, axis=1)[extra]
+    # as in predict: if there are exact matches among the first k neighbors they take all the weight
+    zero_count = np.cumsum(zero, axis=1)
+    if zero_count[:, -1].any():
+        exact = np.cumsum(zero[extra] * targets, axis=1) / np.maximum(zero_count, 1)[extra]
+        weighted = np.where((zero_count > 0)[extra], exact, weighted)
+    return weighted
+
+class KSweepCV:
+    ''' Model selection of the number of neighbors with one neighbor search per fold: the k_max
+        nearest neighbors of the test rows are found once in sorted order and the predictions of
+        every k are cumulative means over them, so all k values are scored in one vectorized step.
+        It exposes the attributes of GridSearchCV (best_params_, best_score_, cv_results_,
+        best_estimator_) and predicts with the refitted best model
+    '''
+    def __init__(self, k_range=range(1, 50), weights=('uniform',), cv=5, task='regression',
+                 algorithm='auto', leaf_size=64):
+        self.k_range = list(k_range)
+        self.weights = [weights] if isinstance(weights, str) else list(weights)
+        self.cv = cv
+        self.task = task
+        self.algorithm = algorithm
+        self.leaf_size = leaf_size
+
+    def fit(self, X, y):
+        ''' Score every (k, weights) pair with cross validation (R^2 for regression, accuracy for
+            classification, the default scores of GridSearchCV) and refit the best one
+        INPUTS:
+            X: training points (n x d)
+            y: targets or classes
+        OUTPUTS:
+            self
+        '''
+        from sklearn.model_selection import KFold, StratifiedKFold
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y)
+        k_max = max(self.k_range)
+        k_idx = np.array(self.k_range) - 1
+        if self.task == 'classification':
+            classes, y_codes = np.unique(y, return_inverse=True)
+            folds = list(StratifiedKFold(self.cv).split(X, y))
+        else:
+            y_codes = y.astype(np.float64)
+            folds = list(KFold(self.cv).split(X))
+        min_train = min(len(train) for train, _ in folds)
+        if k_max > min_train:
+            raise ValueError("k_range reaches %d neighbors but the smallest training fold has %d rows" % (k_max, min_train))
+        scores = {w: [] for w in self.weights}
+        for train, test in folds:
+            model = KNN(k_max, self.task, self.algorithm, leaf_size=self.leaf_size).fit(X[train], y[train])
+            dist, ind = model.kneighbors(X[test])
+            if self.task == 'classification':
+                targets = np.eye(len(classes))[y_codes[train][ind]]
+            else:
+                targets = y_codes[train][ind]
+            for w in self.weights:
+                pred = cumulative_predictions(dist, targets, w)[:, k_idx]
+                if self.task == 'classification':
+                    # ties go to the smallest class, as in predict
+                    scores[w].append((np.argmax(pred, axis=2) == y_codes[test][:, None]).mean(axis=0))
+                else:
+                    y_test = y_codes[test]
+                    sse = ((pred - y_test[:, None])**2).sum(axis=0)
+                    sst = ((y_test - y_test.mean())**2).sum()
+                    scores[w].append(1 - sse / sst)
+        # same order of the candidates as GridSearchCV (weights varies fastest)
+        params = [{'n_neighbors': k, 'weights': w} for k in self.k_range for w in self.weights]
+        fold_scores = np.stack([np.array(scores[w]) for w in self.weights], axis=2).reshape(self.cv, -1)
+        mean = fold_scores.mean(axis=0)
+        self.cv_results_ = {'params': params, 'mean_test_score': mean, 'std_test_score': fold_scores.std(axis=0),
+                            'rank_test_score': np.argsort(np.argsort(-mean, kind='stable'), kind='stable') + 1}
+        self.best_index_ = int(np.argmax(mean))
+        self.best_params_ = params[self.best_index_]
+        self.best_score_ = mean[self.best_index_]
+        self.best_estimator_ = KNN(self.best_params_['n_neighbors'], self.task, self.algorithm,
+                                   self.best_params_['weights'], self.leaf_size).fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+def reference_kneighbors(X, y, queries, k):
+    ''' Regression KNN of the notebook: norm of X - query and full argsort for every query '''
+    predictions = np.empty(len(queries))
+    for i, new_data_point in enumerate(queries):
+        distances = np.linalg.norm(X - new_data_point, axis=1)
+        nearest_neighbor_ids = distances.argsort()[:k]
+        predictions[i] = y[nearest_neighbor_ids].mean()
+    return predictions
+
+def benchmark(n_points=4177, d=7, n_queries=1000, k=3, reference_queries=None, seed=0):
+    ''' Query throughput of the notebook loop, the blocked brute force search and the KD-tree
+    INPUTS:
+        n_points, d: size of the random training data (4177 x 7 is the abalone dataset)
+        n_queries: number of random queries
+        k: number of neighbors
+        reference_queries: queries timed with the notebook loop (default: all, it is slow for big data)
+        seed: random seed
+    OUTPUTS:
+        results: dict method -> (build seconds, queries per second)
+    '''
+    rng = np.random.RandomState(seed)
+    X = rng.rand(n_points, d)
+    y = rng.rand(n_points)
+    queries = rng.rand(n_queries, d)
+    n_ref = n_queries if reference_queries is None else min(reference_queries, n_queries)
+    results = {}
+    start = time.perf_counter()
+    expected = reference_kneighbors(X, y, queries[:n_ref], k)
+    results['reference'] = (0.0, n_ref / (time.perf_counter() - start))
+    for algorithm in ('brute', 'kdtree'):
+        start = time.perf_counter()
+        model = KNN(k, algorithm=algorithm).fit(X, y)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        pred = model.predict(queries)
+        results[algorithm] = (build, n_queries / (time.perf_counter() - start))
+        assert np.allclose(pred[:n_ref], expected)
+    for method, (build, qps) in results.items():
+        print("%-10s build: %8.3f s   queries/s: %12.1f" % (method, build, qps))
+    return results
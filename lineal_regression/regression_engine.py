@@ -0,0 +1,403 @@
+"""
+Linear regression solvers: closed form (QR or normal equations), streaming normal equations
+accumulated over chunks (mergeable across processes, one pass over data on disk) and mini-batch
+SGD, plus bulk imputation of rows
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from scipy.linalg import solve_triangular
+except ImportError:
+    solve_triangular = None
+
+def design_matrix(X, fit_intercept=True):
+    ''' Float64 matrix of the features (n x d), with a first column of ones when fit_intercept '''
+    X = np.asarray(X, dtype=np.float64)
+    X = X.reshape(len(X), -1)
+    if not fit_intercept:
+        return X
+    X_b = np.empty((len(X), X.shape[1] + 1))
+    X_b[:, 0] = 1
+    X_b[:, 1:] = X
+    return X_b
+
+def solve_symmetric(A, b):
+    ''' Solution of the symmetric positive semidefinite system A x = b (minimum norm least squares
+        solution when A is numerically singular) '''
+    eig = np.linalg.eigvalsh(A)
+    if eig[0] <= len(A) * np.finfo(np.float64).eps * eig[-1]:
+        return np.linalg.lstsq(A, b, rcond=None)[0]
+    return np.linalg.solve(A, b)
+
+def closed_form(X, y, method='qr', fit_intercept=True, ridge=0.):
+    ''' Least squares coefficients in closed form
+    INPUTS:
+        X: features (n x d)
+        y: target (n)
+        method: 'qr' (QR factorization of the centered data, accurate for ill conditioned features)
+            or 'normal' (normal equations of the centered data, cheaper for n >> d)
+        fit_intercept: fit an intercept (the data is centered and the intercept recovered from the means)
+        ridge: L2 penalty of the coefficients (not of the intercept)
+    OUTPUTS:
+        intercept: intercept (0 if not fit_intercept)
+        coef: coefficients (d)
+    '''
+    if method == 'normal':
+        return NormalEquations().update(X, y).solve(ridge, fit_intercept)
+    if method != 'qr':
+        raise ValueError("unknown method %s" % method)
+    X = design_matrix(X, fit_intercept=False)
+    y = np.asarray(y, dtype=np.float64).ravel()
+    x_mean, y_mean = (X.mean(axis=0), y.mean()) if fit_intercept else (np.zeros(X.shape[1]), 0.)
+    A = X - x_mean
+    b = y - y_mean
+    if ridge > 0:
+        # ridge as least squares of the data augmented with sqrt(ridge)*I rows
+        A = np.vstack((A, np.sqrt(ridge) * np.eye(X.shape[1])))
+        b = np.concatenate((b, np.zeros(X.shape[1])))
+    Q, R = np.linalg.qr(A)
+    pivots = np.abs(np.diag(R))
+    if pivots.min() <= max(A.shape) * np.finfo(np.float64).eps * pivots.max():
+        # rank deficient features: minimum norm solution
+        coef = np.linalg.lstsq(A, b, rcond=None)[0]
+    elif solve_triangular is not None:
+        coef = solve_triangular(R, Q.T.dot(b))
+    else:
+        coef = np.linalg.solve(R, Q.T.dot(b))
+    return y_mean - x_mean.dot(coef), coef
+
+class NormalEquations:
+    ''' Normal equations of a linear regression accumulated over chunks of rows. The means and the
+        centered cross products of [X, y] are kept instead of the raw X^T X and X^T y, and chunks
+        (or accumulators of other processes) are merged with the pairwise update of Chan et al.,
+        so the sums do not lose precision on hundreds of millions of rows with large offsets
+    '''
+    def __init__(self, n_features=None):
+        self.n = 0
+        self.mean = None if n_features is None else np.zeros(n_features + 1)
+        self.comoment = None if n_features is None else np.zeros((n_features + 1, n_features + 1))
+
+    def merge_moments(self, n, mean, comoment):
+        ''' Add the moments of other n rows (mean and centered cross products of [X, y]) '''
+        if n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.comoment = n, mean.copy(), comoment.copy()
+            return self
+        total = self.n + n
+        delta = mean - self.mean
+        self.comoment += comoment
+        self.comoment += np.outer(delta, delta) * (self.n * n / total)
+        self.mean += delta * (n / total)
+        self.n = total
+        return self
+
+    def update(self, X, y):
+        ''' Add a chunk of rows '''
+        X = np.asarray(X, dtype=np.float64)
+        X = X.reshape(len(X), -1)
+        Z = np.empty((len(X), X.shape[1] + 1))
+        Z[:, :-1] = X
+        Z[:, -1] = np.asarray(y, dtype=np.float64).ravel()
+        if len(Z) == 0:
+            return self
+        mean = Z.mean(axis=0)
+        Z -= mean
+        return self.merge_moments(len(Z), mean, Z.T.dot(Z))
+
+    def merge(self, other):
+        ''' Add the rows accumulated by another NormalEquations (e.g. of another process) '''
+        return self.merge_moments(other.n, other.mean, other.comoment)
+
+    def gram(self, fit_intercept=True):
+        ''' Raw normal equations X_b^T X_b and X_b^T y of the design matrix (first column of ones
+            when fit_intercept)
+        '''
+        d = len(self.mean) - 1
+        raw = self.comoment + self.n * np.outer(self.mean, self.mean)
+        if not fit_intercept:
+            return raw[:d, :d], raw[:d, d]
+        G = np.empty((d + 1, d + 1))
+        G[0, 0] = self.n
+        G[0, 1:] = G[1:, 0] = self.n * self.mean[:d]
+        G[1:, 1:] = raw[:d, :d]
+        return G, np.concatenate(([self.n * self.mean[d]], raw[:d, d]))
+
+    def solve(self, ridge=0., fit_intercept=True):
+        ''' Least squares coefficients of the accumulated rows
+        OUTPUTS:
+            intercept: intercept (0 if not fit_intercept)
+            coef: coefficients (d)
+        '''
+        d = len(self.mean) - 1
+        if fit_intercept:
+            A, b = self.comoment[:d, :d].copy(), self.comoment[:d, d]
+        else:
+            A, b = self.gram(fit_intercept=False)
+            A = A.copy()
+        A[np.diag_indices(d)] += ridge
+        coef = solve_symmetric(A, b)
+        return (self.mean[d] - self.mean[:d].dot(coef) if fit_intercept else 0.), coef
+
+    def rss(self, intercept, coef):
+        ''' Residual sum of squares of the accumulated rows for any coefficients (no pass over the data) '''
+        d = len(self.mean) - 1
+        C = self.comoment
+        bias = self.mean[d] - intercept - self.mean[:d].dot(coef)
+        return C[d, d] - 2 * coef.dot(C[:d, d]) + coef.dot(C[:d, :d]).dot(coef) + self.n * bias**2
+
+    def r2(self, intercept, coef):
+        ''' Coefficient of determination of the accumulated rows '''
+        return 1 - self.rss(intercept, coef) / self.comoment[-1, -1]
+
+def npy_chunks(x_path, y_path, chunk_rows=2**20, start=0, stop=None):
+    ''' Chunks (X, y) of rows start..stop of .npy files read through memory maps
+    INPUTS:
+        x_path: features (n x d)
+        y_path: target (n)
+        chunk_rows: rows per chunk
+        start, stop: row range
+    '''
+    X = np.load(x_path, mmap_mode='r')
+    y = np.load(y_path, mmap_mode='r')
+    stop = len(X) if stop is None else stop
+    for s in range(start, stop, chunk_rows):
+        e = min(s + chunk_rows, stop)
+        yield X[s:e], y[s:e]
+
+def csv_chunks(path, feature_cols, target_col, chunk_rows=2**18):
+    ''' Chunks (X, y) of a csv file (pandas chunked reader) '''
+    for frame in pd.read_csv(path, usecols=list(feature_cols) + [target_col], chunksize=chunk_rows):
+        yield frame[list(feature_cols)].to_numpy(np.float64), frame[target_col].to_numpy(np.float64)
+
+def fit_stream(chunks, ridge=0., fit_intercept=True):
+    ''' Closed form regression in one pass over an iterable of chunks (X, y)
+    OUTPUTS:
+        intercept, coef: solution
+        equations: NormalEquations of all the rows (r2, rss, merge)
+    '''
+    equations = NormalEquations()
+    for X, y in chunks:
+        equations.update(X, y)
+    return equations.solve(ridge, fit_intercept) + (equations,)
+
+def moments_segment(args):
+    ''' NormalEquations of a row range of .npy files (runs in a worker process) '''
+    x_path, y_path, start, stop, chunk_rows = args
+    equations = NormalEquations()
+    for X, y in npy_chunks(x_path, y_path, chunk_rows, start, stop):
+        equations.update(X, y)
+    return equations
+
+def fit_npy(x_path, y_path, ridge=0., fit_intercept=True, chunk_rows=2**20, n_jobs=None):
+    ''' Closed form regression of data stored in .npy files in one pass over disk: the rows are
+        divided into contiguous ranges, one per worker process, and their normal equations merged
+    INPUTS:
+        x_path: features (n x d)
+        y_path: target (n)
+        ridge, fit_intercept: parameters of NormalEquations.solve
+        chunk_rows: rows read at once by each worker
+        n_jobs: number of worker processes (default: number of cores)
+    OUTPUTS:
+        intercept, coef: solution
+        equations: NormalEquations of all the rows
+    '''
+    n = len(np.load(y_path, mmap_mode='r'))
+    n_segments = max(1, min(n_jobs or os.cpu_count() or 1, -(-n // chunk_rows)))
+    bounds = np.linspace(0, n, n_segments + 1).astype(np.int64)
+    tasks = [(x_path, y_path, int(s), int(e), chunk_rows) for s, e in zip(bounds[:-1], bounds[1:])]
+    if len(tasks) == 1:
+        parts = [moments_segment(tasks[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+            parts = list(executor.map(moments_segment, tasks))
+    equations = NormalEquations()
+    for part in parts:
+        equations.merge(part)
+    return equations.solve(ridge, fit_intercept) + (equations,)
+
+def minibatch_sgd(source, epochs=10, batch_size=256, eta=0.01, decay=0., fit_intercept=True, rng=None):
+    ''' Mini-batch stochastic gradient descent of the mean squared error. The features are
+        scaled with the statistics of the first chunk (standardized when an intercept absorbs the
+        shift, otherwise just divided by their root mean square, so the step size does not depend
+        on their scale) and the solution is returned in the original units
+    INPUTS:
+        source: tuple (X, y) of arrays (shuffled every epoch) or callable returning an iterator of
+            chunks (X, y), called once per epoch (streaming data, every chunk split in batches)
+        epochs: passes over the data
+        batch_size: rows per gradient step
+        eta: initial learning rate
+        decay: learning rate eta / (1 + decay * step)
+        fit_intercept: fit an intercept
+        rng: seed or np.random.Generator
+    OUTPUTS:
+        intercept, coef: solution
+        losses: mean squared error of the batches of each epoch
+    '''
+    rng = np.random.default_rng(rng)
+    if not callable(source):
+        X_all = design_matrix(source[0], fit_intercept=False)
+        y_all = np.asarray(source[1], dtype=np.float64).ravel()
+        def source():
+            order = rng.permutation(len(X_all))
+            for s in range(0, len(order), 2**16):
+                idx = order[s:s+2**16]
+                yield X_all[idx], y_all[idx]
+    theta = None
+    step = 0
+    losses = []
+    for epoch in range(epochs):
+        sse, rows = 0., 0
+        for X, y in source():
+            X = design_matrix(X, fit_intercept=False)
+            y = np.asarray(y, dtype=np.float64).ravel()
+            if theta is None:
+                if fit_intercept:
+                    shift, scale = X.mean(axis=0), X.std(axis=0)
+                else:
+                    # without intercept the features cannot be centered, only divided by their root mean square
+                    shift, scale = np.zeros(X.shape[1]), np.sqrt((X**2).mean(axis=0))
+                scale[scale == 0] = 1
+                theta = np.zeros(X.shape[1] + 1)
+            Z = design_matrix((X - shift) / scale, fit_intercept)
+            for s in range(0, len(Z), batch_size):
+                Zb, yb = Z[s:s+batch_size], y[s:s+batch_size]
+                w = theta if fit_intercept else theta[1:]
+                residual = Zb.dot(w) - yb
+                gradient = 2 / len(Zb) * Zb.T.dot(residual)
+                w -= eta / (1 + decay * step) * gradient
+                step += 1
+                sse += residual.dot(residual)
+                rows += len(Zb)
+        losses.append(sse / max(rows, 1))
+    coef = theta[1:] / scale
+    return theta[0] - shift.dot(coef), coef, np.array(losses)
+
+def gradient_descent(X_b, y, eta=0.1, n_iter=50, theta=None):
+    ''' Full batch gradient descent of the mean squared error. The gradient 2/m X_b^T (X_b theta - y)
+        is computed from X_b^T X_b and X_b^T y formed once, so each iteration costs O(p^2)
+        instead of a pass over the m rows
+    INPUTS:
+        X_b: design matrix (m x p)
+        y: target (m) or (m x 1)
+        eta: learning rate
+        n_iter: iterations
+        theta: initial coefficients (p) or (p x 1)
+    OUTPUTS:
+        path: coefficients after every iteration (n_iter x p)
+    '''
+    X_b = np.asarray(X_b, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64).ravel()
+    m = len(X_b)
+    G = 2 / m * X_b.T.dot(X_b)
+    b = 2 / m * X_b.T.dot(y)
+    theta = np.zeros(X_b.shape[1]) if theta is None else np.asarray(theta, dtype=np.float64).ravel()
+    path = np.empty((n_iter, len(theta)))
+    for i in range(n_iter):
+        theta = theta - eta * (G.dot(theta) - b)
+        path[i] = theta
+    return path
+
+def impute_rows(X, y, values, count=100, target=None, start=None):
+    ''' Copies of X and y with count imputed rows appended, built in one allocation (instead of
+        growing the frame row by row with .loc)
+    INPUTS:
+        X: DataFrame of features
+        y: Series of the target
+        values: imputed value of each feature
+        count: number of imputed rows
+        target: imputed target (e.g. the prediction of the model at values)
+        start: index label of the first imputed row (default: len(X), like the notebook)
+    OUTPUTS:
+        X_aux, y_aux: DataFrame and Series with the imputed rows
+    '''
+    n = len(X)
+    start = n if start is None else start
+    data = np.empty((n + count, X.shape[1]))
+    data[:n] = X.to_numpy(np.float64)
+    data[n:] = np.asarray(values, dtype=np.float64)
+    index = X.index.append(pd.RangeIndex(start, start + count))
+    y_data = np.empty(n + count)
+    y_data[:n] = y.to_numpy(np.float64)
+    y_data[n:] = np.nan if target is None else target
+    return pd.DataFrame(data, index=index, columns=X.columns), pd.Series(y_data, index=index, name=y.name)
+
+class LinearRegressionEngine:
+    ''' Linear regression with the interface used in the notebook (fit, predict, score, coef_,
+        intercept_) and a choice of solver: 'qr', 'normal' or 'sgd'; partial_fit accumulates
+        chunks in normal equations
+    '''
+    def __init__(self, solver='qr', fit_intercept=True, ridge=0., epochs=10, batch_size=256, eta=0.01, seed=None):
+        self.solver = solver
+        self.fit_intercept = fit_intercept
+        self.ridge = ridge
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.eta = eta
+        self.seed = seed
+        self.equations = None
+
+    def fit(self, X, y):
+        if self.solver == 'sgd':
+            self.intercept_, self.coef_, self.losses_ = minibatch_sgd((X, y), self.epochs, self.batch_size, self.eta,
+                                                                      fit_intercept=self.fit_intercept, rng=self.seed)
+        else:
+            self.intercept_, self.coef_ = closed_form(X, y, self.solver, self.fit_intercept, self.ridge)
+        return self
+
+    def partial_fit(self, X, y):
+        ''' Add a chunk of rows to the normal equations and update the solution '''
+        if self.equations is None:
+            self.equations = NormalEquations()
+        self.equations.update(X, y)
+        self.intercept_, self.coef_ = self.equations.solve(self.ridge, self.fit_intercept)
+        return self
+
+    def predict(self, X):
+        return design_matrix(X, fit_intercept=False).dot(self.coef_) + self.intercept_
+
+    def score(self, X, y):
+        ''' Coefficient of determination R^2 '''
+        y = np.asarray(y, dtype=np.float64).ravel()
+        residual = y - self.predict(X)
+        return 1 - residual.dot(residual) / ((y - y.mean())**2).sum()
+
+def write_synthetic(x_path, y_path, rows, coef, intercept=0., noise=1., offset=1000., chunk_rows=2**22, seed=0):
+    ''' Synthetic regression data written in chunks to .npy files (features with a large offset,
+        like the pressure of the notebook, to check the precision of the accumulated sums)
+    '''
+    rng = np.random.default_rng(seed)
+    coef = np.asarray(coef, dtype=np.float64)
+    X = np.lib.format.open_memmap(x_path, mode='w+', dtype=np.float64, shape=(rows, len(coef)))
+    y = np.lib.format.open_memmap(y_path, mode='w+', dtype=np.float64, shape=(rows,))
+    for s in range(0, rows, chunk_rows):
+        e = min(s + chunk_rows, rows)
+        chunk = rng.standard_normal((e - s, len(coef)))
+        chunk += offset
+        X[s:e] = chunk
+        y[s:e] = chunk.dot(coef) + intercept + noise * rng.standard_normal(e - s)
+    X.flush()
+    y.flush()
+    del X, y
+
+def benchmark(rows=10**8, coef=(0.5, -2.), intercept=3., chunk_rows=2**20, n_jobs=None, directory=None):
+    ''' One pass regression of rows synthetic rows stored on disk
+    OUTPUTS:
+        results: dict with the solution, its error, the R^2 and the time and throughput of the pass
+    '''
+    with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        x_path, y_path = os.path.join(tmp_dir, 'X.npy'), os.path.join(tmp_dir, 'y.npy')
+        write_synthetic(x_path, y_path, rows, coef, intercept)
+        start = time.perf_counter()
+        b, w, equations = fit_npy(x_path, y_path, chunk_rows=chunk_rows, n_jobs=n_jobs)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(x_path) + os.path.getsize(y_path)
+    results = {'intercept': b, 'coef': w, 'coef_error': np.abs(w - np.asarray(coef)).max(),
+               'r2': equations.r2(b, w), 'seconds': elapsed, 'MBps': size / 2**20 / elapsed}
+    print("%d rows: %0.1f s (%0.0f MB/s), coef error %0.2e, R^2 %0.4f"
+          % (rows, elapsed, results['MBps'], results['coef_error'], results['r2']))
+    return results
@@ -0,0 +1,186 @@
+"""
+Evaluation of the logistic regression study: every classification metric from one confusion
+matrix and one sorted score array, and parallel learning curves with warm-started Newton fits
+"""
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from logistic_engine import add_intercept, newton, sigmoid
+try:
+    from sklearn.model_selection import StratifiedKFold
+except ImportError:
+    StratifiedKFold = None
+
+def confusion_counts(y_true, y_pred):
+    ''' Confusion matrix [[tn, fp], [fn, tp]] of 0/1 labels with one bincount (rows: true class) '''
+    codes = 2 * np.asarray(y_true, dtype=np.int64).ravel() + np.asarray(y_pred, dtype=np.int64).ravel()
+    return np.bincount(codes, minlength=4).reshape(2, 2)
+
+def ratio(num, den):
+    ''' num/den, 0 when den is 0 (zero division convention of sklearn) '''
+    return num / den if den else 0.
+
+def confusion_metrics(cm):
+    ''' Accuracy, error, precision, recall (true positive rate), false positive rate, specificity
+        and F1 from a confusion matrix [[tn, fp], [fn, tp]]
+    '''
+    (tn, fp), (fn, tp) = np.asarray(cm)
+    total = tn + fp + fn + tp
+    precision = ratio(tp, tp + fp)
+    recall = ratio(tp, tp + fn)
+    return {'accuracy': ratio(tp + tn, total), 'error': ratio(fp + fn, total),
+            'precision': precision, 'recall': recall, 'fpr': ratio(fp, fp + tn),
+            'specificity': ratio(tn, fp + tn), 'f1': ratio(2 * precision * recall, precision + recall)}
+
+def roc_curve(y_true, scores):
+    ''' ROC curve from one sort of the scores: cumulative true/false positives at every distinct
+        threshold (all of them, sklearn drops the collinear ones, the AUC is the same)
+    OUTPUTS:
+        fpr, tpr: rates of each threshold (starting at 0, 0)
+        thresholds: decreasing distinct scores (the first one is inf)
+        auc: area under the curve (trapezoidal rule)
+    '''
+    y_true = np.asarray(y_true).ravel()
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    order = np.argsort(scores, kind='stable')[::-1]
+    sorted_scores = scores[order]
+    tps = np.cumsum(y_true[order] == 1)
+    # last position of every run of equal scores
+    last = np.r_[np.flatnonzero(np.diff(sorted_scores)), len(scores) - 1]
+    tps = np.r_[0, tps[last]]
+    fps = np.r_[0, last + 1 - tps[1:]]
+    tpr = tps / tps[-1] if tps[-1] else np.zeros(len(tps))
+    fpr = fps / fps[-1] if fps[-1] else np.zeros(len(fps))
+    auc = np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2
+    return fpr, tpr, np.r_[np.inf, sorted_scores[last]], auc
+
+def evaluate(y_true, scores, threshold=0.5):
+    ''' Every metric of a fold from its scores (probabilities of the class 1)
+    OUTPUTS:
+        results: dict with the confusion matrix, the confusion_metrics, the ROC curve and the AUC
+    '''
+    y_true = np.asarray(y_true).ravel()
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    cm = confusion_counts(y_true, scores >= threshold)
+    fpr, tpr, thresholds, auc = roc_curve(y_true, scores)
+    results = confusion_metrics(cm)
+    results.update({'confusion_matrix': cm, 'roc_fpr': fpr, 'roc_tpr': tpr, 'roc_thresholds': thresholds, 'auc': auc})
+    return results
+
+def score_of(y_true, scores, scoring):
+    ''' Metric scoring (accuracy, precision, recall, f1, fpr, auc, ...) of scores '''
+    if scoring == 'auc':
+        return roc_curve(y_true, scores)[3]
+    return confusion_metrics(confusion_counts(y_true, scores >= 0.5))[scoring]
+
+def cv_splits(y, cv=10):
+    ''' Train/test indices of stratified folds (sklearn StratifiedKFold without shuffling when
+        installed, so the folds are the ones of sklearn learning_curve; otherwise every class is
+        divided in cv contiguous blocks)
+    '''
+    y = np.asarray(y).ravel()
+    if StratifiedKFold is not None:
+        return list(StratifiedKFold(cv).split(np.zeros((len(y), 1)), y))
+    fold = np.empty(len(y), dtype=np.int64)
+    for label in np.unique(y):
+        rows = np.flatnonzero(y == label)
+        fold[rows] = np.arange(len(rows)) * cv // len(rows)
+    return [(np.flatnonzero(fold != k), np.flatnonzero(fold == k)) for k in range(cv)]
+
+def absolute_sizes(train_sizes, n_max):
+    ''' Training set sizes: fractions of n_max (floats <= 1) or numbers of rows, like sklearn '''
+    sizes = np.asarray(train_sizes)
+    if np.issubdtype(sizes.dtype, np.floating) and sizes.max() <= 1:
+        sizes = (sizes * n_max).astype(int)
+    return np.unique(np.clip(sizes, 1, n_max))
+
+def fold_chain(args):
+    ''' Fits of one fold for all the training sizes in increasing order, each Newton fit
+        warm-started from the coefficients of the previous size (runs in a worker process)
+    OUTPUTS:
+        train_scores, test_scores: score of each size (nan when the training rows have one class)
+        test_metrics: evaluate of the test fold for the largest size
+    '''
+    X_b, y, train, test, sizes, C, scoring, max_iter = args
+    l2 = np.r_[0., np.ones(X_b.shape[1] - 1)]
+    theta = np.zeros(X_b.shape[1])
+    train_scores = np.full(len(sizes), np.nan)
+    test_scores = np.full(len(sizes), np.nan)
+    # first index where the training rows (taken in order, like sklearn) contain both classes
+    labels = y[train]
+    mixed = np.flatnonzero(labels != labels[0])
+    first_mixed = mixed[0] + 1 if len(mixed) else len(train) + 1
+    test_proba = None
+    for i, size in enumerate(sizes):
+        if size < first_mixed:
+            continue
+        rows = train[:size]
+        # sklearn objective C * sum(loss) + |w|^2 / 2 divided by C * size (the intercept is not penalized)
+        theta = newton((X_b[rows], y[rows]), theta, l2 / (C * size), max_iter)[0]
+        train_scores[i] = score_of(y[rows], sigmoid(X_b[rows].dot(theta)), scoring)
+        test_proba = sigmoid(X_b[test].dot(theta))
+        test_scores[i] = score_of(y[test], test_proba, scoring)
+    test_metrics = evaluate(y[test], test_proba) if test_proba is not None else None
+    return train_scores, test_scores, test_metrics
+
+def learning_curve(X, y, train_sizes=np.linspace(0.1, 1, 5), cv=10, C=1.0, scoring='accuracy',
+                   n_jobs=None, max_iter=50, return_metrics=False):
+    ''' Learning curve of a logistic regression with the folds and training subsets of sklearn
+        learning_curve (StratifiedKFold, first rows of every training fold), same regularization
+        as LogisticRegression(C). The folds run in a process pool and, inside a fold, every size
+        starts from the solution of the previous one
+    INPUTS:
+        X: features (n x d)
+        y: 0/1 labels
+        train_sizes: fractions of the largest training fold or numbers of rows
+        cv: number of folds
+        C: inverse of the regularization strength
+        scoring: metric of confusion_metrics or 'auc'
+        n_jobs: number of worker processes (default: number of cores)
+        max_iter: Newton iterations per fit
+        return_metrics: also return evaluate of every test fold for the largest size
+    OUTPUTS:
+        train_sizes: absolute sizes
+        train_scores, test_scores: arrays (sizes x folds)
+        test_metrics: list of the metrics of each fold (if return_metrics)
+    '''
+    X_b = add_intercept(np.asarray(X, dtype=np.float64).reshape(len(X), -1))
+    y = np.asarray(y, dtype=np.float64).ravel()
+    splits = cv_splits(y, cv)
+    sizes = absolute_sizes(train_sizes, len(splits[0][0]))
+    tasks = [(X_b, y, train, test, sizes, C, scoring, max_iter) for train, test in splits]
+    n_workers = max(1, min(len(tasks), n_jobs or os.cpu_count() or 1))
+    if n_workers == 1:
+        chains = [fold_chain(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            chains = list(executor.map(fold_chain, tasks))
+    train_scores = np.column_stack([chain[0] for chain in chains])
+    test_scores = np.column_stack([chain[1] for chain in chains])
+    if return_metrics:
+        return sizes, train_scores, test_scores, [chain[2] for chain in chains]
+    return sizes, train_scores, test_scores
+
+def benchmark(X, y, train_sizes=np.linspace(0.01, 1, 60), cv=10, n_jobs=None):
+    ''' Time of learning_curve against sklearn learning_curve (LogisticRegression) and largest
+        difference of the mean test scores
+    '''
+    start = time.perf_counter()
+    sizes, train_scores, test_scores = learning_curve(X, y, train_sizes, cv, n_jobs=n_jobs)
+    elapsed = time.perf_counter() - start
+    results = {'seconds': elapsed, 'fits': np.isfinite(test_scores).sum()}
+    try:
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.model_selection import learning_curve as sk_learning_curve
+    except ImportError:
+        print("learning curve, %d fits: %0.2f s" % (results['fits'], elapsed))
+        return results
+    start = time.perf_counter()
+    _, _, sk_test_scores = sk_learning_curve(LogisticRegression(), X, y, cv=cv, scoring='accuracy', n_jobs=1,
+                                             train_sizes=train_sizes)
+    results['sklearn_seconds'] = time.perf_counter() - start
+    results['max_difference'] = np.nanmax(np.abs(np.nanmean(test_scores, axis=1) - np.nanmean(sk_test_scores, axis=1)))
+    print("learning curve, %d fits: %0.2f s (sklearn %0.2f s), largest difference of the mean scores %0.4f"
+          % (results['fits'], elapsed, results['sklearn_seconds'], results['max_difference']))
+    return results
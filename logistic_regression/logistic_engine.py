@@ -0,0 +1,350 @@
+"""
+Logistic regression trainer: fused and numerically stable loss/gradient (one matrix product and
+one exponential per step), gradient descent with periodic cost checks, Newton/IRLS and
+mini-batch SGD, over arrays or streamed chunks
+"""
+import time
+import numpy as np
+
+def softplus_sigmoid(z, with_softplus=True):
+    ''' log(1 + e^z) and sigmoid(z) sharing one exponential e^-|z| (no overflow for any z)
+    OUTPUTS:
+        softplus: log(1 + e^z) = -log_sigmoid(-z) (None if not with_softplus)
+        p: sigmoid(z)
+    '''
+    e = np.exp(-np.abs(z))
+    softplus = None
+    if with_softplus:
+        softplus = np.log1p(e)
+        softplus += np.maximum(z, 0)
+    p = 1 + e
+    np.reciprocal(p, out=p)
+    # e^z / (1 + e^z) for the negative logits
+    np.multiply(p, e, out=p, where=z < 0)
+    return softplus, p
+
+def log_sigmoid(z):
+    ''' Stable log(sigmoid(z)) = -log(1 + e^-z) '''
+    return -np.logaddexp(0, -z)
+
+def sigmoid(z):
+    ''' Stable sigmoid '''
+    return softplus_sigmoid(np.asarray(z, dtype=np.float64))[1]
+
+def add_intercept(X):
+    ''' Design matrix with a first column of ones '''
+    X = np.asarray(X, dtype=np.float64)
+    X_b = np.empty((len(X), X.shape[1] + 1))
+    X_b[:, 0] = 1
+    X_b[:, 1:] = X
+    return X_b
+
+def as_arrays(X, y):
+    ''' Float64 arrays X (m x p) and y (m) from frames, series or column vectors '''
+    X = np.asarray(X, dtype=np.float64)
+    return X.reshape(len(X), -1), np.asarray(y, dtype=np.float64).ravel()
+
+def loss_gradient(theta, X, y, l2=0., with_loss=True):
+    ''' Mean cross entropy and its gradient from one evaluation of the logits z = X theta: the
+        loss of a row is log(1 + e^z) - y*z and its gradient (sigmoid(z) - y) x
+    INPUTS:
+        theta: coefficients (p)
+        X: design matrix (m x p)
+        y: 0/1 labels (m) or (m x 1)
+        l2: L2 penalty sum(l2 * theta^2)/2 (scalar or one per coefficient, e.g. 0 for the intercept)
+        with_loss: compute the loss too (the gradient alone needs only the sigmoid)
+    OUTPUTS:
+        loss: mean loss (None if not with_loss)
+        gradient: gradient (p)
+    '''
+    theta = np.asarray(theta, dtype=np.float64).ravel()
+    y = np.ravel(y)
+    z = X.dot(theta)
+    softplus, p = softplus_sigmoid(z, with_loss)
+    p -= y
+    gradient = X.T.dot(p) / len(X)
+    loss = None
+    if with_loss:
+        loss = (softplus.sum() - y.dot(z)) / len(X)
+    if np.any(l2):
+        gradient += l2 * theta
+        if with_loss:
+            loss += np.dot(l2 * theta, theta) / 2
+    return loss, gradient
+
+def gradient_descent(X, y, theta=None, eta=0.0015, max_cost=0.1, iters=100000, check_every=100, tol=1e-10, l2=0.):
+    ''' Gradient descent with the stopping rules of the notebook (cost <= max_cost or iters),
+        checking the cost only every check_every steps, and stopping too when the gradient norm
+        falls below tol
+    INPUTS:
+        X: design matrix (m x p)
+        y: 0/1 labels (m)
+        theta: initial coefficients (default: zeros)
+        eta: learning rate
+        max_cost: target cost
+        iters: maximum number of iterations
+        check_every: steps between cost evaluations
+        tol: gradient norm tolerance
+        l2: L2 penalty
+    OUTPUTS:
+        theta: coefficients (p)
+        cost: cost of theta
+        n_iter: iterations run
+    '''
+    X, y = as_arrays(X, y)
+    theta = np.zeros(X.shape[1]) if theta is None else np.asarray(theta, dtype=np.float64).ravel().copy()
+    for i in range(iters + 1):
+        check = i % check_every == 0 or i == iters
+        # the cost of theta comes from the logits of its gradient
+        loss, gradient = loss_gradient(theta, X, y, l2, with_loss=check)
+        if check and (loss <= max_cost or np.sqrt(gradient.dot(gradient)) < tol or i == iters):
+            return theta, loss, i
+        theta -= eta * gradient
+
+def chunk_source(X, y, chunk_rows=2**16):
+    ''' Callable returning an iterator of chunks (X, y) of arrays, the interface of streamed data '''
+    X, y = as_arrays(X, y)
+    return lambda: ((X[s:s+chunk_rows], y[s:s+chunk_rows]) for s in range(0, len(X), chunk_rows))
+
+def newton_terms(theta, chunks, l2=0.):
+    ''' Loss, gradient and Hessian (X^T W X with weights p(1 - p)) of all the chunks in one pass '''
+    loss, gradient, hessian, m = 0., 0., 0., 0
+    for X, y in chunks:
+        X, y = as_arrays(X, y)
+        z = X.dot(theta)
+        softplus, p = softplus_sigmoid(z)
+        loss += softplus.sum() - y.dot(z)
+        w = p * (1 - p)
+        p -= y
+        gradient = gradient + X.T.dot(p)
+        hessian = hessian + (X * w[:, None]).T.dot(X)
+        m += len(X)
+    p = len(theta)
+    return (loss / m + np.dot(l2 * theta, theta) / 2, gradient / m + l2 * theta,
+            hessian / m + np.diag(np.broadcast_to(l2, (p,))))
+
+def newton(source, theta=None, l2=0., max_iter=50, tol=1e-8):
+    ''' Newton's method (iteratively reweighted least squares) with step halving: one pass over
+        the data per iteration, quadratic convergence in a few iterations
+    INPUTS:
+        source: tuple (X, y) of arrays or callable returning an iterator of chunks (X, y), called
+            once per pass (streaming data)
+        theta: initial coefficients (default: zeros)
+        l2: L2 penalty, scalar or one per coefficient (needed when the classes are separable)
+        max_iter: maximum number of iterations
+        tol: stop when the Newton decrement g^T H^-1 g / 2 falls below tol
+    OUTPUTS:
+        theta: coefficients (p)
+        cost: loss of theta
+        n_iter: iterations run
+    '''
+    if not callable(source):
+        source = chunk_source(*source)
+    if theta is None:
+        X, _ = next(iter(source()))
+        theta = np.zeros(np.asarray(X).reshape(len(X), -1).shape[1])
+    theta = np.asarray(theta, dtype=np.float64).ravel().copy()
+    loss, gradient, hessian = newton_terms(theta, source(), l2)
+    for i in range(1, max_iter + 1):
+        try:
+            step = np.linalg.solve(hessian, gradient)
+        except np.linalg.LinAlgError:
+            step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+        decrement = gradient.dot(step) / 2
+        if decrement < tol:
+            return theta, loss, i - 1
+        # step halving until the loss decreases
+        t = 1.
+        while True:
+            candidate = theta - t * step
+            terms = newton_terms(candidate, source(), l2)
+            if terms[0] <= loss or t < 1e-10:
+                break
+            t /= 2
+        theta = candidate
+        loss, gradient, hessian = terms
+    return theta, loss, max_iter
+
+def minibatch_sgd(source, theta=None, epochs=5, batch_size=256, eta=0.1, decay=0., l2=0., rng=None):
+    ''' Mini-batch stochastic gradient descent of the cross entropy. The columns are standardized
+        with the statistics of the first chunk (centered only when X has a constant intercept
+        column that absorbs the shift, otherwise just divided by their root mean square, so the
+        model stays the same) and the solution is returned in the original units
+    INPUTS:
+        source: tuple (X, y) of arrays (shuffled every epoch) or callable returning an iterator of
+            chunks (X, y), called once per epoch (streaming data)
+        theta: initial coefficients in the original units (default: zeros)
+        epochs: passes over the data
+        batch_size: rows per step
+        eta: initial learning rate
+        decay: learning rate eta / (1 + decay * step)
+        l2: L2 penalty (of the standardized coefficients)
+        rng: seed or np.random.Generator
+    OUTPUTS:
+        theta: coefficients (p)
+        losses: mean loss of the batches of each epoch
+    '''
+    rng = np.random.default_rng(rng)
+    if not callable(source):
+        X_all, y_all = as_arrays(*source)
+        def source():
+            order = rng.permutation(len(X_all))
+            for s in range(0, len(order), 2**16):
+                idx = order[s:s+2**16]
+                yield X_all[idx], y_all[idx]
+    w = None
+    step = 0
+    losses = []
+    for epoch in range(epochs):
+        total, rows = 0., 0
+        for X, y in source():
+            X, y = as_arrays(X, y)
+            if w is None:
+                constant = (X.std(axis=0) == 0) & (X[0] != 0)
+                if constant.any():
+                    intercept = np.flatnonzero(constant)[0]
+                    shift = np.where(constant, 0, X.mean(axis=0))
+                    scale = np.where(constant, X[0], X.std(axis=0))
+                else:
+                    intercept = None
+                    shift = np.zeros(X.shape[1])
+                    scale = np.sqrt((X**2).mean(axis=0))
+                scale[scale == 0] = 1
+                w = np.zeros(X.shape[1])
+                if theta is not None:
+                    theta = np.asarray(theta, dtype=np.float64).ravel()
+                    w = theta * scale
+                    if intercept is not None:
+                        w[intercept] += theta.dot(shift)
+            Z = X - shift
+            Z /= scale
+            for s in range(0, len(Z), batch_size):
+                loss, gradient = loss_gradient(w, Z[s:s+batch_size], y[s:s+batch_size], l2)
+                w -= eta / (1 + decay * step) * gradient
+                step += 1
+                total += loss * len(Z[s:s+batch_size])
+                rows += len(Z[s:s+batch_size])
+        losses.append(total / max(rows, 1))
+    theta = w / scale
+    if intercept is not None:
+        # w.(x - shift)/scale = theta.x - theta.shift: the constant goes to the intercept column
+        theta[intercept] -= theta.dot(shift) / scale[intercept]
+    return theta, np.array(losses)
+
+def predict_proba(X, theta):
+    ''' Probability of the class 1 '''
+    X = np.asarray(X, dtype=np.float64)
+    return sigmoid(X.reshape(len(X), -1).dot(np.asarray(theta, dtype=np.float64).ravel()))
+
+def predict(X, theta, threshold=0.5):
+    ''' 0/1 classes '''
+    return (predict_proba(X, theta) >= threshold).astype(int)
+
+def accuracy(X, y, theta, threshold=0.5):
+    ''' Percentage of correct classes '''
+    return np.mean(predict(X, theta, threshold) == np.asarray(y).ravel()) * 100
+
+class LogisticRegressionEngine:
+    ''' Logistic regression with the interface used in the notebook (fit, predict, predict_proba,
+        score, coef_, intercept_) and a choice of solver: 'newton', 'gd' or 'sgd'
+    '''
+    def __init__(self, solver='newton', fit_intercept=True, l2=0., max_iter=100, eta=0.1, epochs=5,
+                 batch_size=256, check_every=100, seed=None):
+        self.solver = solver
+        self.fit_intercept = fit_intercept
+        self.l2 = l2
+        self.max_iter = max_iter
+        self.eta = eta
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.check_every = check_every
+        self.seed = seed
+
+    def design(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        X = X.reshape(len(X), -1)
+        return add_intercept(X) if self.fit_intercept else X
+
+    def fit(self, X, y):
+        X_b, y = as_arrays(self.design(X), y)
+        if self.solver == 'newton':
+            theta, self.loss_, self.n_iter_ = newton((X_b, y), l2=self.l2, max_iter=self.max_iter)
+        elif self.solver == 'gd':
+            theta, self.loss_, self.n_iter_ = gradient_descent(X_b, y, eta=self.eta, max_cost=0., iters=self.max_iter,
+                                                               check_every=self.check_every, l2=self.l2)
+        elif self.solver == 'sgd':
+            theta, losses = minibatch_sgd((X_b, y), epochs=self.epochs, batch_size=self.batch_size, eta=self.eta,
+                                          l2=self.l2, rng=self.seed)
+            self.loss_, self.n_iter_ = losses[-1], self.epochs
+        else:
+            raise ValueError("unknown solver %s" % self.solver)
+        self.intercept_ = theta[0] if self.fit_intercept else 0.
+        self.coef_ = theta[1:] if self.fit_intercept else theta
+        return self
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return X.reshape(len(X), -1).dot(self.coef_) + self.intercept_
+
+    def predict_proba(self, X):
+        p = sigmoid(self.decision_function(X))
+        return np.column_stack((1 - p, p))
+
+    def predict(self, X):
+        return (self.decision_function(X) >= 0).astype(int)
+
+    def score(self, X, y):
+        ''' Accuracy (fraction of correct classes, like sklearn) '''
+        return np.mean(self.predict(X) == np.asarray(y).ravel())
+
+def synthetic_source(rows, coef, intercept=0., chunk_rows=2**20, seed=0):
+    ''' Callable streaming rows of a logistic model in chunks, generated again (same seed) on
+        every pass, so no pass keeps more than one chunk in memory
+    OUTPUTS:
+        source: callable returning an iterator of chunks (X with a first column of ones, y)
+    '''
+    coef = np.asarray(coef, dtype=np.float64)
+    def source():
+        rng = np.random.default_rng(seed)
+        for s in range(0, rows, chunk_rows):
+            m = min(chunk_rows, rows - s)
+            X = np.empty((m, len(coef) + 1))
+            X[:, 0] = 1
+            X[:, 1:] = rng.standard_normal((m, len(coef)))
+            p = sigmoid(X[:, 1:].dot(coef) + intercept)
+            yield X, (rng.random(m) < p).astype(np.float64)
+    return source
+
+def benchmark(X=None, y=None, stream_rows=10**7, repeat=20):
+    ''' Training time of Newton, gradient descent with periodic cost checks and mini-batch SGD on
+        (X, y) (default: the notebook data) and of streamed Newton on stream_rows synthetic rows
+    OUTPUTS:
+        results: dict solver -> dict with seconds, loss and iterations
+    '''
+    if X is None:
+        import pandas as pd
+        data = pd.read_csv("weight-height.csv")
+        X = np.c_[data.Height * 0.0254, data.Weight * 0.453592]
+        y = data.Gender.map({'Male': 0, 'Female': 1}).to_numpy()
+    X, y = as_arrays(X, y)
+    X_b = add_intercept(X)
+    solvers = {'newton': lambda: newton((X_b, y)),
+               'gd (1000 iters)': lambda: gradient_descent(X_b, y, eta=0.0015, max_cost=0., iters=1000),
+               'sgd (1 epoch)': lambda: minibatch_sgd((X_b, y), epochs=1, rng=0)}
+    results = {}
+    for name, train in solvers.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            out = train()
+        elapsed = (time.perf_counter() - start) / repeat
+        theta = out[0]
+        results[name] = {'seconds': elapsed, 'theta': theta, 'accuracy': accuracy(X_b, y, theta)}
+        print("%-16s %8.2f ms  accuracy %0.2f%%" % (name, elapsed * 1000, results[name]['accuracy']))
+    if stream_rows:
+        source = synthetic_source(stream_rows, [1.5, -2.], 0.5)
+        start = time.perf_counter()
+        theta, loss, n_iter = newton(source)
+        elapsed = time.perf_counter() - start
+        results['newton stream'] = {'seconds': elapsed, 'theta': theta, 'loss': loss, 'n_iter': n_iter}
+        print("newton, %d streamed rows: %0.1f s (%d iterations), theta %s" % (stream_rows, elapsed, n_iter, theta))
+    return results
@@ -0,0 +1,231 @@
+"""
+Block tiled PCA image codec: one PCA basis shared by all the tiles of an image, quantized
+scores and a compact binary container that can be decoded in parallel or by regions
+"""
+import time
+import zlib
+import struct
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pca_engine import top_components, psnr, synthetic_image
+
+MAGIC = b'PCAT'
+VERSION = 1
+# magic, version, height, width, channels, tile, k, score bytes, tile rows per band, bands, step
+HEADER = struct.Struct('<4sBIIHHHBHIf')
+# integer type of the quantized scores by its size in bytes
+SCORE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+def image_tiles(img, tile):
+    ''' Split an image (H x W or H x W x C) in tile x tile patches; the borders are padded by
+        repeating the edge pixels
+    OUTPUTS:
+        patches: array (tile rows, tile columns, tile*tile*C) of patch vectors
+    '''
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[:, :, None]
+    h, w, c = img.shape
+    pad_h, pad_w = -h % tile, -w % tile
+    if pad_h or pad_w:
+        img = np.pad(img, ((0, pad_h), (0, pad_w), (0, 0)), mode='edge')
+    rows, cols = img.shape[0] // tile, img.shape[1] // tile
+    patches = img.reshape(rows, tile, cols, tile, c).transpose(0, 2, 1, 3, 4)
+    return patches.reshape(rows, cols, tile * tile * c)
+
+def tiles_image(patches, tile, channels):
+    ''' Inverse of image_tiles (without removing the padding) '''
+    rows, cols, _ = patches.shape
+    img = patches.reshape(rows, cols, tile, tile, channels).transpose(0, 2, 1, 3, 4)
+    return img.reshape(rows * tile, cols * tile, channels)
+
+def learn_basis(patches, k, max_samples=200000, seed=0):
+    ''' Shared PCA basis of the patch vectors (eigh of the small patch covariance)
+    INPUTS:
+        patches: array (..., D) of patch vectors
+        k: number of components
+        max_samples: patches sampled to estimate the covariance
+        seed: random seed of the sample
+    OUTPUTS:
+        mean: mean patch (D)
+        basis: components as columns (D x k)
+    '''
+    P = patches.reshape(-1, patches.shape[-1]).astype(np.float32)
+    if len(P) > max_samples:
+        P = P[np.random.RandomState(seed).choice(len(P), max_samples, replace=False)]
+    mean = P.mean(axis=0)
+    basis, _, _ = top_components((P - mean).T, k, method='eigh')
+    return mean, basis
+
+def encode(img, filename=None, tile=8, k=16, step=4., band_rows=8, level=3, n_threads=None):
+    ''' Encode an image in the tiled PCA container
+    INPUTS:
+        img: gray scale (H x W) or color (H x W x C) uint8 image
+        filename: file to write (optional)
+        tile: side of the square tiles
+        k: components of the shared basis
+        step: quantization step of the scores (the basis is orthonormal, so the error per pixel is
+            about step^2/12 * k/D in mean square)
+        band_rows: tile rows of each independently compressed band (unit of parallel and region decoding)
+        level: zlib compression level
+        n_threads: threads compressing the bands
+    OUTPUTS:
+        data: bytes of the container (header, mean, basis, band offsets and zlib compressed bands)
+    '''
+    img = np.asarray(img)
+    h, w = img.shape[:2]
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    patches = image_tiles(img, tile)
+    mean, basis = learn_basis(patches, k)
+    k = basis.shape[1]
+    # store the float16 basis and mean, and quantize with them so the decoder sees the same values
+    mean = mean.astype(np.float16)
+    basis = basis.astype(np.float16)
+    scores = (patches.astype(np.float32) - mean.astype(np.float32)).dot(basis.astype(np.float32))
+    q = np.rint(scores / step)
+    # smallest integer type that holds every quantized score (astype would wrap the others)
+    q_max = np.abs(q).max() if q.size else 0
+    fitting = [t for t in SCORE_DTYPES.values() if q_max <= np.iinfo(t).max]
+    if not fitting:
+        raise ValueError("quantized scores up to %d do not fit in int32, use a larger step" % q_max)
+    score_dtype = fitting[0]
+    q = q.astype(score_dtype)
+    rows = q.shape[0]
+    bands = [q[r:r+band_rows] for r in range(0, rows, band_rows)]
+    # component major order inside a band: coefficients of similar magnitude are contiguous
+    pack = lambda band: zlib.compress(np.ascontiguousarray(band.transpose(2, 0, 1)).tobytes(), level)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        payloads = list(executor.map(pack, bands))
+    offsets = np.cumsum([0] + [len(p) for p in payloads]).astype('<u8')
+    header = HEADER.pack(MAGIC, VERSION, h, w, channels, tile, k, np.dtype(score_dtype).itemsize,
+                         band_rows, len(bands), step)
+    data = b''.join([header, mean.astype('<f2').tobytes(), basis.astype('<f2').tobytes(), offsets.tobytes()] + payloads)
+    if filename is not None:
+        with open(filename, 'wb') as f:
+            f.write(data)
+    return data
+
+def read_header(data):
+    ''' Parse the header of a container
+    OUTPUTS:
+        header: dict with the image/codec parameters, mean, basis, band offsets and the
+            position of the first band
+    '''
+    magic, version, h, w, channels, tile, k, score_bytes, band_rows, n_bands, step = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a tiled PCA container (version %d)" % VERSION)
+    D = tile * tile * channels
+    pos = HEADER.size
+    mean = np.frombuffer(data, '<f2', D, pos).astype(np.float32)
+    pos += 2 * D
+    basis = np.frombuffer(data, '<f2', D * k, pos).reshape(D, k).astype(np.float32)
+    pos += 2 * D * k
+    offsets = np.frombuffer(data, '<u8', n_bands + 1, pos)
+    pos += 8 * (n_bands + 1)
+    return {'height': h, 'width': w, 'channels': channels, 'tile': tile, 'k': k,
+            'score_dtype': SCORE_DTYPES[score_bytes], 'band_rows': band_rows,
+            'n_bands': n_bands, 'step': step, 'mean': mean, 'basis': basis,
+            'offsets': offsets, 'data_start': pos}
+
+def decode_band(data, header, band, col_range=None):
+    ''' Reconstruct the pixels of a band (all its tile columns or the tile columns of col_range) '''
+    tile, k = header['tile'], header['k']
+    cols = -(-header['width'] // tile)
+    rows = min(header['band_rows'], -(-header['height'] // tile) - band * header['band_rows'])
+    start = header['data_start'] + int(header['offsets'][band])
+    end = header['data_start'] + int(header['offsets'][band+1])
+    q = np.frombuffer(zlib.decompress(data[start:end]), header['score_dtype']).reshape(k, rows, cols)
+    c0, c1 = (0, cols) if col_range is None else col_range
+    scores = q[:, :, c0:c1].transpose(1, 2, 0).astype(np.float32) * header['step']
+    patches = scores.dot(header['basis'].T)
+    patches += header['mean']
+    return tiles_image(patches, tile, header['channels'])
+
+def decode(data, region=None, n_threads=None):
+    ''' Decode a container (bytes or file name), whole or only a region of interest; the bands
+        are decompressed and reconstructed in a thread pool (zlib and the matrix products release the GIL)
+    INPUTS:
+        data: bytes returned by encode or file name
+        region: (row_start, row_end, col_start, col_end) in pixels, default: whole image
+        n_threads: decoding threads
+    OUTPUTS:
+        img: uint8 image (or region)
+    '''
+    if isinstance(data, str):
+        with open(data, 'rb') as f:
+            data = f.read()
+    # the bands are sliced without copies
+    data = memoryview(data)
+    header = read_header(data)
+    h, w, tile = header['height'], header['width'], header['tile']
+    r0, r1, c0, c1 = (0, h, 0, w) if region is None else region
+    r0, r1, c0, c1 = max(0, r0), min(h, r1), max(0, c0), min(w, c1)
+    if r0 >= r1 or c0 >= c1:
+        shape = (max(0, r1 - r0), max(0, c1 - c0))
+        return np.zeros(shape if header['channels'] == 1 else shape + (header['channels'],), dtype=np.uint8)
+    band_px = header['band_rows'] * tile
+    bands = range(r0 // band_px, -(-r1 // band_px))
+    col_range = (c0 // tile, -(-c1 // tile))
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        pieces = list(executor.map(lambda b: decode_band(data, header, b, col_range), bands))
+    img = np.concatenate(pieces, axis=0)
+    # crop the region from the decoded bands/tile columns
+    top = bands.start * band_px
+    left = col_range[0] * tile
+    img = img[r0-top:r1-top, c0-left:c1-left]
+    img = np.clip(np.rint(img), 0, 255).astype(np.uint8)
+    return img[:, :, 0] if header['channels'] == 1 else img
+
+def jpeg_roundtrip(img, quality=75):
+    ''' Encode/decode an image as JPEG (opencv, or pillow when opencv is not installed)
+    OUTPUTS:
+        size: bytes of the JPEG file
+        decoded: decoded image
+        encode_time, decode_time: seconds
+    '''
+    try:
+        import cv2 as cv
+        start = time.perf_counter()
+        ok, buf = cv.imencode('.jpg', img, [cv.IMWRITE_JPEG_QUALITY, quality])
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = cv.imdecode(buf, cv.IMREAD_UNCHANGED)
+        return len(buf), decoded, encode_time, time.perf_counter() - start
+    except ImportError:
+        import io
+        from PIL import Image
+        start = time.perf_counter()
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, format='JPEG', quality=quality)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = np.array(Image.open(io.BytesIO(buf.getvalue())))
+        return buf.tell(), decoded, encode_time, time.perf_counter() - start
+
+def benchmark(img=None, tile=8, k=16, step=4., jpeg_quality=75):
+    ''' Compression ratio, PSNR and encode/decode throughput of the tiled PCA codec and JPEG
+    INPUTS:
+        img: uint8 image (default: synthetic 4K gray scale image)
+        tile, k, step: parameters of encode
+        jpeg_quality: JPEG quality
+    OUTPUTS:
+        results: dict codec -> dict with ratio, psnr and encode/decode MB/s
+    '''
+    img = synthetic_image() if img is None else np.asarray(img)
+    mb = img.nbytes / 2**20
+    start = time.perf_counter()
+    data = encode(img, tile=tile, k=k, step=step)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = decode(data)
+    decode_time = time.perf_counter() - start
+    results = {'pca tiles': {'ratio': img.nbytes / len(data), 'psnr': psnr(img, decoded),
+                             'encode_MBps': mb / encode_time, 'decode_MBps': mb / decode_time}}
+    size, decoded, encode_time, decode_time = jpeg_roundtrip(img, jpeg_quality)
+    results['jpeg'] = {'ratio': img.nbytes / size, 'psnr': psnr(img, decoded),
+                       'encode_MBps': mb / encode_time, 'decode_MBps': mb / decode_time}
+    print("image: %s, %0.1f MB" % (img.shape, mb))
+    for codec, r in results.items():
+        print("%-10s ratio: %6.2f  PSNR: %6.2f dB  encode: %8.1f MB/s  decode: %8.1f MB/s"
+              % (codec, r['ratio'], r['psnr'], r['encode_MBps'], r['decode_MBps']))
+    return results
@@ -0,0 +1,165 @@
+"""
+Truncated PCA engine for image compression: only the top k components are computed (randomized
+range finder SVD or eigh of the symmetric covariance) and the compressed image keeps the basis,
+scores and mean in a compact dtype
+"""
+import time
+import numpy as np
+
+def image_matrix(img):
+    ''' Image as a matrix whose columns are the samples: an image of H x W pixels (or H x W x C
+        channels) gives H x (W*C) columns of dimension H, as in np.cov(img) of the notebook
+    '''
+    img = np.asarray(img)
+    return img.reshape(img.shape[0], -1)
+
+def randomized_range(A, k, oversample=10, n_iter=2, rng=np.random):
+    ''' Orthonormal basis (rows x (k+oversample)) of the range of A (randomized range finder with
+        power iterations, Halko et al.). Only A and matrices of k+oversample columns are stored
+    INPUTS:
+        A: matrix (rows x columns)
+        k: number of components
+        oversample: extra random directions
+        n_iter: power iterations (improve the accuracy when the singular values decay slowly)
+        rng: random generator
+    OUTPUTS:
+        Q: orthonormal basis of the approximate range of A
+    '''
+    l = min(k + oversample, min(A.shape))
+    omega = rng.standard_normal((A.shape[1], l)).astype(A.dtype)
+    Q, _ = np.linalg.qr(A.dot(omega))
+    for _ in range(n_iter):
+        Q, _ = np.linalg.qr(A.T.dot(Q))
+        Q, _ = np.linalg.qr(A.dot(Q))
+    return Q
+
+def top_components(Xc, k, method='randomized', oversample=10, n_iter=2, rng=np.random):
+    ''' Top k principal directions of the centered samples (columns) of Xc
+    INPUTS:
+        Xc: centered matrix (dimension x samples)
+        k: number of components
+        method: 'randomized' (randomized SVD, memory proportional to k) or 'eigh' (eigen
+            decomposition of the symmetric covariance, dimension x dimension)
+        oversample, n_iter, rng: parameters of randomized_range
+    OUTPUTS:
+        basis: principal directions as columns (dimension x k), sorted by decreasing variance
+        variance: variance of the samples along each direction
+        scores: projections of the samples on the basis (k x samples)
+    '''
+    k = min(k, min(Xc.shape))
+    n = Xc.shape[1]
+    if method == 'eigh':
+        cov = Xc.dot(Xc.T) / (n - 1)
+        values, vectors = np.linalg.eigh(cov, UPLO='L')
+        # eigh returns ascending eigen values and the eigen vectors as columns
+        basis = vectors[:, ::-1][:, :k]
+        return basis, values[::-1][:k], basis.T.dot(Xc)
+    Q = randomized_range(Xc, k, oversample, n_iter, rng)
+    U, s, Vt = np.linalg.svd(Q.T.dot(Xc), full_matrices=False)
+    # the scores come from the small SVD (U^T Q^T Xc = S V^T), without another product with Xc
+    return Q.dot(U[:, :k]), s[:k]**2 / (n - 1), s[:k, None] * Vt[:k]
+
+def storage_dtype(dtype, *arrays):
+    ''' dtype if it holds the values of all the arrays, float32 otherwise (float16 overflows to inf
+        above 65504, e.g. the scores of images with more than 8 bits)
+    '''
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        largest = max(float(np.abs(a).max()) if a.size else 0. for a in arrays)
+        if largest > float(np.finfo(dtype).max):
+            return np.dtype(np.float32)
+    return dtype
+
+def compress(img, k, method='randomized', dtype=np.float16, oversample=10, n_iter=2, seed=0):
+    ''' Compress an image with its top k principal components
+    INPUTS:
+        img: gray scale (H x W) or color (H x W x C) image
+        k: number of components
+        method: 'randomized' or 'eigh' (see top_components)
+        dtype: storage type of the basis, scores and mean (float16 suits 8 bit images; float32 is
+            used instead when the values exceed the range of dtype)
+        oversample, n_iter: parameters of the randomized range finder
+        seed: random seed of the range finder
+    OUTPUTS:
+        compressed: dict with the basis (H x k), scores (k x W*C), mean (H), the explained
+            variance ratio of each component and the shape/dtype of the original image
+    '''
+    img = np.asarray(img)
+    X = image_matrix(img).astype(np.float32)
+    mean = X.mean(axis=1)
+    Xc = X - mean[:, None]
+    basis, variance, scores = top_components(Xc, k, method, oversample, n_iter, np.random.RandomState(seed))
+    total = np.einsum('ij,ij->', Xc, Xc, dtype=np.float64) / (Xc.shape[1] - 1)
+    dtype = storage_dtype(dtype, basis, scores, mean)
+    return {'basis': basis.astype(dtype), 'scores': scores.astype(dtype), 'mean': mean.astype(dtype),
+            'explained_variance_ratio': variance / total if total > 0 else np.zeros_like(variance),
+            'shape': img.shape, 'dtype': img.dtype.str}
+
+def decompress(compressed, clip=True):
+    ''' Reconstruct the image of compress (basis * scores + mean), with the original shape and dtype
+    INPUTS:
+        compressed: dict returned by compress
+        clip: clip to the range of the original integer dtype
+    OUTPUTS:
+        img: reconstructed image
+    '''
+    basis = compressed['basis'].astype(np.float32)
+    X = basis.dot(compressed['scores'].astype(np.float32))
+    X += compressed['mean'].astype(np.float32)[:, None]
+    dtype = np.dtype(compressed['dtype'])
+    if np.issubdtype(dtype, np.integer):
+        if clip:
+            info = np.iinfo(dtype)
+            np.clip(X, info.min, info.max, out=X)
+        X = np.rint(X)
+    return X.astype(dtype).reshape(compressed['shape'])
+
+def compressed_size(compressed):
+    ''' Bytes of the stored arrays (basis, scores and mean) '''
+    return sum(compressed[key].nbytes for key in ('basis', 'scores', 'mean'))
+
+def psnr(original, approx, peak=255.):
+    ''' Peak signal to noise ratio in dB '''
+    mse = np.mean((np.asarray(original, dtype=np.float64) - np.asarray(approx, dtype=np.float64))**2)
+    return np.inf if mse == 0 else 10 * np.log10(peak**2 / mse)
+
+def synthetic_image(shape=(2160, 3840), seed=0):
+    ''' Smooth gray scale test image (sum of random sinusoids plus noise) '''
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float32)
+    img = np.zeros(shape, dtype=np.float32)
+    for _ in range(8):
+        fy, fx = rng.rand(2) * 0.02
+        img += rng.rand() * np.sin(fy * y + fx * x + rng.rand() * 6.28)
+    img = (img - img.min()) / (img.max() - img.min()) * 235 + rng.rand(*shape) * 20
+    return img.astype(np.uint8)
+
+def benchmark(img=None, k=50, reference=False):
+    ''' Time compress/decompress of the randomized and eigh methods (and, if reference is True,
+        the full covariance np.linalg.eig of the notebook) and report size and PSNR
+    INPUTS:
+        img: image (default: synthetic 4K gray scale image)
+        k: number of components
+        reference: also time np.linalg.eig of the full covariance (slow for large images)
+    OUTPUTS:
+        results: dict method -> (compress seconds, decompress seconds, bytes, psnr)
+    '''
+    img = synthetic_image() if img is None else img
+    results = {}
+    if reference:
+        start = time.perf_counter()
+        np.linalg.eig(np.cov(image_matrix(img).astype(np.float64)))
+        results['eig (notebook)'] = (time.perf_counter() - start, np.nan, np.nan, np.nan)
+    for method in ('randomized', 'eigh'):
+        start = time.perf_counter()
+        compressed = compress(img, k, method)
+        t_compress = time.perf_counter() - start
+        start = time.perf_counter()
+        approx = decompress(compressed)
+        t_decompress = time.perf_counter() - start
+        results[method] = (t_compress, t_decompress, compressed_size(compressed), psnr(img, approx))
+    print("image: %s, %d bytes, k = %d" % (img.shape, img.nbytes, k))
+    for method, (tc, td, size, quality) in results.items():
+        print("%-15s compress: %8.1f ms  decompress: %8.1f ms  bytes: %10.0f  PSNR: %6.2f dB"
+              % (method, tc*1e3, td*1e3, size, quality))
+    return results
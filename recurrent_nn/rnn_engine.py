@@ -0,0 +1,203 @@
+"""
+From scratch Elman RNN over whole sequences [batch, time, features]: the input projection of all
+the timesteps is one matrix product and only the recurrence h_t = tanh(p_t + h_{t-1} W_hh) is
+scanned (tf.scan in a tf.function for the Keras layer, a NumPy or numba kernel for the CPU)
+"""
+import time
+import numpy as np
+try:
+    import tensorflow as tf
+    from tensorflow.keras.layers import Layer
+except ImportError:
+    tf = None
+    Layer = object
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def input_projection(x, W_xh, b_h=None, time_major=False):
+    ''' x_t W_xh + b_h of every timestep with one matmul over the batch x time rows
+    INPUTS:
+        x: inputs (batch x time x features)
+        W_xh: input weights (features x units)
+        b_h: bias (units)
+        time_major: return the projection as time x batch x units (contiguous timesteps)
+    OUTPUTS:
+        projection: array (batch x time x units, or time x batch x units)
+    '''
+    batch, steps, features = x.shape
+    if time_major:
+        rows = x.transpose(1, 0, 2).reshape(steps * batch, features)
+        projection = np.dot(rows, W_xh).reshape(steps, batch, W_xh.shape[1])
+    else:
+        projection = np.dot(x.reshape(batch * steps, features), W_xh).reshape(batch, steps, W_xh.shape[1])
+    if b_h is not None:
+        projection += b_h
+    return projection
+
+def recurrence(projection, W_hh, h0, states):
+    ''' Scalar loops of the recurrence states[t] = tanh(projection[t] + states[t-1] W_hh) over
+        time-major arrays (compiled by numba when installed, the loops keep it in nopython mode)
+    '''
+    steps, batch, units = projection.shape
+    h = h0.copy()
+    for t in range(steps):
+        for b in range(batch):
+            for j in range(units):
+                acc = projection[t, b, j]
+                for k in range(units):
+                    acc += h[b, k] * W_hh[k, j]
+                states[t, b, j] = np.tanh(acc)
+        h[:, :] = states[t]
+    return states
+
+recurrence_kernel = njit(cache=True)(recurrence) if njit is not None else None
+
+def numpy_recurrence(projection, W_hh, h0, states):
+    ''' Recurrence over time-major arrays with one matmul, one add and one tanh per timestep,
+        all written in place in the contiguous state of the timestep
+    '''
+    h = h0
+    for p_t, h_t in zip(projection, states):
+        np.dot(h, W_hh, out=h_t)
+        h_t += p_t
+        np.tanh(h_t, out=h_t)
+        h = h_t
+    return states
+
+def rnn_scan(x, W_xh, W_hh, b_h=None, h0=None, kernel='auto', time_major=False):
+    ''' Hidden states of every timestep of a batch of sequences
+    INPUTS:
+        x: inputs (batch x time x features)
+        W_xh: input weights (features x units)
+        W_hh: recurrent weights (units x units)
+        b_h: bias (units)
+        h0: initial state (batch x units, default: zeros)
+        kernel: 'numba' (compiled loops, best for small batches and units), 'numpy' (a BLAS
+            matmul per timestep) or 'auto' (numba when installed and batch * units^2 is small)
+        time_major: return the contiguous time x batch x units states instead of a batch x time
+            x units view of them
+    OUTPUTS:
+        states: array (batch x time x units)
+    '''
+    x = np.asarray(x)
+    dtype = np.result_type(x.dtype, np.float32)
+    W_xh = np.asarray(W_xh, dtype=dtype)
+    W_hh = np.ascontiguousarray(W_hh, dtype=dtype)
+    b_h = None if b_h is None else np.asarray(b_h, dtype=dtype)
+    projection = input_projection(x.astype(dtype, copy=False), W_xh, b_h, time_major=True)
+    steps, batch, units = projection.shape
+    h0 = np.zeros((batch, units), dtype=dtype) if h0 is None else np.ascontiguousarray(h0, dtype=dtype)
+    states = np.empty_like(projection)
+    if kernel == 'auto':
+        # measured crossover: the scalar loops cost ~batch * units^2 per step, the NumPy step a few
+        # microseconds of call overhead plus vectorized work
+        kernel = 'numba' if recurrence_kernel is not None and batch * units * (units + 8) <= 1024 else 'numpy'
+    if kernel == 'numba':
+        if recurrence_kernel is None:
+            raise ImportError("the numba kernel needs numba")
+        recurrence_kernel(projection, W_hh, h0, states)
+    else:
+        numpy_recurrence(projection, W_hh, h0, states)
+    return states if time_major else states.transpose(1, 0, 2)
+
+def step_loop(x, W_xh, W_hh, b_h=None):
+    ''' Reference: one call per timestep like RNNCell.call (the input is projected at every step) '''
+    h = np.zeros((x.shape[0], W_hh.shape[0]), dtype=W_hh.dtype)
+    states = []
+    for t in range(x.shape[1]):
+        h = np.tanh(np.dot(x[:, t], W_xh) + np.dot(h, W_hh) + (0 if b_h is None else b_h))
+        states.append(h)
+    return np.stack(states, axis=1)
+
+def scan_states(projection, W_hh, h0):
+    ''' tf.scan of the recurrence over the time-major projection (time x batch x units) '''
+    return tf.scan(lambda h, p: tf.math.tanh(p + tf.matmul(h, W_hh)), projection, initializer=h0)
+
+class RNNLayer(Layer):
+    ''' Elman RNN layer with the weights in the convention of tf.keras.layers.SimpleRNN:
+        h_t = tanh(x_t W_xh + h_{t-1} W_hh + b_h), y_t = h_t W_hy + b_y
+    INPUTS:
+        rnn_units: size of the hidden state
+        output_dim: size of the outputs (None: the outputs are the hidden states)
+        compiled: run the scan in a tf.function
+    '''
+    def __init__(self, rnn_units, output_dim=None, compiled=True, **kwargs):
+        if tf is None:
+            raise ImportError("RNNLayer needs tensorflow")
+        super(RNNLayer, self).__init__(**kwargs)
+        self.rnn_units = rnn_units
+        self.output_dim = output_dim
+        self.scan = tf.function(scan_states) if compiled else scan_states
+
+    def build(self, input_shape):
+        input_dim = int(input_shape[-1])
+        self.W_xh = self.add_weight(name='W_xh', shape=(input_dim, self.rnn_units),
+                                    initializer='glorot_uniform', trainable=True)
+        self.W_hh = self.add_weight(name='W_hh', shape=(self.rnn_units, self.rnn_units),
+                                    initializer='orthogonal', trainable=True)
+        self.b_h = self.add_weight(name='b_h', shape=(self.rnn_units,), initializer='zeros', trainable=True)
+        if self.output_dim is not None:
+            self.W_hy = self.add_weight(name='W_hy', shape=(self.rnn_units, self.output_dim),
+                                        initializer='glorot_uniform', trainable=True)
+            self.b_y = self.add_weight(name='b_y', shape=(self.output_dim,), initializer='zeros', trainable=True)
+        super(RNNLayer, self).build(input_shape)
+
+    def call(self, x, h0=None):
+        ''' Outputs and hidden states of every timestep of x (batch x time x features) '''
+        x = tf.convert_to_tensor(x, dtype=self.compute_dtype)
+        # input projection of all the timesteps, time-major for the scan
+        projection = tf.einsum('btf,fu->tbu', x, tf.convert_to_tensor(self.W_xh)) + tf.convert_to_tensor(self.b_h)
+        if h0 is None:
+            h0 = tf.zeros([tf.shape(x)[0], self.rnn_units], dtype=x.dtype)
+        states = tf.transpose(self.scan(projection, tf.convert_to_tensor(self.W_hh), h0), [1, 0, 2])
+        if self.output_dim is None:
+            return states, states
+        outputs = tf.einsum('btu,uo->bto', states, tf.convert_to_tensor(self.W_hy)) + tf.convert_to_tensor(self.b_y)
+        return outputs, states
+
+def best_time(fun, repeat=3):
+    ''' Smallest wall time of repeat calls of fun (the first call warms up compilation) '''
+    fun()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def benchmark(batch=32, time_steps=2000, features=8, units=64, repeat=3, seed=0):
+    ''' Throughput (timesteps x sequences per second) of the per-step loop, the NumPy and numba
+        scans and, with tensorflow, of RNNLayer against tf.keras.layers.SimpleRNN with the same
+        weights, and largest difference of the hidden states
+    '''
+    rng = np.random.default_rng(seed)
+    x = rng.standard_normal((batch, time_steps, features)).astype(np.float32)
+    W_xh = (rng.standard_normal((features, units)) / np.sqrt(features)).astype(np.float32)
+    W_hh = np.linalg.qr(rng.standard_normal((units, units)))[0].astype(np.float32)
+    b_h = (0.1 * rng.standard_normal(units)).astype(np.float32)
+    reference = step_loop(x, W_xh, W_hh, b_h)
+    rates, errors = {}, {}
+    runs = {'step loop': lambda: step_loop(x, W_xh, W_hh, b_h),
+            'numpy scan': lambda: rnn_scan(x, W_xh, W_hh, b_h, kernel='numpy')}
+    if recurrence_kernel is not None:
+        runs['numba scan'] = lambda: rnn_scan(x, W_xh, W_hh, b_h, kernel='numba')
+    if tf is not None:
+        layer = RNNLayer(units)
+        layer.build(x.shape)
+        layer.set_weights([W_xh, W_hh, b_h])
+        simple_rnn = tf.keras.layers.SimpleRNN(units, return_sequences=True)
+        simple_rnn.build(x.shape)
+        simple_rnn.set_weights([W_xh, W_hh, b_h])
+        x_tf = tf.constant(x)
+        # both layers are called in a tf.function (graph mode, as inside model.fit/predict)
+        layer_call = tf.function(lambda inputs: layer(inputs)[1])
+        simple_rnn_call = tf.function(simple_rnn)
+        runs['RNNLayer (tf.scan)'] = lambda: layer_call(x_tf).numpy()
+        runs['keras SimpleRNN'] = lambda: simple_rnn_call(x_tf).numpy()
+    for name, run in runs.items():
+        errors[name] = float(np.abs(run() - reference).max())
+        rates[name] = batch * time_steps / best_time(run, repeat)
+        print("%-20s %12.0f steps/s   max difference %0.2e" % (name, rates[name], errors[name]))
+    return rates, errors
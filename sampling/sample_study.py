@@ -0,0 +1,137 @@
+"""
+Parallel Monte Carlo study of the convergence of samples to the population (Wasserstein distance
+against the sample size) with replicate bands and bootstrap confidence intervals of the mean
+"""
+import os
+import tempfile
+import numpy as np
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from sampler import population_cdf, wasserstein_to_population
+
+def count_distances(values, counts, size, replicates, rng):
+    ''' Wasserstein distances of replicate samples of a population with few distinct values. The
+        value counts of a sample without replacement follow the (multivariate) hypergeometric
+        distribution, so each replicate is drawn directly as counts and its distance is the
+        closed form sum |F - G| * dv over the support, O(distinct values) per sample
+    INPUTS:
+        values: sorted distinct values of the population
+        counts: population count of each value
+        size: sample size
+        replicates: number of samples
+        rng: np.random.Generator
+    OUTPUTS:
+        distances: array (replicates)
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    if len(values) == 1:
+        return np.zeros(replicates)
+    F = np.cumsum(counts)[:-1] / counts.sum()
+    dv = np.diff(values).astype(np.float64)
+    if len(values) == 2:
+        # 0/1 population: the distance is |p - ones/size| * (v1 - v0)
+        first = rng.hypergeometric(counts[0], counts[1], size, size=replicates)
+        return np.abs(F[0] - first / size) * dv[0]
+    sample_counts = rng.multivariate_hypergeometric(counts, size, size=replicates)
+    G = np.cumsum(sample_counts, axis=1)[:, :-1] / size
+    return np.abs(F - G).dot(dv)
+
+def replicate_block(args):
+    ''' Distances of a block of replicates of one sample size (runs in a worker process with its own
+        seeded stream)
+    INPUTS:
+        args: tuple (mode, payload, size, replicates, seed) where mode is 'counts' (payload: values
+            and counts) or 'data' (payload: population .npy file, values and cdf)
+    OUTPUTS:
+        distances: array (replicates)
+    '''
+    mode, payload, size, replicates, seed = args
+    rng = np.random.default_rng(seed)
+    if mode == 'counts':
+        values, counts = payload
+        return count_distances(values, counts, size, replicates, rng)
+    path, values, cdf = payload
+    data = np.load(path, mmap_mode='r')
+    return np.array([wasserstein_to_population(values, cdf, data[np.sort(rng.choice(len(data), size, replace=False))])
+                     for _ in range(replicates)])
+
+def bootstrap_mean_ci(samples, level=0.95, n_boot=1000, rng=None):
+    ''' Percentile bootstrap confidence interval of the mean of each row of samples (vectorized)
+    INPUTS:
+        samples: array (groups x replicates)
+        level: confidence level
+        n_boot: bootstrap resamples
+        rng: seed or np.random.Generator
+    OUTPUTS:
+        lower, upper: interval bounds of each group
+    '''
+    rng = np.random.default_rng(rng)
+    groups, r = samples.shape
+    idx = rng.integers(0, r, size=(n_boot, r))
+    means = samples[:, idx].mean(axis=2)
+    alpha = (1 - level) / 2
+    return np.quantile(means, alpha, axis=1), np.quantile(means, 1 - alpha, axis=1)
+
+def sample_size_study(data, sizes, replicates=1000, level=0.95, n_boot=1000, block=250,
+                      max_support=256, n_jobs=None, seed=0):
+    ''' Draw replicates samples of every size in parallel worker processes and summarize the
+        Wasserstein distance to the population
+    INPUTS:
+        data: population array
+        sizes: sample sizes
+        replicates: samples per size
+        level: level of the replicate band and of the bootstrap interval of the mean
+        n_boot: bootstrap resamples of the mean
+        block: replicates per task
+        max_support: populations with at most this number of distinct values use the closed form
+            of the class counts; the others draw the samples from a memory mapped copy of data
+        n_jobs: number of worker processes (default: number of cores)
+        seed: root seed, every task gets an independent stream (SeedSequence.spawn)
+    OUTPUTS:
+        results: dict with the sizes, the distances (sizes x replicates), their mean and std, the
+            replicate band (lower/upper quantiles) and the bootstrap interval of the mean
+    '''
+    data = np.asarray(data)
+    sizes = list(sizes)
+    values, cdf = population_cdf(data)
+    blocks = [(i, min(block, replicates - start)) for i in range(len(sizes)) for start in range(0, replicates, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks) + 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(values) <= max_support:
+            counts = np.round(np.diff(np.concatenate(([0.], cdf))) * len(data)).astype(np.int64)
+            payload = ('counts', (values, counts))
+        else:
+            path = os.path.join(tmp_dir, 'population.npy')
+            np.save(path, data)
+            payload = ('data', (path, values, cdf))
+        tasks = [(payload[0], payload[1], sizes[i], n, s) for (i, n), s in zip(blocks, seeds)]
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            parts = list(executor.map(replicate_block, tasks))
+    distances = np.zeros((len(sizes), replicates))
+    filled = np.zeros(len(sizes), dtype=np.int64)
+    for (i, n), part in zip(blocks, parts):
+        distances[i, filled[i]:filled[i]+n] = part
+        filled[i] += n
+    alpha = (1 - level) / 2
+    mean_lower, mean_upper = bootstrap_mean_ci(distances, level, n_boot, seeds[-1])
+    return {'sizes': np.array(sizes), 'distances': distances,
+            'mean': distances.mean(axis=1), 'std': distances.std(axis=1),
+            'lower': np.quantile(distances, alpha, axis=1), 'upper': np.quantile(distances, 1 - alpha, axis=1),
+            'mean_lower': mean_lower, 'mean_upper': mean_upper, 'level': level}
+
+def plot_study(results, title="Wasserstein distance vs sample size"):
+    ''' Mean distance per size with the replicate band and the bootstrap interval of the mean '''
+    sizes = results['sizes']
+    pct = int(round(results['level'] * 100))
+    plt.figure(figsize=(16,8))
+    plt.fill_between(sizes, results['lower'], results['upper'], color='grey', alpha=0.3, label="%d%% of the replicates" % pct)
+    plt.fill_between(sizes, results['mean_lower'], results['mean_upper'], color='b', alpha=0.3, label="%d%% bootstrap CI of the mean" % pct)
+    plt.plot(sizes, results['mean'], 'b-o', label="Mean distance")
+    plt.xscale('log')
+    plt.yscale('log')
+    plt.xlabel('Sample size')
+    plt.ylabel('Wasserstein distance')
+    plt.title(title)
+    plt.legend()
+    plt.grid()
+    plt.show()
@@ -0,0 +1,140 @@
+"""
+Sampling without replacement in O(k), reservoir sampling of streams, stratified sampling and
+Wasserstein distance of samples against a precomputed population distribution
+"""
+import numpy as np
+
+def generate_data(proportion=30, points=1000000, shuffle=True, rng=None):
+    ''' Population of 0/1 values with proportion % of ones (vectorized)
+    INPUTS:
+        proportion: percentage of ones
+        points: size of the population
+        shuffle: shuffle the population (sampling does not need it, the indices are uniform)
+        rng: seed or np.random.Generator
+    OUTPUTS:
+        data: uint8 array
+    '''
+    rng = np.random.default_rng(rng)
+    data = np.zeros(points, dtype=np.uint8)
+    data[:int(proportion*points/100)] = 1
+    if shuffle:
+        rng.shuffle(data)
+    return data
+
+def sample_indices(n, k, rng=None):
+    ''' k distinct indices of range(n). Generator.choice without replacement runs Floyd's algorithm
+        (hash set of the chosen indices) when k is small compared with n and a partial Fisher-Yates
+        shuffle otherwise, so the cost is O(k) draws instead of the O(k^2) scan of get_sample
+    '''
+    if k > n:
+        raise ValueError("sample size %d larger than the population %d" % (k, n))
+    return np.random.default_rng(rng).choice(n, k, replace=False)
+
+def get_sample(input_data, size=10, rng=None):
+    ''' Sample without replacement of size items of input_data '''
+    return input_data[sample_indices(len(input_data), size, rng)]
+
+def reservoir_sample(chunks, k, rng=None):
+    ''' Uniform sample of k items of a stream of unknown length (reservoir algorithm R, vectorized
+        over each chunk: item t replaces a random slot with probability k/(t+1))
+    INPUTS:
+        chunks: iterable of arrays
+        k: sample size
+        rng: seed or np.random.Generator
+    OUTPUTS:
+        reservoir: array with min(k, items seen) items
+    '''
+    rng = np.random.default_rng(rng)
+    reservoir = None
+    seen = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk)
+        if reservoir is None:
+            reservoir = np.empty((k,) + chunk.shape[1:], dtype=chunk.dtype)
+        # fill the reservoir with the first k items
+        fill = min(max(k - seen, 0), len(chunk))
+        reservoir[seen:seen+fill] = chunk[:fill]
+        t = seen + fill + np.arange(len(chunk) - fill)
+        seen += len(chunk)
+        if len(t) == 0:
+            continue
+        slot = (rng.random(len(t)) * (t + 1)).astype(np.int64)
+        accepted = np.flatnonzero(slot < k)
+        # when several items hit the same slot the last one wins (sequential algorithm)
+        last = len(accepted) - 1 - np.unique(slot[accepted][::-1], return_index=True)[1]
+        reservoir[slot[accepted[last]]] = chunk[fill + accepted[last]]
+    if reservoir is None:
+        return np.empty(0)
+    return reservoir[:min(k, seen)]
+
+def allocate(counts, size):
+    ''' Proportional allocation of size items to strata of the given counts (largest remainders) '''
+    counts = np.asarray(counts)
+    quota = size * counts / counts.sum()
+    alloc = np.floor(quota).astype(np.int64)
+    remainder = size - alloc.sum()
+    alloc[np.argsort(alloc - quota, kind='stable')[:remainder]] += 1
+    return np.minimum(alloc, counts)
+
+def stratified_sample(strata, size, rng=None):
+    ''' Indices of a stratified sample without replacement: each stratum contributes in proportion to its size
+    INPUTS:
+        strata: stratum label of every row
+        size: total sample size
+        rng: seed or np.random.Generator
+    OUTPUTS:
+        idx: sampled row indices, grouped by stratum
+    '''
+    rng = np.random.default_rng(rng)
+    strata = np.asarray(strata)
+    labels, counts = np.unique(strata, return_counts=True)
+    alloc = allocate(counts, size)
+    idx = []
+    for label, n in zip(labels, alloc):
+        rows = np.flatnonzero(strata == label)
+        idx.append(rows[sample_indices(len(rows), n, rng)])
+    return np.concatenate(idx)
+
+def population_cdf(data):
+    ''' Distinct values and cumulative distribution of a population, computed once (bincount for
+        small non negative integers, np.unique otherwise)
+    OUTPUTS:
+        values: sorted distinct values
+        cdf: fraction of the population <= each value
+    '''
+    data = np.asarray(data)
+    if np.issubdtype(data.dtype, np.integer) and data.min() >= 0 and data.max() < 2**16:
+        counts = np.bincount(data)
+        values = np.flatnonzero(counts)
+        counts = counts[values]
+    else:
+        values, counts = np.unique(data, return_counts=True)
+    return values, np.cumsum(counts) / counts.sum()
+
+def wasserstein_to_population(values, cdf, sample):
+    ''' 1-Wasserstein distance between a sample and a population given by population_cdf: the
+        integral of |F - G| over the union of both supports, without touching the population rows
+        (same value as scipy.stats.wasserstein_distance(data, sample))
+    '''
+    sample = np.sort(np.asarray(sample), kind='stable')
+    grid = np.union1d(values, sample)
+    pos = np.searchsorted(values, grid, side='right') - 1
+    F = np.where(pos >= 0, cdf[np.maximum(pos, 0)], 0.)
+    G = np.searchsorted(sample, grid, side='right') / len(sample)
+    return np.sum(np.abs(F - G)[:-1] * np.diff(grid))
+
+def wasserstein_sweep(data, sizes, rng=None, cdf=None):
+    ''' Wasserstein distance between the population and one sample of each size
+    INPUTS:
+        data: population
+        sizes: sample sizes
+        rng: seed or np.random.Generator
+        cdf: precomputed population_cdf(data)
+    OUTPUTS:
+        w_distance: distance of each size
+        samples: the sample of each size
+    '''
+    rng = np.random.default_rng(rng)
+    values, cdf = population_cdf(data) if cdf is None else cdf
+    samples = [get_sample(data, size, rng) for size in sizes]
+    return np.array([wasserstein_to_population(values, cdf, s) for s in samples]), samples
@@ -0,0 +1,262 @@
+"""
+Self-Organizing Map engine: vectorized online trainer and mini-batch batch-SOM trainer
+"""
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Squared norms of the cells of the SOM grid (m x n)
+def codebook_norms(SOM):
+    return np.einsum('ijk,ijk->ij', SOM, SOM)
+
+# Return the (g,h) index of the BMU in the grid. The distance ||w||^2 - 2 w.x
+# (||x||^2 is the same for every cell) is computed with one matrix-vector product
+def find_BMU(SOM, x, norms=None):
+    m, n, d = SOM.shape
+    if norms is None:
+        norms = codebook_norms(SOM)
+    dist = norms.ravel() - 2 * SOM.reshape(-1, d).dot(x)
+    return divmod(int(np.argmin(dist)), n)
+
+# Rows per block so that a block of the distance matrix has about max_entries entries
+def distance_block_size(cells, max_entries=2**22):
+    return max(1, max_entries // cells)
+
+# Return the flat index of the BMU of every row of X, computing the distance
+# matrix ||w||^2 - 2 X W^T by blocks of block_size rows (in place, without temporaries)
+def find_BMUs(SOM, X, block_size=None, norms=None):
+    m, n, d = SOM.shape
+    if block_size is None:
+        block_size = distance_block_size(m * n)
+    if norms is None:
+        norms = codebook_norms(SOM)
+    norms = norms.ravel()
+    W_T = np.ascontiguousarray(-2 * SOM.reshape(-1, d).T)
+    bmus = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), block_size):
+        block = np.asarray(X[start:start+block_size], dtype=W_T.dtype)
+        dist = block.dot(W_T)
+        dist += norms
+        bmus[start:start+len(block)] = np.argmin(dist, axis=1)
+    return bmus
+
+# BMU search over a fixed codebook (trained SOM or the SOM of the current batch epoch).
+# The codebook norms and -2W^T are precomputed, so each lookup is one matrix-vector product
+# ('brute'); for low dimensional data a KD-tree over the codebook can be used ('kdtree',
+# requires scipy), and for streams of similar examples a local search that starts from the
+# previous BMU and moves over the grid while a neighbor cell is closer ('local', approximate)
+class BMUSearch:
+    def __init__(self, SOM, method='auto', leaf_size=16):
+        self.m, self.n, self.d = SOM.shape
+        self.W = np.ascontiguousarray(SOM.reshape(-1, self.d), dtype=np.float64)
+        self.W_T = np.ascontiguousarray(-2 * self.W.T)
+        self.norms = np.einsum('ij,ij->i', self.W, self.W)
+        if method == 'auto':
+            method = 'kdtree' if cKDTree is not None and self.d <= 16 else 'brute'
+        if method == 'kdtree' and cKDTree is None:
+            raise ImportError("method='kdtree' requires scipy")
+        self.method = method
+        self.tree = cKDTree(self.W, leafsize=leaf_size) if method == 'kdtree' else None
+        self.previous = None
+
+    # flat index of the BMU of a single example
+    def query(self, x, previous=None):
+        x = np.asarray(x, dtype=np.float64)
+        if self.method == 'kdtree':
+            return int(self.tree.query(x)[1])
+        if self.method == 'local':
+            start = self.previous if previous is None else previous
+            self.previous = self.local_search(x, start) if start is not None else self.brute(x)
+            return self.previous
+        return self.brute(x)
+
+    def brute(self, x):
+        return int(np.argmin(self.norms + x.dot(self.W_T)))
+
+    # greedy descent over the 3x3 grid neighborhood starting from the flat index start
+    def local_search(self, x, start):
+        g, h = divmod(int(start), self.n)
+        for _ in range(self.m + self.n):
+            i0, i1 = max(0, g-1), min(self.m, g+2)
+            j0, j1 = max(0, h-1), min(self.n, h+2)
+            cells = (np.arange(i0, i1)[:, None] * self.n + np.arange(j0, j1)[None, :]).ravel()
+            best = cells[np.argmin(self.norms[cells] + x.dot(self.W_T[:, cells]))]
+            if best == g * self.n + h:
+                break
+            g, h = divmod(int(best), self.n)
+        return g * self.n + h
+
+    # flat index of the BMU of every row of X (blocked distance products or KD-tree)
+    def query_batch(self, X, block_size=None):
+        X = np.asarray(X, dtype=np.float64)
+        if block_size is None:
+            block_size = distance_block_size(self.m * self.n)
+        if self.method == 'kdtree':
+            return self.tree.query(X)[1].astype(np.int64)
+        if self.method == 'local':
+            bmus = np.empty(len(X), dtype=np.int64)
+            for i, x in enumerate(X):
+                bmus[i] = self.query(x)
+            return bmus
+        bmus = np.empty(len(X), dtype=np.int64)
+        for start in range(0, len(X), block_size):
+            dist = X[start:start+block_size].dot(self.W_T)
+            dist += self.norms
+            bmus[start:start+len(dist)] = np.argmin(dist, axis=1)
+        return bmus
+
+    # map the rows of X to (g,h) grid coordinates, by chunks processed in a thread pool
+    # (the distance products and the KD-tree queries release the GIL)
+    def predict(self, X, chunk_size=65536, n_threads=None):
+        chunks = [X[start:start+chunk_size] for start in range(0, len(X), chunk_size)]
+        if self.method == 'local' or len(chunks) <= 1:
+            bmus = [self.query_batch(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                bmus = list(executor.map(self.query_batch, chunks))
+        bmus = np.concatenate(bmus) if bmus else np.zeros(0, dtype=np.int64)
+        return np.column_stack(divmod(bmus, self.n))
+
+# Map the rows of X to the (g,h) grid coordinates of their BMUs in a trained SOM
+def predict(SOM, X, method='auto', chunk_size=65536, n_threads=None):
+    return BMUSearch(SOM, method).predict(X, chunk_size, n_threads)
+
+# Gaussian neighborhood window for offsets -step..step-1 (same window as update_weights
+# of the notebook: range(g-step, g+step))
+def neighborhood_kernel(radius_sq, step=3):
+    offsets = np.arange(-step, step)
+    dist_sq = offsets[:, None]**2 + offsets[None, :]**2
+    return np.exp(-dist_sq / 2 / radius_sq)
+
+# Update the weights of the SOM cells when given a single training example. The window
+# around the BMU is updated with one vectorized operation; if norms is given, the squared
+# norms of the updated cells are refreshed
+def update_weights(SOM, train_ex, learn_rate, radius_sq, BMU_coord, step=3, kernel=None, norms=None):
+    g, h = BMU_coord
+    #if radius is close to zero then only BMU is changed
+    if radius_sq < 1e-3:
+        SOM[g,h,:] += learn_rate * (train_ex - SOM[g,h,:])
+        if norms is not None:
+            norms[g,h] = SOM[g,h,:].dot(SOM[g,h,:])
+        return SOM
+    if kernel is None:
+        kernel = neighborhood_kernel(radius_sq, step)
+    # Change all cells in a small neighborhood of BMU
+    i0, i1 = max(0, g-step), min(SOM.shape[0], g+step)
+    j0, j1 = max(0, h-step), min(SOM.shape[1], h+step)
+    f = kernel[i0-g+step:i1-g+step, j0-h+step:j1-h+step]
+    window = SOM[i0:i1, j0:j1, :]
+    window += (learn_rate * f)[:, :, None] * (train_ex - window)
+    if norms is not None:
+        norms[i0:i1, j0:j1] = np.einsum('ijk,ijk->ij', window, window)
+    return SOM
+
+# Online SOM training (one example at a time) with vectorized BMU search and window
+# update. It follows the same schedule as train_SOM of the notebook
+def train_SOM(SOM, train_data, learn_rate = .1, radius_sq = 1,
+              lr_decay = .1, radius_decay = .1, epochs = 10, step = 3, rng = np.random):
+    learn_rate_0 = learn_rate
+    radius_0 = radius_sq
+    for epoch in np.arange(0, epochs):
+        rng.shuffle(train_data)
+        kernel = neighborhood_kernel(radius_sq, step) if radius_sq >= 1e-3 else None
+        norms = codebook_norms(SOM)
+        for train_ex in train_data:
+            g, h = find_BMU(SOM, train_ex, norms)
+            SOM = update_weights(SOM, train_ex, learn_rate, radius_sq, (g,h),
+                                 step, kernel, norms)
+        # Update learning rate and radius
+        learn_rate = learn_rate_0 * np.exp(-epoch * lr_decay)
+        radius_sq = radius_0 * np.exp(-epoch * radius_decay)
+    return SOM
+
+# Batch SOM training. For every mini-batch the BMUs are found with one distance-matrix
+# product and the examples are accumulated per BMU (sums and counts). At the end of the
+# epoch each cell moves to the neighborhood-weighted centroid of the examples; the gaussian
+# neighborhood is separable, so the weighting is two small matrix products over the grid
+# axes instead of a (m*n x m*n) matrix. learn_rate=1 is the classic batch SOM
+def train_SOM_batch(SOM, train_data, radius_sq = 1, radius_decay = .1, epochs = 10,
+                    learn_rate = 1., lr_decay = 0., batch_size = 65536, block_size = None,
+                    bmu_method = 'brute'):
+    m, n, d = SOM.shape
+    learn_rate_0 = learn_rate
+    radius_0 = radius_sq
+    grid_m = np.arange(m)
+    grid_n = np.arange(n)
+    for epoch in np.arange(0, epochs):
+        sums = np.zeros((m * n, d))
+        counts = np.zeros(m * n)
+        # the codebook is fixed during the epoch, so the BMU search structures are built once
+        search = BMUSearch(SOM, bmu_method)
+        for start in range(0, len(train_data), batch_size):
+            batch = np.asarray(train_data[start:start+batch_size], dtype=np.float64)
+            bmus = search.query_batch(batch, block_size)
+            counts += np.bincount(bmus, minlength=m * n)
+            for k in range(d):
+                sums[:, k] += np.bincount(bmus, weights=batch[:, k], minlength=m * n)
+        # neighborhood weights along each axis of the grid
+        radius = max(radius_sq, 1e-12)
+        G_m = np.exp(-np.square(grid_m[:, None] - grid_m[None, :]) / 2 / radius)
+        G_n = np.exp(-np.square(grid_n[:, None] - grid_n[None, :]) / 2 / radius)
+        num = np.einsum('ig,ghk,jh->ijk', G_m, sums.reshape(m, n, d), G_n)
+        den = G_m.dot(counts.reshape(m, n)).dot(G_n.T)
+        mask = den > 1e-12
+        target = np.where(mask[:, :, None], num / np.where(mask, den, 1)[:, :, None], SOM)
+        SOM += learn_rate * (target - SOM)
+        # Update learning rate and radius
+        learn_rate = learn_rate_0 * np.exp(-epoch * lr_decay)
+        radius_sq = radius_0 * np.exp(-epoch * radius_decay)
+    return SOM
+
+# Reference trainer of the notebook (per example BMU scan and python double loop)
+def train_SOM_reference(SOM, train_data, learn_rate = .1, radius_sq = 1,
+                        lr_decay = .1, radius_decay = .1, epochs = 10, step = 3, rng = np.random):
+    learn_rate_0 = learn_rate
+    radius_0 = radius_sq
+    for epoch in np.arange(0, epochs):
+        rng.shuffle(train_data)
+        for train_ex in train_data:
+            distSq = (np.square(SOM - train_ex)).sum(axis=2)
+            g, h = np.unravel_index(np.argmin(distSq, axis=None), distSq.shape)
+            if radius_sq < 1e-3:
+                SOM[g,h,:] += learn_rate * (train_ex - SOM[g,h,:])
+                continue
+            for i in range(max(0, g-step), min(SOM.shape[0], g+step)):
+                for j in range(max(0, h-step), min(SOM.shape[1], h+step)):
+                    dist_sq = np.square(i - g) + np.square(j - h)
+                    dist_func = np.exp(-dist_sq / 2 / radius_sq)
+                    SOM[i,j,:] += learn_rate * dist_func * (train_ex - SOM[i,j,:])
+        learn_rate = learn_rate_0 * np.exp(-epoch * lr_decay)
+        radius_sq = radius_0 * np.exp(-epoch * radius_decay)
+    return SOM
+
+# Quantization error: mean distance of each example to its BMU
+def quantization_error(SOM, X, block_size=None):
+    m, n, d = SOM.shape
+    bmus = find_BMUs(SOM, X, block_size)
+    return np.mean(np.linalg.norm(np.asarray(X, dtype=np.float64) - SOM.reshape(-1, d)[bmus], axis=1))
+
+# Time the reference trainer of the notebook against the online and batch trainers
+# (samples per second and quantization error after the same number of epochs)
+def benchmark(m=100, n=100, n_x=20000, d=3, epochs=2, seed=0):
+    rand = np.random.RandomState(seed)
+    train_data = rand.randint(0, 255, (n_x, d)).astype(float)
+    SOM_0 = rand.randint(0, 255, (m, n, d)).astype(float)
+    results = {}
+    for name, trainer in [('reference', train_SOM_reference), ('online', train_SOM), ('batch', train_SOM_batch)]:
+        data = train_data.copy()
+        kwargs = {'epochs': epochs}
+        if name != 'batch':
+            kwargs['rng'] = np.random.RandomState(seed)
+        start = time.perf_counter()
+        SOM = trainer(SOM_0.copy(), data, **kwargs)
+        elapsed = time.perf_counter() - start
+        results[name] = {'seconds': elapsed, 'samples_per_s': n_x * epochs / elapsed,
+                         'quantization_error': quantization_error(SOM, train_data)}
+        print("%-10s %10.3f s %14.0f samples/s  QE %8.3f" % (name, elapsed, results[name]['samples_per_s'],
+                                                             results[name]['quantization_error']))
+    return results
@@ -0,0 +1,309 @@
+"""
+Natural cubic splines: second derivatives solved once in O(n), per interval cubic coefficients
+and vectorized evaluation (bucket table interval lookup + Horner's rule), and batched/streaming
+interpolation of many series that share one x grid
+"""
+import numpy as np
+try:
+    from scipy.linalg.lapack import dgttrf, dgttrs
+except ImportError:
+    dgttrf = dgttrs = None
+
+class TridiagonalFactor:
+    ''' Factorization of a tridiagonal matrix, computed once and reused for any number of right
+        hand sides (LAPACK gttrf/gttrs when scipy is installed and n > 2, the sizes gttrf accepts,
+        Thomas algorithm otherwise)
+    '''
+    def __init__(self, lower, diag, upper):
+        self.n = len(diag)
+        lower = np.asarray(lower, dtype=np.float64)
+        diag = np.asarray(diag, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        if dgttrf is not None and self.n > 2:
+            self.lu = dgttrf(lower, diag, upper)[:5]
+            if np.any(self.lu[1] == 0):
+                raise ValueError("singular tridiagonal matrix")
+            return
+        self.lu = None
+        # Thomas algorithm: forward elimination factors (w: pivots, cp: modified upper diagonal)
+        self.lower = lower
+        self.w = np.empty(self.n)
+        self.cp = np.empty(max(self.n-1, 0))
+        self.w[0] = diag[0]
+        for i in range(1, self.n):
+            self.cp[i-1] = upper[i-1] / self.w[i-1]
+            self.w[i] = diag[i] - lower[i-1] * self.cp[i-1]
+
+    def solve(self, rhs):
+        ''' Solve the system for rhs (n) or for the columns of rhs (n x m) '''
+        rhs = np.asarray(rhs, dtype=np.float64)
+        b = rhs.reshape(self.n, -1)
+        if self.lu is not None:
+            x, info = dgttrs(*self.lu, b)
+            return x.reshape(rhs.shape)
+        x = np.empty_like(b)
+        x[0] = b[0] / self.w[0]
+        for i in range(1, self.n):
+            x[i] = (b[i] - self.lower[i-1] * x[i-1]) / self.w[i]
+        for i in range(self.n-2, -1, -1):
+            x[i] -= self.cp[i] * x[i+1]
+        return x.reshape(rhs.shape)
+
+def spline_system(x):
+    ''' Factorization of the tridiagonal system of the interior second derivatives of a natural
+        spline over the knots x (sorted, distinct)
+    '''
+    h = np.diff(x)
+    if len(h) < 2:
+        return None
+    return TridiagonalFactor(h[1:-1], 2 * (h[:-1] + h[1:]), h[1:-1])
+
+def second_derivatives(x, y, system=None):
+    ''' Second derivatives of the natural spline at the knots (zero at both ends)
+    INPUTS:
+        x: sorted distinct knots (n)
+        y: values at the knots (n) or (n x m) for m series over the same knots
+        system: factorization of spline_system(x) (computed if not given)
+    OUTPUTS:
+        M: second derivatives, same shape as y
+    '''
+    h = np.diff(x)
+    M = np.zeros(np.shape(y))
+    if len(h) < 2:
+        return M
+    if system is None:
+        system = spline_system(x)
+    slope = np.diff(y, axis=0) / (h if np.ndim(y) == 1 else h[:, None])
+    M[1:-1] = system.solve(6 * np.diff(slope, axis=0))
+    return M
+
+def spline_coefficients(x, y, M):
+    ''' Cubic of each interval in the local variable t = x - x[i]: a + b t + c t^2 + d t^3
+    OUTPUTS:
+        coef: array (n-1, 4, ...) with the coefficients a, b, c, d of each interval
+    '''
+    h = np.diff(x)
+    if np.ndim(y) > 1:
+        h = h[:, None]
+    a = y[:-1]
+    b = np.diff(y, axis=0) / h - h * (2 * M[:-1] + M[1:]) / 6
+    c = M[:-1] / 2
+    d = np.diff(M, axis=0) / (6 * h)
+    return np.stack((a, b, c, d), axis=1)
+
+def horner(coef, t, nu=0):
+    ''' Evaluate the cubics coef (q, 4, ...) (or their nu-th derivative) at the local offsets t '''
+    if coef.ndim > 2:
+        t = t.reshape(t.shape + (1,) * (coef.ndim - 2))
+    a, b, c, d = coef[:, 0], coef[:, 1], coef[:, 2], coef[:, 3]
+    if nu == 0:
+        return ((d * t + c) * t + b) * t + a
+    if nu == 1:
+        return (3 * d * t + 2 * c) * t + b
+    if nu == 2:
+        return 6 * d * t + 2 * c
+    if nu == 3:
+        return 6 * d * np.ones_like(t)
+    return np.zeros_like(a * t)
+
+def interval_buckets(x):
+    ''' Uniform bucket table over [x[0], x[-1]] with one bucket per interval: the first interval
+        that can contain the points of each bucket
+    OUTPUTS:
+        scale: buckets per unit of x
+        start: interval of the left edge of each bucket (minus one, against rounding)
+    '''
+    n_buckets = len(x) - 1
+    scale = n_buckets / (x[-1] - x[0])
+    edges = x[0] + np.arange(n_buckets) / scale
+    start = np.searchsorted(x, edges, side='right') - 2
+    return scale, np.clip(start, 0, len(x) - 2)
+
+def locate_intervals(x, x_new, scale, start, max_steps=4):
+    ''' Interval i (x[i] <= x_new < x[i+1], clipped to the end intervals) of every query point.
+        The bucket of a point gives a first guess that is moved right by a few vectorized steps;
+        searchsorted (about log2(n) random accesses per point) is only used for the points still
+        unresolved, in buckets crowded with knots
+    '''
+    last = len(x) - 2
+    b = (x_new - x[0]) * scale
+    # fmax/fmin also map NaN queries to a valid bucket (they evaluate to NaN anyway)
+    np.fmin(np.fmax(b, 0, out=b), len(start) - 1, out=b)
+    i = start[b.astype(np.int64)]
+    active = np.arange(len(x_new))
+    for _ in range(max_steps):
+        ii = i[active]
+        step = (ii < last) & (x[np.minimum(ii + 1, last + 1)] <= x_new[active])
+        active = active[step]
+        if len(active) == 0:
+            return i
+        i[active] += 1
+    i[active] = np.clip(np.searchsorted(x, x_new[active], side='right') - 1, 0, last)
+    return i
+
+class NaturalSpline:
+    ''' Natural cubic spline through the points (x, y). The knots are sorted once, the second
+        derivatives are solved once in O(n) and the cubic coefficients of every interval are kept
+        in a flat (n-1, 4) array, so evaluating q points costs an interval lookup and a Horner step
+    '''
+    def __init__(self, x, y, assume_sorted=False):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) < 2 or len(x) != len(y):
+            raise ValueError("at least 2 points with the same number of x and y values are required")
+        if not assume_sorted:
+            order = np.argsort(x, kind='stable')
+            x, y = x[order], y[order]
+        if np.any(np.diff(x) <= 0):
+            raise ValueError("x values must be distinct")
+        self.x = x
+        self.y = y
+        self.M = second_derivatives(x, y)
+        self.coef = spline_coefficients(x, y, self.M)
+        self.bucket_scale, self.bucket_start = interval_buckets(x)
+
+    def locate(self, x_new):
+        ''' Interval of every query point (see locate_intervals) '''
+        return locate_intervals(self.x, x_new, self.bucket_scale, self.bucket_start)
+
+    def __call__(self, x_new, nu=0, extrapolate=True, chunk_size=2**20):
+        ''' Evaluate the spline (or its derivative of order nu) at x_new
+        INPUTS:
+            x_new: query points (any shape)
+            nu: order of the derivative (0: value)
+            extrapolate: evaluate the end cubics outside [x[0], x[-1]] (NaN otherwise)
+            chunk_size: points evaluated at once (bounds the temporaries)
+        OUTPUTS:
+            values: array with the shape of x_new
+        '''
+        x_new = np.asarray(x_new, dtype=np.float64)
+        flat = x_new.ravel()
+        out = np.empty(flat.shape + self.coef.shape[2:])
+        for start in range(0, len(flat), chunk_size):
+            xq = flat[start:start+chunk_size]
+            i = self.locate(xq)
+            out[start:start+len(xq)] = horner(self.coef[i], xq - self.x[i], nu)
+        if not extrapolate:
+            out[(flat < self.x[0]) | (flat > self.x[-1])] = np.nan
+        return out.reshape(x_new.shape + self.coef.shape[2:])
+
+    def derivative(self, x_new, nu=1, extrapolate=True):
+        ''' Derivative of order nu at x_new '''
+        return self(x_new, nu, extrapolate)
+
+class SplineGrid:
+    ''' Natural splines of many series sampled on one shared x grid. The tridiagonal system depends
+        only on x, so it is factorized once and the second derivatives of a whole chunk of series are
+        solved together (one multiple right hand side solve); the intervals and weights of the query
+        points are also computed once, so interpolating a chunk costs four gathered products
+    '''
+    def __init__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) < 2:
+            raise ValueError("at least 2 points are required")
+        self.order = np.argsort(x, kind='stable')
+        self.x = x[self.order]
+        if np.any(np.diff(self.x) <= 0):
+            raise ValueError("x values must be distinct")
+        if np.all(self.order == np.arange(len(x))):
+            self.order = None
+        self.system = spline_system(self.x)
+        self.bucket_scale, self.bucket_start = interval_buckets(self.x)
+        self.plans = {}
+
+    def plan(self, x_new, nu=0):
+        ''' Interval and weights of every query point, so that the spline (or its derivative of
+            order nu <= 2) is wa*y[i] + wb*y[i+1] + wc*M[i] + wd*M[i+1]
+        '''
+        x_new = np.asarray(x_new, dtype=np.float64).ravel()
+        i = locate_intervals(self.x, x_new, self.bucket_scale, self.bucket_start)
+        h = self.x[i+1] - self.x[i]
+        A = (self.x[i+1] - x_new) / h
+        B = 1 - A
+        if nu == 0:
+            weights = (A, B, (A**3 - A) * h**2 / 6, (B**3 - B) * h**2 / 6)
+        elif nu == 1:
+            weights = (-1 / h, 1 / h, -(3 * A**2 - 1) * h / 6, (3 * B**2 - 1) * h / 6)
+        elif nu == 2:
+            zero = np.zeros_like(A)
+            weights = (zero, zero, A, B)
+        else:
+            raise ValueError("derivatives of order 0, 1 or 2 are supported")
+        return i, tuple(w[:, None] for w in weights)
+
+    def second_derivatives(self, Y):
+        ''' Second derivatives at the knots of every series
+        INPUTS:
+            Y: series as rows (m x n), values at the (unsorted) x given to the constructor
+        OUTPUTS:
+            M: second derivatives (n x m), knots sorted, one column per series
+            Yt: the series as columns (n x m), knots sorted
+        '''
+        Y = np.asarray(Y, dtype=np.float64)
+        if self.order is not None:
+            Y = Y[:, self.order]
+        Yt = np.ascontiguousarray(Y.T)
+        return second_derivatives(self.x, Yt, self.system), Yt
+
+    def interpolate(self, Y, x_new, nu=0):
+        ''' Evaluate the splines of all the series of Y at x_new
+        INPUTS:
+            Y: series as rows (m x n)
+            x_new: query points (q)
+            nu: order of the derivative (0, 1 or 2)
+        OUTPUTS:
+            values: array (m x q)
+        '''
+        key = (id(x_new), nu)
+        if key not in self.plans or self.plans[key][0] is not x_new:
+            self.plans = {key: (x_new, self.plan(x_new, nu))}
+        i, (wa, wb, wc, wd) = self.plans[key][1]
+        M, Yt = self.second_derivatives(Y)
+        out = wa * Yt[i]
+        out += wb * Yt[i+1]
+        out += wc * M[i]
+        out += wd * M[i+1]
+        return out.T
+
+    def iter_interpolate(self, chunks, x_new, nu=0):
+        ''' Interpolate a stream of chunks of series (each chunk c x n), yielding c x q chunks '''
+        for chunk in chunks:
+            yield self.interpolate(chunk, x_new, nu)
+
+def interpolate_stream(x, series, x_new, out=None, chunk_series=4096, nu=0, dtype=np.float64):
+    ''' Interpolate many series sharing the grid x without holding all of them in memory
+    INPUTS:
+        x: shared grid (n)
+        series: array or np.memmap of series as rows (m x n), or iterable of chunks (c x n)
+        x_new: query points (q)
+        out: output array/np.memmap (m x q), or file name of a .npy file created as a memmap
+            (required for iterables of unknown length); default: new array
+        chunk_series: series interpolated together (arrays and memmaps)
+        nu: order of the derivative (0, 1 or 2)
+        dtype: dtype of the output created by this function
+    OUTPUTS:
+        out: interpolated series (m x q)
+    '''
+    grid = SplineGrid(x)
+    x_new = np.asarray(x_new, dtype=np.float64).ravel()
+    if hasattr(series, 'shape'):
+        m = series.shape[0]
+        chunks = (series[start:start+chunk_series] for start in range(0, m, chunk_series))
+    else:
+        m = None
+        chunks = iter(series)
+    if isinstance(out, str):
+        if m is None:
+            raise ValueError("the number of series is required to create %s" % out)
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(m, len(x_new)))
+    elif out is None:
+        if m is None:
+            return np.concatenate(list(grid.iter_interpolate(chunks, x_new, nu)))
+        out = np.empty((m, len(x_new)), dtype=dtype)
+    row = 0
+    for values in grid.iter_interpolate(chunks, x_new, nu):
+        out[row:row+len(values)] = values
+        row += len(values)
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
@@ -0,0 +1,33 @@
+"""
+Tests of the natural splines against scipy.interpolate.CubicSpline with natural end conditions
+"""
+import numpy as np
+import pytest
+from scipy.interpolate import CubicSpline
+from natural_spline import NaturalSpline, SplineGrid, TridiagonalFactor
+
+@pytest.mark.parametrize('n_knots', [2, 3, 4, 5])
+def test_natural_spline_small_grids(n_knots):
+    x = np.sort(np.random.RandomState(n_knots).rand(n_knots)) * 10
+    y = np.sin(x)
+    x_new = np.linspace(x[0], x[-1], 50)
+    reference = CubicSpline(x, y, bc_type='natural')
+    np.testing.assert_allclose(NaturalSpline(x, y)(x_new), reference(x_new), atol=1e-10)
+    np.testing.assert_allclose(NaturalSpline(x, y)(x_new, nu=1), reference(x_new, 1), atol=1e-10)
+
+@pytest.mark.parametrize('n_knots', [2, 3, 4, 5])
+def test_spline_grid_small_grids(n_knots):
+    x = np.sort(np.random.RandomState(n_knots).rand(n_knots)) * 10
+    Y = np.random.RandomState(0).rand(3, n_knots)
+    x_new = np.linspace(x[0], x[-1], 50)
+    expected = np.array([CubicSpline(x, y, bc_type='natural')(x_new) for y in Y])
+    np.testing.assert_allclose(SplineGrid(x).interpolate(Y, x_new), expected, atol=1e-10)
+
+@pytest.mark.parametrize('n', [1, 2, 3, 10])
+def test_tridiagonal_factor(n):
+    rng = np.random.RandomState(n)
+    lower, upper = rng.rand(n - 1), rng.rand(n - 1)
+    diag = 4 + rng.rand(n)
+    A = np.diag(diag) + np.diag(lower, -1) + np.diag(upper, 1)
+    rhs = rng.rand(n, 2)
+    np.testing.assert_allclose(TridiagonalFactor(lower, diag, upper).solve(rhs), np.linalg.solve(A, rhs))
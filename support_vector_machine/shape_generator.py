@@ -0,0 +1,328 @@
+"""
+Vectorized generators of labeled inside/outside points of circles, triangles, squares and arbitrary
+polygons for the SVM experiments (seeded np.random.Generator, rows [x, y, label] like the notebook)
+"""
+import time
+import numpy as np
+
+def labeled(inside, outside):
+    ''' Stack inside (label 1) and outside (label 0) points as rows [x, y, label]
+    INPUTS:
+        inside, outside: tuples (x, y) of coordinate arrays
+    OUTPUTS:
+        pts: array (n_inside + n_outside x 3), inside points first
+    '''
+    n = len(inside[0])
+    pts = np.empty((n + len(outside[0]), 3))
+    pts[:n, 0], pts[:n, 1], pts[:n, 2] = inside[0], inside[1], 1
+    pts[n:, 0], pts[n:, 1], pts[n:, 2] = outside[0], outside[1], 0
+    return pts
+
+def uniform_box(low, high, n, rng):
+    ''' n uniform points of the box [low, high] (scalars or (x, y) pairs) as coordinate arrays '''
+    low = np.broadcast_to(np.asarray(low, dtype=np.float64), (2,))
+    high = np.broadcast_to(np.asarray(high, dtype=np.float64), (2,))
+    coords = []
+    for lo, hi in zip(low, high):
+        c = rng.random(n)
+        c *= hi - lo
+        c += lo
+        coords.append(c)
+    return tuple(coords)
+
+def rectangles_sample(rects, n, rng):
+    ''' Direct sampling of n uniform points of a union of disjoint rectangles: the rectangle of each
+        point is drawn in proportion to its area (inverse sampling of the cumulative areas, one
+        comparison per rectangle), then the point inside it
+    INPUTS:
+        rects: array (r x 4) of rectangles (x0, y0, x1, y1)
+        n: number of points
+        rng: np.random.Generator
+    OUTPUTS:
+        x, y: coordinate arrays
+    '''
+    rects = np.asarray(rects, dtype=np.float64)
+    x0, y0 = rects[:, 0], rects[:, 1]
+    width, height = rects[:, 2] - x0, rects[:, 3] - y0
+    x, y = rng.random(n), rng.random(n)
+    if len(rects) == 1:
+        x *= width[0]
+        x += x0[0]
+        y *= height[0]
+        y += y0[0]
+        return x, y
+    cum_area = np.cumsum(width * height)
+    u = rng.random(n)
+    u *= cum_area[-1]
+    which = np.zeros(n, dtype=np.intp)
+    for c in cum_area[:-1]:
+        which += u >= c
+    x *= width[which]
+    x += x0[which]
+    y *= height[which]
+    y += y0[which]
+    return x, y
+
+def frame_rectangles(low, high, inner_low, inner_high):
+    ''' Rectangles (x0, y0, x1, y1) covering the box [low, high] out of the inner box (clipped to
+        the box), the empty ones removed '''
+    (x0, y0), (x1, y1) = [np.broadcast_to(np.asarray(v, dtype=np.float64), (2,)) for v in (low, high)]
+    a0, b0 = np.clip(np.broadcast_to(inner_low, (2,)), (x0, y0), (x1, y1))
+    a1, b1 = np.clip(np.broadcast_to(inner_high, (2,)), (x0, y0), (x1, y1))
+    rects = np.array([[x0, y0, x1, b0], [x0, b1, x1, y1], [x0, b0, a0, b1], [a1, b0, x1, b1]])
+    return rects[(rects[:, 2] > rects[:, 0]) & (rects[:, 3] > rects[:, 1])]
+
+def rejection_sample(accept, propose, n, rate=None):
+    ''' n points of the proposal distribution that satisfy accept, drawn in vectorized batches
+    INPUTS:
+        accept: function of the coordinate arrays (x, y) returning a boolean mask
+        propose: function of a number of points returning candidate coordinate arrays (x, y)
+        n: number of points
+        rate: expected acceptance rate (sizes the batches, estimated from the first batch if None)
+    OUTPUTS:
+        x, y: coordinate arrays
+    '''
+    x_out, y_out = np.empty(n), np.empty(n)
+    filled = 0
+    while filled < n:
+        missing = n - filled
+        batch = int(missing / rate * 1.02) + 256 if rate else max(missing, 1024)
+        x, y = propose(batch)
+        mask = accept(x, y)
+        if rate is None:
+            rate = max(np.count_nonzero(mask) / batch, 1e-3)
+        idx = np.flatnonzero(mask)[:missing]
+        x_out[filled:filled+len(idx)] = x[idx]
+        y_out[filled:filled+len(idx)] = y[idx]
+        filled += len(idx)
+    return x_out, y_out
+
+def points_in_polygon(x, y, vertices):
+    ''' Exact even-odd ray casting test of points against a polygon (loop over the edges,
+        vectorized over the points)
+    INPUTS:
+        x, y: coordinate arrays
+        vertices: polygon vertices in order (k x 2)
+    OUTPUTS:
+        inside: boolean mask
+    '''
+    vertices = np.asarray(vertices, dtype=np.float64)
+    inside = np.zeros(len(x), dtype=bool)
+    for (x0, y0), (x1, y1) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        if y0 == y1:
+            continue
+        crosses = (y0 > y) != (y1 > y)
+        # x coordinate where the horizontal line of the point cuts the edge
+        x_cross = y - y0
+        x_cross *= (x1 - x0) / (y1 - y0)
+        x_cross += x0
+        crosses &= x < x_cross
+        inside ^= crosses
+    return inside
+
+class PolygonMask:
+    ''' Point in polygon test accelerated by a grid over the sampling box: the cells that no edge
+        crosses are classified once by their center, so only the points of the cells along the
+        boundary need the exact ray casting test
+    INPUTS:
+        vertices: polygon vertices in order (k x 2)
+        low, high: limits of the box of the tested points
+        resolution: cells per side of the grid
+    '''
+    def __init__(self, vertices, low, high, resolution=512):
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        self.low = np.broadcast_to(np.asarray(low, dtype=np.float64), (2,)).copy()
+        self.high = np.broadcast_to(np.asarray(high, dtype=np.float64), (2,)).copy()
+        self.resolution = resolution
+        self.scale = resolution / (self.high - self.low)
+        cell = 1 / self.scale
+        # 0: outside, 1: inside (cell centers) and 2: boundary
+        centers = [self.low[d] + (np.arange(resolution) + 0.5) * cell[d] for d in range(2)]
+        cx, cy = np.meshgrid(centers[0], centers[1])
+        table = points_in_polygon(cx.ravel(), cy.ravel(), self.vertices).astype(np.uint8)
+        # edges sampled with a step shorter than the cells: a segment between two samples stays in
+        # the 3x3 neighborhood of the cell of its first sample
+        boundary = np.zeros((resolution + 2, resolution + 2), dtype=bool)
+        step = cell.min() / 2
+        for p0, p1 in zip(self.vertices, np.roll(self.vertices, -1, axis=0)):
+            t = np.linspace(0, 1, int(np.hypot(*(p1 - p0)) / step) + 2)[:, None]
+            ix, iy = self.cells(*(p0 + t * (p1 - p0)).T)
+            boundary[iy + 1, ix + 1] = True
+        dilated = np.zeros_like(boundary)
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                dilated[1:-1, 1:-1] |= boundary[1+di:resolution+1+di, 1+dj:resolution+1+dj]
+        table[dilated[1:-1, 1:-1].ravel()] = 2
+        # extra boundary column and row for the points on the upper limits of the box
+        self.table = np.pad(table.reshape(resolution, resolution), ((0, 1), (0, 1)), constant_values=2).ravel()
+
+    def cells(self, x, y):
+        ''' Grid cell (column, row) of each point, clipped to the grid '''
+        ix = np.clip(((x - self.low[0]) * self.scale[0]).astype(np.intp), 0, self.resolution - 1)
+        iy = np.clip(((y - self.low[1]) * self.scale[1]).astype(np.intp), 0, self.resolution - 1)
+        return ix, iy
+
+    def __call__(self, x, y):
+        ''' Boolean mask of the points (inside the box) that are inside the polygon '''
+        ix = x - self.low[0]
+        ix *= self.scale[0]
+        iy = y - self.low[1]
+        iy *= self.scale[1]
+        cell = iy.astype(np.intp)
+        cell *= self.resolution + 1
+        cell += ix.astype(np.intp)
+        code = self.table[cell]
+        edge = np.flatnonzero(code == 2)
+        inside = code == 1
+        inside[edge] = points_in_polygon(x[edge], y[edge], self.vertices)
+        return inside
+
+def polygon_area(vertices):
+    ''' Area of a simple polygon (shoelace formula) '''
+    x, y = np.asarray(vertices, dtype=np.float64).T
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+def polygon_sample(vertices, n, rng, low=None, high=None, outside=False, resolution=512):
+    ''' Uniform points inside a polygon, or outside it in a box, by rejection sampling with a PolygonMask
+    INPUTS:
+        vertices: polygon vertices in order (k x 2)
+        n: number of points
+        rng: np.random.Generator
+        low, high: limits of the candidate box (default: bounding box of the polygon)
+        outside: keep the points out of the polygon
+        resolution: cells per side of the mask grid
+    OUTPUTS:
+        x, y: coordinate arrays
+    '''
+    vertices = np.asarray(vertices, dtype=np.float64)
+    low = vertices.min(axis=0) if low is None else np.broadcast_to(np.asarray(low, dtype=np.float64), (2,))
+    high = vertices.max(axis=0) if high is None else np.broadcast_to(np.asarray(high, dtype=np.float64), (2,))
+    mask = PolygonMask(vertices, low, high, resolution)
+    # acceptance rate when the box contains the polygon, estimated from the first batch otherwise
+    rate = polygon_area(vertices) / np.prod(high - low)
+    contained = np.all(vertices >= low) and np.all(vertices <= high)
+    accept = (lambda x, y: ~mask(x, y)) if outside else mask
+    if outside:
+        rate = 1 - rate
+    return rejection_sample(accept, lambda m: uniform_box(low, high, m, rng), n,
+                            rate if contained and rate > 0 else None)
+
+def circle_points(radius, center, points=1200, rng=None):
+    ''' Inside points of a circle and outside points uniform in the square [0, 2*center]^2 out of the
+        circle, both by rejection sampling (the inside candidates come from the bounding square of
+        the circle: its pi/4 acceptance rate costs less than the cos/sin of the inverse sampling
+        radius*sqrt(u))
+    OUTPUTS:
+        pts: array (2*points x 3) of rows [x, y, label]
+    '''
+    if radius <= 0:
+        raise ValueError("the circle is empty (radius %r)" % radius)
+    if radius >= center * np.sqrt(2):
+        raise ValueError("the circle covers the box [0, 2*center]^2, there are no outside points")
+    rng = np.random.default_rng(rng)
+    def squared_radius(x, y):
+        dx, dy = x - center, y - center
+        dx *= dx
+        dy *= dy
+        dx += dy
+        return dx
+    inside = rejection_sample(lambda x, y: squared_radius(x, y) <= radius**2,
+                              lambda m: uniform_box(center - radius, center + radius, m, rng), points, np.pi / 4)
+    # exact acceptance rate when the circle is inside the square, estimated from the first batch otherwise
+    rate = 1 - np.pi * radius**2 / (2 * center)**2
+    outside = rejection_sample(lambda x, y: squared_radius(x, y) > radius**2,
+                               lambda m: uniform_box(0, 2 * center, m, rng), points,
+                               rate if radius <= center else None)
+    return labeled(inside, outside)
+
+def triangle_vertices(length, center):
+    ''' Vertices of the equilateral triangle of side length centered in (center, center) (notebook geometry) '''
+    h = np.sqrt(3) * length / 2
+    return np.array([[center - length/2, center - h/2], [center, center + h/2], [center + length/2, center - h/2]])
+
+def triangle_sample(vertices, n, rng):
+    ''' Direct sampling of n uniform points of a triangle (a, b, c): with p <= q the sorted pair of
+        two uniforms, (p, q - p, 1 - q) are uniform barycentric coordinates, so the point is
+        c + p*(a - b) + q*(b - c)
+    '''
+    a, b, c = np.asarray(vertices, dtype=np.float64)
+    u, v = rng.random(n), rng.random(n)
+    p, q = np.minimum(u, v), np.maximum(u, v, out=u)
+    coords = []
+    for d in range(2):
+        coord = p * (a[d] - b[d])
+        coord += c[d]
+        coord += q * (b[d] - c[d])
+        coords.append(coord)
+    return tuple(coords)
+
+def triangle_points(length, center, points=1200, rng=None):
+    ''' Inside points of an equilateral triangle (direct sampling) and outside points uniform in the
+        square [0, 2*center]^2 out of the triangle (polygon_sample)
+    OUTPUTS:
+        pts: array (2*points x 3) of rows [x, y, label]
+    '''
+    rng = np.random.default_rng(rng)
+    vertices = triangle_vertices(length, center)
+    inside = triangle_sample(vertices, points, rng)
+    outside = polygon_sample(vertices, points, rng, 0, 2 * center, outside=True)
+    return labeled(inside, outside)
+
+def square_points(length, center, points=1200, rng=None):
+    ''' Inside points of the square [center-length, center+length]^2 and outside points uniform in
+        the square [0, 2*center]^2 out of it, both by direct sampling (the outside region is the
+        union of four rectangles)
+    OUTPUTS:
+        pts: array (2*points x 3) of rows [x, y, label]
+    '''
+    a, b = center - length, center + length
+    if length <= 0:
+        raise ValueError("the square is empty (length %r)" % length)
+    frame = frame_rectangles(0, 2 * center, a, b)
+    if len(frame) == 0:
+        raise ValueError("the square covers the box [0, 2*center]^2, there are no outside points")
+    rng = np.random.default_rng(rng)
+    inside = rectangles_sample([[a, a, b, b]], points, rng)
+    outside = rectangles_sample(frame, points, rng)
+    return labeled(inside, outside)
+
+def polygon_points(vertices, points=1200, box=None, rng=None, resolution=512):
+    ''' Inside/outside points of an arbitrary (simple) polygon (polygon_sample)
+    INPUTS:
+        vertices: polygon vertices in order (k x 2)
+        points: points of each class
+        box: (low, high) limits of the outside points (default: bounding box of the polygon
+            enlarged by half of its size on every side)
+        rng: seed or np.random.Generator
+        resolution: cells per side of the mask grids
+    OUTPUTS:
+        pts: array (2*points x 3) of rows [x, y, label]
+    '''
+    rng = np.random.default_rng(rng)
+    vertices = np.asarray(vertices, dtype=np.float64)
+    vmin, vmax = vertices.min(axis=0), vertices.max(axis=0)
+    if box is None:
+        margin = (vmax - vmin) / 2
+        box = (vmin - margin, vmax + margin)
+    inside = polygon_sample(vertices, points, rng, resolution=resolution)
+    outside = polygon_sample(vertices, points, rng, box[0], box[1], outside=True, resolution=resolution)
+    return labeled(inside, outside)
+
+def benchmark(points=5000000, seed=0):
+    ''' Generation time of points inside + points outside of every shape (notebook sizes, and a
+        10 vertex star for the arbitrary polygons)
+    OUTPUTS:
+        times: dict shape -> seconds
+    '''
+    star = [[0, 3], [1, 1], [3, 1], [1.5, -0.5], [2, -3], [0, -1.5], [-2, -3], [-1.5, -0.5], [-3, 1], [-1, 1]]
+    shapes = {'circle': lambda: circle_points(90, 100, points, seed),
+              'triangle': lambda: triangle_points(80, 100, points, seed),
+              'square': lambda: square_points(80, 100, points, seed),
+              'star': lambda: polygon_points(star, points, rng=seed)}
+    times = {}
+    for name, generate in shapes.items():
+        start = time.perf_counter()
+        pts = generate()
+        times[name] = time.perf_counter() - start
+        print("%-8s %d labeled points: %0.3f s" % (name, len(pts), times[name]))
+    return times